@@ -0,0 +1,153 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterator
+
+from api.core.config import settings
+from api.core.logging import get_logger
+from api.core.metrics import track_breaker_state
+
+logger = get_logger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+# Responses that say the provider can't serve anyone right now (auth, credits,
+# quota, overload), as opposed to a problem with one particular request
+_PROVIDER_FAULT_STATUSES = {401, 402, 403, 408, 429}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose circuit breaker is open."""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"{name} is unavailable (circuit open, next probe in {retry_in:.0f}s)")
+        self.name = name
+        self.retry_in = retry_in
+
+
+def is_provider_fault(exc: BaseException) -> bool:
+    """Whether an error should count against the provider's breaker."""
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status is None or status >= 500 or status in _PROVIDER_FAULT_STATUSES
+
+
+class CircuitBreaker:
+    """
+    Per-provider circuit breaker with error-rate and latency thresholds.
+
+    Outcomes of the last ``window`` seconds are kept; once at least
+    ``min_calls`` of them are recorded and ``failure_ratio`` of those failed
+    or took longer than ``slow_call_seconds``, the breaker opens and
+    ``call()`` raises CircuitOpenError straight away. After ``open_seconds``
+    a single probe call is let through (half-open): success closes the
+    breaker, failure opens it for another ``open_seconds``.
+
+    Errors for which is_provider_fault() is false (a bad request, a missing
+    resource) and cancellations are not held against the provider.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        slow_call_seconds: float,
+        window: float = settings.BREAKER_WINDOW_SECONDS,
+        min_calls: int = settings.BREAKER_MIN_CALLS,
+        failure_ratio: float = settings.BREAKER_FAILURE_RATIO,
+        open_seconds: float = settings.BREAKER_OPEN_SECONDS,
+    ):
+        self.name = name
+        self.slow_call_seconds = slow_call_seconds
+        self.window = window
+        self.min_calls = max(1, min_calls)
+        self.failure_ratio = failure_ratio
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._outcomes: deque[tuple[float, bool]] = deque()
+        self._lock = threading.Lock()
+        track_breaker_state(name, lambda: self.state)
+
+    def _retry_in(self, now: float):
+        # None when a call made now would go through (possibly as the probe)
+        if self.state == CLOSED:
+            return None
+        if self.state == OPEN:
+            remaining = self._opened_at + self.open_seconds - now
+            return remaining if remaining > 0 else None
+        return 0.0 if self._probing else None
+
+    def check(self) -> None:
+        """Raises CircuitOpenError if a call made now would be rejected."""
+        with self._lock:
+            retry_in = self._retry_in(time.monotonic())
+        if retry_in is not None:
+            raise CircuitOpenError(self.name, retry_in)
+
+    @property
+    def closed(self) -> bool:
+        return self.state == CLOSED
+
+    def _acquire(self) -> bool:
+        # Returns whether this call is the half-open probe
+        with self._lock:
+            if self.state == CLOSED:
+                return False
+            now = time.monotonic()
+            retry_in = self._retry_in(now)
+            if retry_in is None:
+                self._transition(HALF_OPEN)
+                self._probing = True
+                return True
+        raise CircuitOpenError(self.name, retry_in)
+
+    def _record(self, failed: bool, probe: bool) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if probe:
+                self._probing = False
+                self._outcomes.clear()
+                if failed:
+                    self._open(now)
+                else:
+                    self._transition(CLOSED)
+                return
+            if self.state != CLOSED:
+                return  # A call that started before the breaker opened
+            self._outcomes.append((now, failed))
+            while self._outcomes and self._outcomes[0][0] < now - self.window:
+                self._outcomes.popleft()
+            failures = sum(1 for _, bad in self._outcomes if bad)
+            if len(self._outcomes) >= self.min_calls and failures >= self.failure_ratio * len(self._outcomes):
+                self._open(now)
+
+    def _open(self, now: float) -> None:
+        self._opened_at = now
+        self._outcomes.clear()
+        self._transition(OPEN)
+
+    def _transition(self, state: str) -> None:
+        if state != self.state:
+            logger.warning(f"Circuit breaker {self.name}: {self.state} -> {state}")
+            self.state = state
+
+    @contextmanager
+    def call(self) -> Iterator[None]:
+        """Guards one provider call; raises CircuitOpenError without running it when open."""
+        probe = self._acquire()
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self._record(is_provider_fault(e), probe)
+            raise
+        except BaseException:
+            # Cancelled: says nothing about the provider, but free the probe
+            if probe:
+                with self._lock:
+                    self._probing = False
+            raise
+        self._record(time.monotonic() - start > self.slow_call_seconds, probe)
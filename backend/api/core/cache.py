@@ -0,0 +1,200 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Optional, Union
+
+from api.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+CacheValue = Union[bytes, str, os.PathLike]
+
+
+def link_or_copy(src: Union[str, os.PathLike], dst: Union[str, os.PathLike]) -> None:
+    """Hard-links src to dst (replacing dst), falling back to a copy across filesystems."""
+    tmp = f"{dst}.{uuid.uuid4().hex}.tmp"
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    try:
+        os.replace(tmp, dst)
+    finally:
+        # rename() is a no-op when dst is already a link to the same file
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+
+
+class DiskCache:
+    """
+    Content-addressed on-disk cache with a size budget and LRU eviction.
+
+    Each entry is a directory of named files stored under ``root/<key[:2]>/<key>``.
+    Entries are assembled in a private temp directory and renamed into place, so
+    readers in any worker process only ever see complete entries. Reads bump the
+    entry directory's mtime, which is what LRU eviction orders by; that makes the
+    recency order shared between processes without any coordination file.
+
+    Size accounting is per process: each instance tracks what it has written since
+    its last full scan and rescans the whole cache once that estimate crosses
+    ``max_bytes``, evicting least-recently-used entries until it is back under
+    ``low_water`` of the budget.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        max_bytes: int,
+        ttl: Optional[float] = None,
+        name: str = "cache",
+        low_water: float = 0.9,
+    ):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.name = name
+        self.low_water = low_water
+        self._lock = threading.Lock()
+        self._approx_bytes: Optional[int] = None
+        self._hits = 0
+        self._misses = 0
+        self._writes = 0
+        self._evictions = 0
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """Stable SHA-256 key over any JSON-serializable parts."""
+        digest = hashlib.sha256()
+        for part in parts:
+            if not isinstance(part, (str, bytes)):
+                part = json.dumps(part, sort_keys=True, separators=(",", ":"))
+            if isinstance(part, str):
+                part = part.encode("utf-8")
+            digest.update(len(part).to_bytes(8, "little"))
+            digest.update(part)
+        return digest.hexdigest()
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def _is_expired(self, entry: str) -> bool:
+        if self.ttl is None:
+            return False
+        # Entry files keep their write time; only the directory mtime is bumped on reads
+        created = min(
+            (os.stat(os.path.join(entry, name)).st_mtime for name in os.listdir(entry)),
+            default=0.0,
+        )
+        return time.time() - created > self.ttl
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the entry directory for key, or None on a miss or expired entry."""
+        entry = self._entry_dir(key)
+        try:
+            if self._is_expired(entry):
+                shutil.rmtree(entry, ignore_errors=True)
+                raise FileNotFoundError(entry)
+            os.utime(entry)
+        except FileNotFoundError:
+            with self._lock:
+                self._misses += 1
+            return None
+
+        with self._lock:
+            self._hits += 1
+        return entry
+
+    def put(self, key: str, files: dict[str, CacheValue]) -> str:
+        """
+        Stores files under key and returns the entry directory.
+
+        Values are either raw bytes or paths to existing files, which are hard-linked
+        (or copied) into the entry. If another worker stored the same key first, its
+        entry wins and is returned.
+        """
+        entry = self._entry_dir(key)
+        tmp_root = os.path.join(self.root, ".tmp")
+        os.makedirs(tmp_root, exist_ok=True)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+
+        tmp = os.path.join(tmp_root, uuid.uuid4().hex)
+        os.makedirs(tmp)
+        size = 0
+        try:
+            for name, value in files.items():
+                path = os.path.join(tmp, name)
+                if isinstance(value, bytes):
+                    with open(path, "wb") as f:
+                        f.write(value)
+                else:
+                    link_or_copy(value, path)
+                size += os.path.getsize(path)
+            try:
+                os.rename(tmp, entry)
+            except OSError:
+                # Lost the race to another writer; their identical entry is kept
+                shutil.rmtree(tmp, ignore_errors=True)
+                return entry
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+        with self._lock:
+            self._writes += 1
+            if self._approx_bytes is not None:
+                self._approx_bytes += size
+            needs_scan = self._approx_bytes is None or self._approx_bytes > self.max_bytes
+        if needs_scan:
+            self.evict()
+        return entry
+
+    def _scan(self) -> list[tuple[float, int, str]]:
+        entries = []
+        if not os.path.isdir(self.root):
+            return entries
+        for shard in os.scandir(self.root):
+            if not shard.is_dir() or shard.name == ".tmp":
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                    entries.append((entry.stat().st_mtime, size, entry.path))
+                except FileNotFoundError:
+                    continue  # Evicted by another worker mid-scan
+        return entries
+
+    def evict(self) -> int:
+        """Removes least-recently-used entries until under the low-water mark."""
+        entries = self._scan()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        if total > self.max_bytes:
+            target = self.max_bytes * self.low_water
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+                removed += 1
+            logger.info(f"Evicted {removed} entries from {self.name} cache")
+
+        with self._lock:
+            self._approx_bytes = total
+            self._evictions += removed
+        return removed
+
+    def stats(self) -> dict[str, Union[int, float, None]]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": self._hits / lookups if lookups else None,
+                "writes": self._writes,
+                "evictions": self._evictions,
+                "approx_bytes": self._approx_bytes,
+            }
@@ -0,0 +1,40 @@
+import asyncio
+from typing import Awaitable, Callable, Iterable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+async def gather_or_cancel(
+    awaitables: Iterable[Awaitable[T]],
+    serial_while: Optional[Callable[[], bool]] = None,
+) -> list[T]:
+    """
+    Like asyncio.gather(), but the first failure cancels everything still running.
+
+    Results are in input order. The original exception is re-raised once the
+    other tasks have wound down, so no request outlives the call that needed it.
+
+    While ``serial_while()`` is true, awaitables are run one at a time, and
+    the rest are gathered as soon as it turns false. Callers pass "breaker
+    not closed", so a half-open probe isn't cancelled by siblings the breaker
+    turned away.
+    """
+    pending = list(awaitables)
+    results: list[T] = []
+    while serial_while is not None and pending and serial_while():
+        try:
+            results.append(await pending.pop(0))
+        except BaseException:
+            for awaitable in pending:
+                if asyncio.iscoroutine(awaitable):
+                    awaitable.close()
+            raise
+
+    tasks = [asyncio.ensure_future(awaitable) for awaitable in pending]
+    try:
+        return results + await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -7,6 +9,117 @@ class Settings(BaseSettings):
     APP_NAME: str = "Ballad AI Backend"
     DEBUG: bool = True
 
+    # Background job queue
+    JOB_WORKERS: int = 4
+    JOB_QUEUE_SIZE: int = 500
+    JOB_RETENTION: int = 1000
+    JOBS_DIR: str = "./jobs"
+    # Finished results, looked up by a hash of the input text and settings
+    RESULTS_DB: str = "./jobs/results.sqlite3"
+
+    # Provider endpoints; override to point the pipeline at local stand-ins
+    LEMONFOX_API_URL: str = "https://api.lemonfox.ai/v1/audio/speech"
+    VERTEX_API_BASE: str = "https://us-central1-aiplatform.googleapis.com"
+    ANTHROPIC_API_BASE: Optional[str] = None
+    # Fixed bearer token for Vertex instead of application default credentials
+    GOOGLE_ACCESS_TOKEN: Optional[str] = None
+
+    # Provider limits shared by all jobs: sustained requests per second (0
+    # disables), burst size and concurrent requests. Calls over the limit wait;
+    # the *_CONCURRENCY settings further down cap a single job's fan-out
+    LEMONFOX_RATE_PER_SECOND: float = 5.0
+    LEMONFOX_BURST: int = 10
+    LEMONFOX_MAX_CONCURRENCY: int = 8
+    VERTEX_RATE_PER_SECOND: float = 0.5
+    VERTEX_BURST: int = 4
+    VERTEX_MAX_CONCURRENCY: int = 4
+    ANTHROPIC_RATE_PER_SECOND: float = 0.5
+    ANTHROPIC_BURST: int = 4
+    ANTHROPIC_MAX_CONCURRENCY: int = 4
+
+    # Circuit breakers: a provider's breaker opens once BREAKER_FAILURE_RATIO of
+    # at least BREAKER_MIN_CALLS calls in the last BREAKER_WINDOW_SECONDS failed
+    # or were slower than its *_SLOW_CALL_SECONDS. Jobs then take the degraded
+    # path at once; after BREAKER_OPEN_SECONDS one probe call is let through
+    BREAKER_WINDOW_SECONDS: float = 120.0
+    BREAKER_MIN_CALLS: int = 4
+    BREAKER_FAILURE_RATIO: float = 0.5
+    BREAKER_OPEN_SECONDS: float = 30.0
+    LEMONFOX_SLOW_CALL_SECONDS: float = 120.0
+    VERTEX_SLOW_CALL_SECONDS: float = 120.0
+    ANTHROPIC_SLOW_CALL_SECONDS: float = 180.0
+
+    # Upload ingestion
+    MAX_UPLOAD_BYTES: int = 50 * 1024**2
+    UPLOAD_READ_BLOCK_BYTES: int = 1024**2
+    PDF_WORKERS: int = 2
+    PDF_PAGES_PER_TASK: int = 8
+
+    # LemonFox text-to-speech
+    TTS_CACHE_DIR: str = "./cache/tts"
+    TTS_CACHE_MAX_BYTES: int = 2 * 1024**3
+    TTS_SHARD_CHARS: int = 4000
+    TTS_CONCURRENCY: int = 4
+    TTS_REQUEST_TIMEOUT: float = 300.0
+    # Pads every shard but the last with silence to a multiple of this, so an
+    # edit that changes one shard's length a little doesn't shift the rest and
+    # more of an edited text's mix is reused. Off by default: the padding is
+    # an audible pause at each shard join
+    TTS_SHARD_ALIGN_SECONDS: float = 0.0
+
+    # Claude chunking
+    CHUNKING_MODEL: str = "anthropic/claude-3-5-sonnet-20240620"
+    CHUNK_CACHE_DIR: str = "./cache/chunks"
+    CHUNK_CACHE_MAX_BYTES: int = 256 * 1024**2
+    CHUNK_CACHE_TTL: float = 30 * 24 * 3600
+    CHUNK_WINDOW_LINES: int = 300
+    CHUNK_WINDOW_OVERLAP: int = 30
+    CHUNK_CONCURRENCY: int = 4
+    # Edited texts (previous_id uploads): an edited stretch of lines keeps the
+    # prompts of the chunks it replaced unless it grew by more than this many
+    # lines, in which case only that stretch is chunked again
+    INCREMENTAL_RECHUNK_LINES: int = 20
+
+    # Lyria music generation
+    MUSIC_CONCURRENCY: int = 4
+    MUSIC_MAX_RETRIES: int = 3
+    MUSIC_RETRY_BACKOFF: float = 1.0
+    MUSIC_CACHE_DIR: str = "./cache/music"
+    MUSIC_CACHE_MAX_BYTES: int = 5 * 1024**3
+
+    # Audio mixing: "numpy" (vectorized, in place) or "pydub" (reference overlay loop)
+    MIX_ENGINE: str = "numpy"
+    # Music clips decoded to PCM in the mix format, reused across mixes
+    PCM_CACHE_DIR: str = "./cache/pcm"
+    PCM_CACHE_MAX_BYTES: int = 2 * 1024**3
+
+    # HLS output (output_mode="hls")
+    HLS_SEGMENT_SECONDS: float = 6.0
+    HLS_BITRATE: str = "128k"
+
+    # Compressed output ("wav", "opus", "mp3" or "flac"); the mix is encoded in
+    # ENCODE_SEGMENT_SECONDS pieces on ENCODE_WORKERS processes (None: one per CPU)
+    AUDIO_FORMAT: str = "opus"
+    ENCODE_SEGMENT_SECONDS: float = 600.0
+    ENCODE_WORKERS: Optional[int] = None
+    # Encoded parts keyed by their PCM, so re-encoding an edited text only
+    # encodes the parts whose audio changed
+    ENCODE_CACHE_DIR: str = "./cache/encode"
+    ENCODE_CACHE_MAX_BYTES: int = 2 * 1024**3
+    KEEP_WAV_OUTPUT: bool = False
+
+    # Audio artifact serving
+    AUDIO_READ_CHUNK_BYTES: int = 1024 * 1024
+    AUDIO_CACHE_MAX_AGE: int = 86400
+    # Internal nginx location aliased to JOBS_DIR; when set, audio responses
+    # are handed to nginx via X-Accel-Redirect and sent with sendfile
+    AUDIO_ACCEL_REDIRECT_PREFIX: Optional[str] = None
+
+    # Google Cloud (Vertex AI) client
+    GOOGLE_TOKEN_REFRESH_MARGIN: float = 300.0
+    GOOGLE_HTTP_POOL_SIZE: int = 10
+    GOOGLE_REQUEST_TIMEOUT: float = 300.0
+
     model_config = SettingsConfigDict(
         env_file=".env",
         env_file_encoding="utf-8",
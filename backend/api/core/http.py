@@ -0,0 +1,44 @@
+import asyncio
+import weakref
+from typing import Any
+
+import httpx
+
+_registry: "weakref.WeakSet[LoopLocalClient]" = weakref.WeakSet()
+
+
+class LoopLocalClient:
+    """
+    One pooled httpx.AsyncClient per event loop.
+
+    httpx connection pools are bound to the loop they were opened on. The app
+    runs everything on uvicorn's loop, so in practice this is a single
+    long-lived client; scripts and benchmarks that call asyncio.run() more
+    than once get a fresh client per loop instead of a broken one.
+    """
+
+    def __init__(self, **client_kwargs: Any):
+        self.client_kwargs = client_kwargs
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+            weakref.WeakKeyDictionary()
+        )
+        _registry.add(self)
+
+    def get(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(**self.client_kwargs)
+            self._clients[loop] = client
+        return client
+
+    async def aclose(self) -> None:
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+
+async def close_http_clients() -> None:
+    """Closes every LoopLocalClient's client for the running loop (app shutdown)."""
+    for clients in list(_registry):
+        await clients.aclose()
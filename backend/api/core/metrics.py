@@ -0,0 +1,164 @@
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from api.core.cache import DiskCache
+from api.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+# Pipeline stages run from seconds (cached TTS) to many minutes (long mixes)
+STAGE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+PROVIDER_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+STAGE_DURATION = Histogram(
+    "ballad_stage_duration_seconds",
+    "Wall time of each pipeline stage.",
+    ["stage", "outcome"],
+    buckets=STAGE_BUCKETS,
+)
+STAGES_IN_PROGRESS = Gauge(
+    "ballad_stages_in_progress",
+    "Pipeline stages currently running.",
+    ["stage"],
+)
+PROVIDER_DURATION = Histogram(
+    "ballad_provider_request_duration_seconds",
+    "Latency of outbound provider calls.",
+    ["provider", "operation", "outcome"],
+    buckets=PROVIDER_BUCKETS,
+)
+PROVIDER_IN_FLIGHT = Gauge(
+    "ballad_provider_requests_in_flight",
+    "Outbound provider calls currently waiting on a response.",
+    ["provider"],
+)
+PROVIDER_BYTES = Counter(
+    "ballad_provider_bytes_total",
+    "Payload bytes exchanged with providers.",
+    ["provider", "direction"],
+)
+PROVIDER_QUEUE_DEPTH = Gauge(
+    "ballad_provider_queue_depth",
+    "Calls waiting on a provider's rate limit or concurrency cap.",
+    ["provider"],
+)
+PROVIDER_QUEUE_WAIT = Histogram(
+    "ballad_provider_queue_wait_seconds",
+    "Time calls spent waiting on a provider's rate limit or concurrency cap.",
+    ["provider"],
+    buckets=PROVIDER_BUCKETS,
+)
+PROVIDER_CIRCUIT_STATE = Gauge(
+    "ballad_provider_circuit_state",
+    "Provider circuit breaker state: 0 closed, 1 half-open, 2 open.",
+    ["provider"],
+)
+JOB_QUEUE_DEPTH = Gauge(
+    "ballad_job_queue_depth",
+    "Uploads waiting for a pipeline worker.",
+)
+
+
+class ProviderCall:
+    """Handle yielded by provider_call() for recording payload sizes."""
+
+    def __init__(self, provider: str):
+        self.provider = provider
+
+    def sent(self, n: int) -> None:
+        PROVIDER_BYTES.labels(self.provider, "sent").inc(n)
+
+    def received(self, n: int) -> None:
+        PROVIDER_BYTES.labels(self.provider, "received").inc(n)
+
+
+@contextmanager
+def stage_span(stage: str) -> Iterator[None]:
+    """Times one pipeline stage into STAGE_DURATION and tracks it as in progress."""
+    start = time.perf_counter()
+    outcome = "error"
+    STAGES_IN_PROGRESS.labels(stage).inc()
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGES_IN_PROGRESS.labels(stage).dec()
+        STAGE_DURATION.labels(stage, outcome).observe(elapsed)
+        logger.debug(f"span stage={stage} outcome={outcome} seconds={elapsed:.3f}")
+
+
+@contextmanager
+def provider_call(provider: str, operation: str) -> Iterator[ProviderCall]:
+    """Times one outbound call into PROVIDER_DURATION and tracks it as in flight."""
+    start = time.perf_counter()
+    outcome = "error"
+    PROVIDER_IN_FLIGHT.labels(provider).inc()
+    try:
+        yield ProviderCall(provider)
+        outcome = "ok"
+    finally:
+        elapsed = time.perf_counter() - start
+        PROVIDER_IN_FLIGHT.labels(provider).dec()
+        PROVIDER_DURATION.labels(provider, operation, outcome).observe(elapsed)
+        logger.debug(
+            f"span provider={provider} operation={operation} outcome={outcome} seconds={elapsed:.3f}"
+        )
+
+
+class _CacheCollector:
+    """Exports DiskCache.stats() of every registered cache at scrape time."""
+
+    def __init__(self):
+        self.caches: dict[str, DiskCache] = {}
+
+    def collect(self):
+        lookups = CounterMetricFamily(
+            "ballad_cache_lookups", "Cache lookups by result.", labels=["cache", "result"]
+        )
+        hit_ratio = GaugeMetricFamily(
+            "ballad_cache_hit_ratio", "Share of lookups served from the cache.", labels=["cache"]
+        )
+        size = GaugeMetricFamily(
+            "ballad_cache_bytes", "Approximate size of the cache on disk.", labels=["cache"]
+        )
+        for name, cache in self.caches.items():
+            stats = cache.stats()
+            lookups.add_metric([name, "hit"], stats["hits"])
+            lookups.add_metric([name, "miss"], stats["misses"])
+            if stats["hit_ratio"] is not None:
+                hit_ratio.add_metric([name], stats["hit_ratio"])
+            if stats["approx_bytes"] is not None:
+                size.add_metric([name], stats["approx_bytes"])
+        yield lookups
+        yield hit_ratio
+        yield size
+
+
+_cache_collector = _CacheCollector()
+REGISTRY.register(_cache_collector)
+
+
+def register_cache(cache: DiskCache) -> DiskCache:
+    """Adds a cache's hit/miss counts and size to the /metrics output."""
+    _cache_collector.caches[cache.name] = cache
+    return cache
+
+
+def track_queue_depth(depth: Callable[[], int]) -> None:
+    JOB_QUEUE_DEPTH.set_function(depth)
+
+
+def track_provider_queue(provider: str, depth: Callable[[], int]) -> None:
+    PROVIDER_QUEUE_DEPTH.labels(provider).set_function(depth)
+
+
+_CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+def track_breaker_state(provider: str, state: Callable[[], str]) -> None:
+    PROVIDER_CIRCUIT_STATE.labels(provider).set_function(lambda: _CIRCUIT_STATES[state()])
@@ -0,0 +1,88 @@
+import asyncio
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from api.core.metrics import PROVIDER_QUEUE_WAIT, track_provider_queue
+
+
+class ProviderLimiter:
+    """
+    Token bucket plus concurrency cap shared by every call to one provider.
+
+    Callers wait in ``slot()`` for one of ``max_concurrency`` slots, then for
+    a token; tokens refill at ``rate`` per second up to ``burst``. Waiting is
+    the backpressure: a burst of uploads queues here instead of fanning out
+    into more requests than the provider accepts and retrying the 429s.
+
+    A rate of 0 disables the token bucket and keeps only the concurrency cap.
+    Tokens are reserved in arrival order, so waiters are served FIFO; a
+    caller cancelled while waiting hands its token back.
+    """
+
+    def __init__(self, name: str, rate: float, burst: int, max_concurrency: int):
+        self.name = name
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_concurrency = max(1, max_concurrency)
+        self.waiting = 0
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        # asyncio primitives are bound to one loop; scripts may run several
+        self._slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+            weakref.WeakKeyDictionary()
+        )
+        track_provider_queue(name, lambda: self.waiting)
+
+    def _reserve(self) -> float:
+        """Takes a token and returns how long to wait until it is due."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def _refund(self) -> None:
+        if self.rate > 0:
+            with self._lock:
+                self._tokens = min(self.burst, self._tokens + 1)
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._slots.get(loop)
+        if semaphore is None:
+            semaphore = self._slots[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Holds one concurrency slot and one token for the duration of a request."""
+        semaphore = self._semaphore()
+        start = time.perf_counter()
+        self.waiting += 1
+        try:
+            await semaphore.acquire()
+            try:
+                delay = self._reserve()
+                if delay > 0:
+                    try:
+                        await asyncio.sleep(delay)
+                    except asyncio.CancelledError:
+                        self._refund()
+                        raise
+            except BaseException:
+                semaphore.release()
+                raise
+        finally:
+            self.waiting -= 1
+        PROVIDER_QUEUE_WAIT.labels(self.name).observe(time.perf_counter() - start)
+        try:
+            yield
+        finally:
+            semaphore.release()
@@ -0,0 +1,74 @@
+import os
+from typing import Mapping, Optional
+from urllib.parse import quote
+
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import FileResponse, Response
+from starlette.types import Receive, Scope, Send
+
+from api.core.config import settings
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match uses weak comparison: W/"x" matches "x"
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+class ArtifactResponse(FileResponse):
+    """
+    FileResponse for large generated files such as a job's audio.
+
+    Starlette already answers Range and If-Range requests (so a player can
+    seek without downloading everything before the seek point) and derives an
+    ETag from the file's mtime and size. This adds 304 Not Modified for a
+    matching If-None-Match and reads the file in larger blocks.
+    """
+
+    chunk_size = settings.AUDIO_READ_CHUNK_BYTES
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if self.stat_result is None:
+            self.stat_result = await run_in_threadpool(os.stat, self.path)
+            self.set_stat_headers(self.stat_result)
+
+        if_none_match = next(
+            (value.decode("latin-1") for name, value in scope["headers"] if name == b"if-none-match"),
+            None,
+        )
+        if if_none_match is not None and _etag_matches(if_none_match, self.headers["etag"]):
+            kept = ("etag", "cache-control", "last-modified", "vary")
+            response = Response(
+                status_code=304,
+                headers={name: self.headers[name] for name in kept if name in self.headers},
+            )
+            await response(scope, receive, send)
+            return
+
+        await super().__call__(scope, receive, send)
+
+
+def artifact_response(
+    path: str,
+    media_type: str,
+    headers: Optional[Mapping[str, str]] = None,
+    root: str = settings.JOBS_DIR,
+) -> Response:
+    """
+    Serves a file under root, through nginx when AUDIO_ACCEL_REDIRECT_PREFIX is set.
+
+    With the prefix set the body is left to nginx (X-Accel-Redirect), which
+    sends it with sendfile and handles Range and conditional requests itself;
+    otherwise the file is streamed by ArtifactResponse.
+    """
+    prefix = settings.AUDIO_ACCEL_REDIRECT_PREFIX
+    relative = os.path.relpath(os.path.abspath(path), os.path.abspath(root))
+    if prefix and not relative.startswith(os.pardir):
+        return Response(
+            media_type=media_type,
+            headers={
+                **(headers or {}),
+                "X-Accel-Redirect": f"{prefix.rstrip('/')}/{quote(relative)}",
+            },
+        )
+    return ArtifactResponse(path, media_type=media_type, headers=headers)
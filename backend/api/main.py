@@ -1,8 +1,16 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 from api.core.config import settings
+from api.core.http import close_http_clients
 from api.core.logging import get_logger, setup_logging
+from api.core.middleware import BodySizeLimitMiddleware
+from api.src.texts.encode import ffmpeg_available, shutdown_encode_pool
+from api.src.texts.ingest import shutdown_pdf_pool
+from api.src.texts.jobs import job_manager
 from api.src.texts.routes import router as texts_router
 
 # Set up logging configuration
@@ -11,11 +19,36 @@ setup_logging()
 # Set up logger for this module
 logger = get_logger(__name__)
 
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Compressed output needs ffmpeg; without it uploads fall back to WAV
+    # instead of every job failing at the encoding stage
+    if settings.AUDIO_FORMAT != "wav" and not ffmpeg_available():
+        logger.warning(
+            f"ffmpeg not found: AUDIO_FORMAT={settings.AUDIO_FORMAT} is unavailable,"
+            " uploads will be served as wav. Install ffmpeg to enable compressed output"
+        )
+
+    # Start the background pipeline workers for the lifetime of the app
+    await job_manager.start()
+    yield
+    await job_manager.stop()
+    shutdown_pdf_pool()
+    shutdown_encode_pool()
+    await close_http_clients()
+
+
 app = FastAPI(
     title=settings.APP_NAME,
     debug=settings.DEBUG,
+    lifespan=lifespan,
 )
 
+# Refuse oversized uploads before they are spooled (added first so CORS wraps it)
+app.add_middleware(BodySizeLimitMiddleware, max_bytes=settings.MAX_UPLOAD_BYTES)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -32,3 +65,9 @@ app.include_router(texts_router)
 @app.get("/health")
 async def health_check():
     return {"status": "ok", "message": "Ballad AI Backend is running"}
+
+
+@app.get("/metrics")
+async def metrics():
+    # Prometheus text exposition: stage/provider latency, in-flight calls, caches
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -1,10 +1,19 @@
+import asyncio
 import json
 import os
+import re
 import litellm
-from litellm import completion 
+from litellm import acompletion
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
+from api.core.breaker import CircuitBreaker
+from api.core.cache import DiskCache
+from api.core.concurrency import gather_or_cancel
+from api.core.config import settings
+from api.core.metrics import provider_call, register_cache
+from api.core.ratelimit import ProviderLimiter
+
 # Set Anthropic API key
 load_dotenv()
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
@@ -49,10 +58,50 @@ class ChunksList(BaseModel):
 
 litellm.enable_json_schema_validation = True
 
-def generate_prompt_chunks(formatted_text: str):
-    if not formatted_text:
-        return {"chunks": []}
-    
+# Results are keyed on everything that shapes the model output, so editing the
+# prompt, the schema or the model invalidates old entries automatically
+chunk_cache = register_cache(DiskCache(
+    settings.CHUNK_CACHE_DIR,
+    max_bytes=settings.CHUNK_CACHE_MAX_BYTES,
+    ttl=settings.CHUNK_CACHE_TTL,
+    name="chunks",
+))
+
+anthropic_limiter = ProviderLimiter(
+    "anthropic",
+    rate=settings.ANTHROPIC_RATE_PER_SECOND,
+    burst=settings.ANTHROPIC_BURST,
+    max_concurrency=settings.ANTHROPIC_MAX_CONCURRENCY,
+)
+anthropic_breaker = CircuitBreaker("anthropic", slow_call_seconds=settings.ANTHROPIC_SLOW_CALL_SECONDS)
+
+
+def chunk_cache_key(formatted_text: str, model: str) -> str:
+    return chunk_cache.make_key(
+        formatted_text,
+        model,
+        INSTRUCTION,
+        ChunksList.model_json_schema(),
+    )
+
+
+def _read_cached_chunks(cache_key: str):
+    entry = chunk_cache.get(cache_key)
+    if entry is None:
+        return None
+    try:
+        with open(os.path.join(entry, "chunks.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None  # Evicted between lookup and read
+
+
+async def _chunk_text(formatted_text: str, model: str):
+    cache_key = chunk_cache_key(formatted_text, model)
+    cached = await asyncio.to_thread(_read_cached_chunks, cache_key)
+    if cached is not None:
+        return cached
+
     book = f"""
     Raw book text:
     ```
@@ -65,11 +114,153 @@ def generate_prompt_chunks(formatted_text: str):
         {"role": "user", "content": book},
     ]
 
-    resp = completion(
-        model="anthropic/claude-3-5-sonnet-20240620",
-        messages=messages,
-        response_format=ChunksList,
+    anthropic_breaker.check()
+    async with anthropic_limiter.slot():
+        with anthropic_breaker.call(), provider_call("anthropic", "messages") as call:
+            call.sent(len(INSTRUCTION.encode("utf-8")) + len(book.encode("utf-8")))
+            resp = await acompletion(
+                model=model,
+                messages=messages,
+                response_format=ChunksList,
+                api_base=settings.ANTHROPIC_API_BASE,
+            )
+            content = resp.choices[0].message.content
+            call.received(len(content.encode("utf-8")))
+
+    output = json.loads(content)
+    print(json.dumps(output, indent=2))
+
+    await asyncio.to_thread(chunk_cache.put, cache_key, {"chunks.json": json.dumps(output).encode("utf-8")})
+    return output
+
+
+_LINE_PREFIX = re.compile(r"^\[Line (\d+)\]")
+
+
+def _line_number(annotated_line: str) -> int:
+    return int(_LINE_PREFIX.match(annotated_line).group(1))
+
+
+def split_annotated_windows(formatted_text: str, window_lines: int, overlap_lines: int) -> list[str]:
+    """Splits [Line N]-annotated text into windows of window_lines sharing overlap_lines."""
+    lines = [line for line in formatted_text.splitlines() if _LINE_PREFIX.match(line)]
+    step = max(1, window_lines - overlap_lines)
+    windows = []
+    for start in range(0, len(lines), step):
+        windows.append("\n".join(lines[start:start + window_lines]))
+        if start + window_lines >= len(lines):
+            break
+    return windows
+
+
+def _choose_cut(overlap_start: int, overlap_end: int, next_window_chunks: list[dict]) -> int:
+    """
+    Picks the first line owned by the later of two overlapping windows.
+
+    A chunk boundary the later window placed inside the overlap is preferred,
+    since that window saw context on both sides of it; the one closest to the
+    middle of the overlap wins. Without one, the overlap is split in half.
+    """
+    middle = (overlap_start + overlap_end + 1) // 2
+    candidates = [
+        chunk["starting_line_number"] for chunk in next_window_chunks
+        if overlap_start < chunk["starting_line_number"] <= overlap_end
+    ]
+    if not candidates:
+        return middle
+    return min(candidates, key=lambda line: abs(line - middle))
+
+
+def normalize_chunks(chunks: list[dict], first_line: int, last_line: int) -> list[dict]:
+    """Makes chunks non-overlapping and contiguous over [first_line, last_line]."""
+    normalized = []
+    for chunk in sorted(chunks, key=lambda c: (c["starting_line_number"], c["ending_line_number"])):
+        chunk = dict(chunk)
+        floor = normalized[-1]["ending_line_number"] + 1 if normalized else first_line
+        chunk["starting_line_number"] = max(chunk["starting_line_number"], floor)
+        chunk["ending_line_number"] = min(chunk["ending_line_number"], last_line)
+        if chunk["ending_line_number"] < chunk["starting_line_number"]:
+            continue
+        if normalized:
+            # Close any gap by extending the previous chunk
+            normalized[-1]["ending_line_number"] = chunk["starting_line_number"] - 1
+        normalized.append(chunk)
+
+    if normalized:
+        normalized[0]["starting_line_number"] = first_line
+        normalized[-1]["ending_line_number"] = last_line
+    return normalized
+
+
+def reconcile_window_chunks(windows: list[str], window_chunks: list[list[dict]]) -> list[dict]:
+    """
+    Merges per-window chunk lists into one non-overlapping, contiguous list.
+
+    Each pair of adjacent windows is split at a cut line inside their overlap;
+    every window keeps only its chunks between the cuts on either side of it,
+    clipped to that range.
+    """
+    bounds = []
+    for window in windows:
+        lines = window.splitlines()
+        bounds.append((_line_number(lines[0]), _line_number(lines[-1])))
+
+    cuts = [bounds[0][0]]
+    for k in range(len(windows) - 1):
+        overlap_start, overlap_end = bounds[k + 1][0], bounds[k][1]
+        cuts.append(_choose_cut(overlap_start, overlap_end, window_chunks[k + 1]))
+    cuts.append(bounds[-1][1] + 1)
+
+    merged = []
+    for k, chunks in enumerate(window_chunks):
+        owned = [
+            chunk for chunk in chunks
+            if chunk["ending_line_number"] >= cuts[k] and chunk["starting_line_number"] < cuts[k + 1]
+        ]
+        merged.extend(normalize_chunks(owned, cuts[k], cuts[k + 1] - 1))
+
+    return normalize_chunks(merged, bounds[0][0], bounds[-1][1])
+
+
+async def generate_prompt_chunks(
+    formatted_text: str,
+    model: str = settings.CHUNKING_MODEL,
+    window_lines: int = settings.CHUNK_WINDOW_LINES,
+    overlap_lines: int = settings.CHUNK_WINDOW_OVERLAP,
+    max_concurrency: int = settings.CHUNK_CONCURRENCY,
+):
+    """
+    Splits [Line N]-annotated text into thematic chunks with music annotations.
+
+    Texts longer than window_lines are chunked map-reduce style: overlapping
+    windows are sent to the model in parallel (each through the chunk cache)
+    and their boundary chunks reconciled, so a full novel takes about as long
+    as a single window. The result is always non-overlapping and contiguous in
+    line numbers.
+    """
+    windows = split_annotated_windows(formatted_text, window_lines, overlap_lines)
+    if not windows:
+        return {"chunks": []}
+
+    if len(windows) == 1:
+        # Same clean-up as the windowed path: the model's gaps, overlaps and
+        # out-of-range line numbers don't reach the music stage
+        lines = windows[0].splitlines()
+        chunks = (await _chunk_text(formatted_text, model))["chunks"]
+        normalized = normalize_chunks(chunks, _line_number(lines[0]), _line_number(lines[-1]))
+        return ChunksList.model_validate({"chunks": normalized}).model_dump()
+
+    print(f"Chunking {len(windows)} windows of up to {window_lines} lines")
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def chunk_window(window: str):
+        async with semaphore:
+            return (await _chunk_text(window, model))["chunks"]
+
+    window_chunks = await gather_or_cancel(
+        (chunk_window(window) for window in windows),
+        serial_while=lambda: not anthropic_breaker.closed,
     )
 
-    output = json.loads(resp.choices[0].message.content)
-    print(json.dumps(output, indent=2))
\ No newline at end of file
+    merged = reconcile_window_chunks(windows, window_chunks)
+    return ChunksList.model_validate({"chunks": merged}).model_dump()
@@ -0,0 +1,225 @@
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+import wave
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+from pydub import AudioSegment
+
+from api.core.cache import DiskCache, link_or_copy
+from api.core.config import settings
+from api.core.metrics import register_cache
+
+WAV_MEDIA_TYPE = "audio/wav"
+
+
+@dataclass(frozen=True)
+class Codec:
+    extension: str
+    media_type: str
+    encoder: str
+    container: str
+    default_bitrate: Optional[str] = None
+    # Whether independently encoded parts can be joined by stream copy. FLAC
+    # frames are numbered from the start of the stream, and every MP3 part
+    # adds ~25 ms of encoder delay and padding that would push the audio out
+    # of sync with the word timings; Opus parts only add a few ms of pre-skip
+    splittable: bool = True
+
+
+# Compressed formats for the final mix; "wav" keeps the mixer's output as is
+CODECS = {
+    "opus": Codec("opus", "audio/ogg", "libopus", "ogg", "64k"),
+    "mp3": Codec("mp3", "audio/mpeg", "libmp3lame", "mp3", "128k", splittable=False),
+    "flac": Codec("flac", "audio/flac", "flac", "flac", splittable=False),
+}
+AUDIO_FORMATS = ("wav", *CODECS)
+
+_encode_pool: Optional[ProcessPoolExecutor] = None
+_ffmpeg_found: Optional[bool] = None
+
+# Encoded parts keyed by their PCM and encoder arguments. Parts are cut at
+# fixed offsets, so when an edited text leaves the audio after the edit where
+# it was, only the parts around the edit are encoded again
+encode_cache = register_cache(DiskCache(
+    settings.ENCODE_CACHE_DIR,
+    max_bytes=settings.ENCODE_CACHE_MAX_BYTES,
+    name="encode",
+))
+
+
+def audio_extension(audio_format: str) -> str:
+    return CODECS[audio_format].extension if audio_format in CODECS else "wav"
+
+
+def effective_bitrate(audio_format: str, bitrate: Optional[str]) -> Optional[str]:
+    """The bitrate an encode will use: None for lossless formats, else bitrate or the default."""
+    codec = CODECS.get(audio_format)
+    if codec is None or codec.default_bitrate is None:
+        return None
+    return bitrate or codec.default_bitrate
+
+
+def media_type_for(filename: str) -> str:
+    extension = os.path.splitext(filename)[1].lstrip(".")
+    for codec in CODECS.values():
+        if codec.extension == extension:
+            return codec.media_type
+    return WAV_MEDIA_TYPE
+
+
+def ffmpeg_available() -> bool:
+    """Whether the ffmpeg binary pydub found (or defaulted to) is on the PATH."""
+    global _ffmpeg_found
+    if _ffmpeg_found is None:
+        _ffmpeg_found = shutil.which(AudioSegment.converter) is not None
+    return _ffmpeg_found
+
+
+def usable_audio_format(audio_format: str) -> str:
+    """audio_format, or "wav" if it is a compressed format and ffmpeg is missing."""
+    if audio_format in CODECS and not ffmpeg_available():
+        return "wav"
+    return audio_format
+
+
+def _ffmpeg(*args: str) -> None:
+    result = subprocess.run(
+        [AudioSegment.converter, "-nostdin", "-hide_banner", "-loglevel", "error", "-y", *args],
+        capture_output=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.decode(errors='replace').strip()}")
+
+
+def _part_key(
+    wav_path: str, first: int, frames: Optional[int], args: list[str], block_frames: int = 1 << 16
+) -> str:
+    # Hash of the part's PCM and format; frames None reads to the end
+    digest = hashlib.blake2b(digest_size=32)
+    with wave.open(wav_path, "rb") as f:
+        digest.update(repr((f.getnchannels(), f.getsampwidth(), f.getframerate())).encode())
+        frame_bytes = f.getnchannels() * f.getsampwidth()
+        f.setpos(first)
+        remaining = f.getnframes() - first if frames is None else frames
+        while remaining > 0:
+            block = f.readframes(min(block_frames, remaining))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block) // frame_bytes
+    return encode_cache.make_key(digest.hexdigest(), args)
+
+
+def _encode_part(wav_path: str, first: int, frames: Optional[int], frame_rate: int, path: str,
+                 args: list[str]) -> str:
+    # Runs in a worker process. Seeking in PCM WAV is sample exact, so parts
+    # line up without overlap; the last part (frames None) runs to the end
+    key = _part_key(wav_path, first, frames, args)
+    asset = f"part{os.path.splitext(path)[1]}"
+    entry = encode_cache.get(key)
+    if entry is not None:
+        try:
+            link_or_copy(os.path.join(entry, asset), path)
+            return path
+        except FileNotFoundError:
+            pass  # Evicted between lookup and read; encode again
+
+    limit = ["-t", f"{frames / frame_rate:.6f}"] if frames is not None else []
+    _ffmpeg("-ss", f"{first / frame_rate:.6f}", "-i", wav_path, *limit, *args, path)
+    encode_cache.put(key, {asset: path})
+    return path
+
+
+def _wav_length(wav_path: str) -> tuple[int, int]:
+    with wave.open(wav_path, "rb") as f:
+        return f.getnframes(), f.getframerate()
+
+
+def _join_parts(parts: list[str], parts_dir: str, codec: Codec, joined: str) -> None:
+    list_path = os.path.join(parts_dir, "parts.txt")
+    with open(list_path, "w") as f:
+        for part in parts:
+            escaped = part.replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    _ffmpeg("-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", "-f", codec.container, joined)
+
+
+def _get_encode_pool() -> ProcessPoolExecutor:
+    global _encode_pool
+    if _encode_pool is None:
+        _encode_pool = ProcessPoolExecutor(
+            max_workers=settings.ENCODE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _encode_pool
+
+
+def shutdown_encode_pool():
+    global _encode_pool
+    if _encode_pool is not None:
+        _encode_pool.shutdown(wait=False, cancel_futures=True)
+        _encode_pool = None
+
+
+async def encode_audio(
+    wav_path: str,
+    audio_format: str,
+    bitrate: Optional[str] = None,
+    segment_seconds: float = settings.ENCODE_SEGMENT_SECONDS,
+) -> str:
+    """
+    Encodes a WAV file next to itself in audio_format and returns the new path.
+
+    For splittable codecs the audio is cut into segment_seconds parts that
+    are encoded in parallel on the encoder process pool, then joined into one
+    file by stream copy (no re-encode); other codecs are encoded in one piece
+    on the pool, alongside other jobs' parts. Parts are served from the
+    encode cache when their audio was encoded before with the same
+    arguments. Only bookkeeping runs on the event loop. bitrate applies to
+    the lossy codecs and defaults to the codec's default_bitrate.
+    """
+    codec = CODECS[audio_format]
+    output_path = f"{os.path.splitext(wav_path)[0]}.{codec.extension}"
+    frames, frame_rate = await asyncio.to_thread(_wav_length, wav_path)
+
+    args = ["-c:a", codec.encoder, "-f", codec.container]
+    if codec.default_bitrate is not None:
+        args += ["-b:a", bitrate or codec.default_bitrate]
+
+    segment_frames = max(1, int(segment_seconds * frame_rate)) if codec.splittable else max(frames, 1)
+    starts = list(range(0, frames, segment_frames)) or [0]
+    parts_dir = tempfile.mkdtemp(prefix=".encode-", dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        loop = asyncio.get_running_loop()
+        pool = _get_encode_pool()
+        tasks = [
+            loop.run_in_executor(
+                pool,
+                _encode_part,
+                wav_path,
+                first,
+                segment_frames if i < len(starts) - 1 else None,
+                frame_rate,
+                os.path.join(parts_dir, f"part_{i:05d}.{codec.extension}"),
+                args,
+            )
+            for i, first in enumerate(starts)
+        ]
+        parts = await asyncio.gather(*tasks)
+
+        joined = os.path.join(parts_dir, f"joined.{codec.extension}")
+        if len(parts) == 1:
+            joined = parts[0]
+        else:
+            await asyncio.to_thread(_join_parts, parts, parts_dir, codec, joined)
+        os.replace(joined, output_path)
+    finally:
+        await asyncio.to_thread(shutil.rmtree, parts_dir, ignore_errors=True)
+    return output_path
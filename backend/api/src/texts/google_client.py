@@ -0,0 +1,150 @@
+import asyncio
+import datetime
+import threading
+from typing import Optional
+
+import google.auth
+import google.auth.transport.requests
+import httpx
+import requests
+
+from api.core.breaker import CircuitBreaker
+from api.core.config import settings
+from api.core.http import LoopLocalClient
+from api.core.logging import get_logger
+from api.core.metrics import provider_call
+from api.core.ratelimit import ProviderLimiter
+
+logger = get_logger(__name__)
+
+CLOUD_PLATFORM_SCOPE = "https://www.googleapis.com/auth/cloud-platform"
+
+
+class GoogleApiClient:
+    """
+    Long-lived client for Google Cloud REST endpoints such as Vertex AI.
+
+    Application default credentials are loaded once and their access token is
+    reused until it is within ``refresh_margin`` seconds of expiring. Refreshes
+    happen under a lock, so concurrent callers trigger at most one token
+    exchange, which runs on a worker thread since google-auth is blocking.
+    Requests go through a pooled keep-alive async client instead of a new TLS
+    connection per call, and wait on ``limiter`` (the Vertex rate limit and
+    concurrency cap) before going out. While ``breaker`` is open they fail
+    with CircuitOpenError without being sent.
+
+    With ``static_token`` set, that bearer token is used as is and no
+    credentials are loaded (for emulators and local stand-ins).
+    """
+
+    def __init__(
+        self,
+        refresh_margin: float = settings.GOOGLE_TOKEN_REFRESH_MARGIN,
+        pool_size: int = settings.GOOGLE_HTTP_POOL_SIZE,
+        timeout: float = settings.GOOGLE_REQUEST_TIMEOUT,
+        static_token: Optional[str] = settings.GOOGLE_ACCESS_TOKEN,
+        limiter: Optional[ProviderLimiter] = None,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.refresh_margin = datetime.timedelta(seconds=refresh_margin)
+        self.timeout = timeout
+        self.static_token = static_token
+        self._lock = threading.Lock()
+        self._credentials = None
+        self._token_refreshes = 0
+        self._token_reuses = 0
+        self.limiter = limiter or ProviderLimiter(
+            "vertex",
+            rate=settings.VERTEX_RATE_PER_SECOND,
+            burst=settings.VERTEX_BURST,
+            max_concurrency=settings.VERTEX_MAX_CONCURRENCY,
+        )
+        self.breaker = breaker or CircuitBreaker("vertex", slow_call_seconds=settings.VERTEX_SLOW_CALL_SECONDS)
+
+        # Only used by google-auth for token exchanges
+        self.session = requests.Session()
+        self.http = LoopLocalClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+
+    def _needs_refresh(self) -> bool:
+        creds = self._credentials
+        if not creds.token:
+            return True
+        if creds.expiry is None:
+            return False
+        # google-auth reports expiry as a naive UTC datetime
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        return creds.expiry - now <= self.refresh_margin
+
+    def access_token(self, force_refresh: bool = False) -> str:
+        """Returns a valid access token, refreshing it only when close to expiry."""
+        with self._lock:
+            if self.static_token:
+                self._token_reuses += 1
+                return self.static_token
+
+            if self._credentials is None:
+                self._credentials, _ = google.auth.default(scopes=[CLOUD_PLATFORM_SCOPE])
+
+            if force_refresh or self._needs_refresh():
+                auth_req = google.auth.transport.requests.Request(session=self.session)
+                self._credentials.refresh(auth_req)
+                self._token_refreshes += 1
+                logger.debug(f"Refreshed Google access token (expires {self._credentials.expiry})")
+            else:
+                self._token_reuses += 1
+
+            return self._credentials.token
+
+    async def _access_token_async(self, force_refresh: bool = False) -> str:
+        # A still-valid token is read without the thread lock, which would
+        # block the event loop while a refresh holds it. Only a (blocking)
+        # token exchange hops to a thread and takes the lock there
+        if not force_refresh:
+            if self.static_token:
+                self._token_reuses += 1
+                return self.static_token
+            creds = self._credentials
+            if creds is not None:
+                token = creds.token
+                if token and not self._needs_refresh():
+                    self._token_reuses += 1
+                    return token
+        return await asyncio.to_thread(self.access_token, force_refresh)
+
+    async def post(self, api_endpoint: str, data: Optional[dict] = None) -> dict:
+        """POSTs JSON to a Google API endpoint and returns the decoded response."""
+        # Vertex endpoints end in ":<method>", e.g. ":predict"
+        operation = api_endpoint.rsplit("/", 1)[-1].partition(":")[2] or "post"
+        self.breaker.check()
+        async with self.limiter.slot():
+            with self.breaker.call(), provider_call("vertex", operation) as call:
+                response = await self._post(api_endpoint, data, await self._access_token_async())
+                if response.status_code == 401:
+                    # The token was revoked or expired early; refresh once and retry
+                    token = await self._access_token_async(force_refresh=True)
+                    response = await self._post(api_endpoint, data, token)
+                call.sent(len(response.request.content))
+                call.received(len(response.content))
+                response.raise_for_status()
+            # Lyria responses carry megabytes of base64 audio; decode off the loop
+            return await asyncio.to_thread(response.json)
+
+    async def _post(self, api_endpoint: str, data: Optional[dict], access_token: str) -> httpx.Response:
+        headers = {
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": "application/json",
+        }
+        return await self.http.get().post(api_endpoint, headers=headers, json=data)
+
+    def stats(self) -> dict[str, int]:
+        """Counts of token refreshes versus cached-token reuses."""
+        return {
+            "token_refreshes": self._token_refreshes,
+            "token_reuses": self._token_reuses,
+        }
+
+
+google_client = GoogleApiClient()
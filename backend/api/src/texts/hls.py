@@ -0,0 +1,87 @@
+import math
+import os
+
+import numpy as np
+from pydub import AudioSegment
+
+from .mixer import AudioFormat
+
+PLAYLIST_NAME = "playlist.m3u8"
+SEGMENT_EXTENSION = "ts"
+
+
+def encode_segment(pcm: np.ndarray, fmt: AudioFormat, path: str, start_seconds: float, bitrate: str) -> None:
+    """
+    Encodes a block of mixed PCM as an AAC MPEG-TS segment.
+
+    Timestamps are offset to the segment's position in the timeline so players
+    can stitch independently encoded segments without discontinuities.
+    """
+    segment = AudioSegment(
+        data=np.ascontiguousarray(pcm).tobytes(),
+        sample_width=fmt.sample_width,
+        frame_rate=fmt.frame_rate,
+        channels=fmt.channels,
+    )
+    tmp = f"{path}.tmp"
+    segment.export(
+        tmp,
+        format="mpegts",
+        codec="aac",
+        bitrate=bitrate,
+        parameters=["-output_ts_offset", f"{start_seconds:.3f}"],
+    )
+    os.replace(tmp, path)
+
+
+class HLSPlaylist:
+    """
+    Growing HLS EVENT playlist for a job's orchestrated audio.
+
+    Segments are appended as they are encoded and the playlist file is
+    rewritten atomically each time, so a player polling it only ever sees
+    segments that already exist. finish() adds #EXT-X-ENDLIST.
+    """
+
+    def __init__(self, directory: str, segment_seconds: float):
+        self.directory = directory
+        self.target_duration = math.ceil(segment_seconds)
+        self.segments: list[tuple[str, float]] = []
+        self.finished = False
+        os.makedirs(directory, exist_ok=True)
+        self._write()
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, PLAYLIST_NAME)
+
+    @staticmethod
+    def segment_name(index: int) -> str:
+        return f"segment_{index:05d}.{SEGMENT_EXTENSION}"
+
+    def add(self, filename: str, duration: float) -> None:
+        self.segments.append((filename, duration))
+        self._write()
+
+    def finish(self) -> None:
+        self.finished = True
+        self._write()
+
+    def _write(self) -> None:
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            "#EXT-X-PLAYLIST-TYPE:EVENT",
+            f"#EXT-X-TARGETDURATION:{self.target_duration}",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+        ]
+        for filename, duration in self.segments:
+            lines.append(f"#EXTINF:{duration:.3f},")
+            lines.append(filename)
+        if self.finished:
+            lines.append("#EXT-X-ENDLIST")
+
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp, self.path)
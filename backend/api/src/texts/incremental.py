@@ -0,0 +1,161 @@
+import difflib
+import os
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from api.core.breaker import CircuitOpenError
+from api.core.concurrency import gather_or_cancel
+from api.core.config import settings
+from .chunkify import ChunksList, anthropic_breaker, generate_prompt_chunks, normalize_chunks
+from .song_gen import MUSIC_ASSET_NAME, music_cache, music_cache_key, music_request
+from .word_timeline import WordTimeline
+
+# The uploaded text, kept in a job's output_dir so a later edit can be diffed against it
+SOURCE_NAME = "source.txt"
+
+
+@dataclass
+class PreviousVersion:
+    """An earlier result for the same document, which an edited upload builds on."""
+
+    text: str
+    word_timeline: WordTimeline
+    chunks: list[dict[str, Any]]
+    # Music entries with absolute music_file_path
+    music: list[dict[str, Any]]
+
+    @classmethod
+    def load(cls, stored) -> Optional["PreviousVersion"]:
+        """From a StoredResult; None if its source text is gone."""
+        try:
+            with open(os.path.join(stored.output_dir, SOURCE_NAME), encoding="utf-8") as f:
+                text = f.read()
+        except FileNotFoundError:
+            return None
+        return cls(
+            text=text,
+            word_timeline=stored.word_timeline,
+            chunks=stored.chunks,
+            music=[
+                {**entry, "music_file_path": os.path.join(stored.output_dir, entry["music_file_path"])}
+                for entry in stored.music
+            ],
+        )
+
+
+def _line_map(old_lines: list[str], new_lines: list[str]) -> dict[int, int]:
+    # Old line number -> new line number, for lines the diff kept
+    moved: dict[int, int] = {}
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, _ in matcher.get_opcodes():
+        if tag == "equal":
+            moved.update(zip(range(i1, i2), range(j1, j1 + i2 - i1)))
+    return moved
+
+
+def _spread(chunks: list[dict], first_line: int, last_line: int) -> list[dict]:
+    # Lays chunks out over [first_line, last_line] in proportion to their old lengths
+    lengths = [chunk["ending_line_number"] - chunk["starting_line_number"] + 1 for chunk in chunks]
+    total, span = sum(lengths), last_line - first_line + 1
+    spread, covered = [], 0
+    for chunk, length in zip(chunks, lengths):
+        start = first_line + round(covered * span / total)
+        covered += length
+        end = first_line + round(covered * span / total) - 1
+        if end >= start:
+            spread.append({**chunk, "starting_line_number": start, "ending_line_number": end})
+    return spread
+
+
+async def carry_over_chunks(
+    previous: PreviousVersion,
+    word_timeline: WordTimeline,
+    annotated_text: str,
+    rechunk_lines: int = settings.INCREMENTAL_RECHUNK_LINES,
+) -> tuple[dict, dict[str, int]]:
+    """
+    Chunks an edited text by reusing the previous version's chunks.
+
+    Lines are diffed by their words. Every old chunk whose lines all survived
+    in order is kept, moved to its new line numbers, with its prompt (and so
+    its music) unchanged. The old chunks between two kept ones are replaced
+    by whatever the edit left between them: if that stretch grew by at most
+    rechunk_lines lines, their prompts are spread over it in proportion to
+    their old lengths; otherwise only that stretch is sent to the chunking
+    model. Returns the chunk list, in generate_prompt_chunks() format, and
+    counts of kept, spread and rechunked chunks.
+    """
+    annotated_lines = annotated_text.splitlines()
+    last_line = len(annotated_lines) - 1
+    if last_line < 0:
+        return {"chunks": []}, {"kept": 0, "spread": 0, "rechunked": 0}
+
+    moved = _line_map(previous.word_timeline.line_texts(), word_timeline.line_texts())
+    old_chunks = sorted(previous.chunks, key=lambda c: c["starting_line_number"])
+
+    # Kept chunks at their new lines, and the gaps between them with the old
+    # chunks they displaced
+    kept: list[dict] = []
+    gaps: list[tuple[int, int, list[dict]]] = []
+    displaced: list[dict] = []
+    next_line = 0
+    for chunk in old_chunks:
+        start, end = chunk["starting_line_number"], chunk["ending_line_number"]
+        lines = range(start, end + 1)
+        if all(line in moved for line in lines) and moved[end] - moved[start] == end - start \
+                and moved[start] >= next_line:
+            gaps.append((next_line, moved[start] - 1, displaced))
+            kept.append({**chunk, "starting_line_number": moved[start], "ending_line_number": moved[end]})
+            displaced, next_line = [], moved[end] + 1
+        else:
+            displaced.append(chunk)
+    gaps.append((next_line, last_line, displaced))
+
+    spread: list[dict] = []
+    rechunk: list[tuple[int, int, list[dict]]] = []
+    for first, last, old in gaps:
+        if last < first:
+            continue
+        old_length = sum(c["ending_line_number"] - c["starting_line_number"] + 1 for c in old)
+        if old and last - first + 1 <= old_length + rechunk_lines:
+            spread.extend(_spread(old, first, last))
+        else:
+            rechunk.append((first, last, old))
+
+    async def chunk_gap(first: int, last: int, old: list[dict]) -> list[dict]:
+        try:
+            chunks = await generate_prompt_chunks("\n".join(annotated_lines[first:last + 1]))
+        except CircuitOpenError as e:
+            # Keep what music the stretch had; with none, its neighbours cover it
+            print(f"Not rechunking lines {first}-{last}: {e}")
+            return _spread(old, first, last) if old else []
+        return normalize_chunks(chunks["chunks"], first, last)
+
+    rechunked = await gather_or_cancel(
+        (chunk_gap(*gap) for gap in rechunk),
+        serial_while=lambda: not anthropic_breaker.closed,
+    )
+    new_chunks = [chunk for chunks in rechunked for chunk in chunks]
+
+    merged = normalize_chunks(kept + spread + new_chunks, 0, last_line)
+    stats = {"kept": len(kept), "spread": len(spread), "rechunked": len(new_chunks)}
+    return ChunksList.model_validate({"chunks": merged}).model_dump(), stats
+
+
+def seed_music_cache(previous: PreviousVersion) -> int:
+    """
+    Puts the previous version's clips back into the music cache where they
+    were evicted, so chunks that kept their prompts don't go back to Lyria.
+    Returns how many clips were restored.
+    """
+    paths = {(entry["start_line"], entry["end_line"]): entry["music_file_path"] for entry in previous.music}
+    restored = 0
+    for chunk in previous.chunks:
+        path = paths.get((chunk["starting_line_number"], chunk["ending_line_number"]))
+        if not chunk.get("music_prompt") or path is None or not os.path.isfile(path):
+            continue
+        key = music_cache_key(music_request(chunk["music_prompt"]))
+        if music_cache.get(key) is None:
+            music_cache.put(key, {MUSIC_ASSET_NAME: path})
+            restored += 1
+    return restored
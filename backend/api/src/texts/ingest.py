@@ -0,0 +1,145 @@
+import asyncio
+import codecs
+import io
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Optional
+
+from fastapi import UploadFile
+
+from api.core.config import settings
+
+TEXT_EXTENSIONS = (".txt",)
+PDF_EXTENSIONS = (".pdf",)
+PDF_CONTENT_TYPE = "application/pdf"
+
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+
+
+class UnsupportedUploadError(ValueError):
+    """The upload is neither a UTF-8 text file nor a PDF."""
+
+
+class EmptyDocumentError(ValueError):
+    """The upload decoded fine but contains no text to narrate."""
+
+
+def upload_kind(filename: Optional[str], content_type: Optional[str]) -> str:
+    """Classifies an upload as "text" or "pdf" by extension and content type."""
+    name = (filename or "").lower()
+    content_type = content_type or ""
+    if name.endswith(PDF_EXTENSIONS) or content_type == PDF_CONTENT_TYPE:
+        return "pdf"
+    if content_type.startswith("text/") and (not name or name.endswith(TEXT_EXTENSIONS)):
+        return "text"
+    raise UnsupportedUploadError("Only .txt and .pdf files are allowed.")
+
+
+def decode_utf8_stream(source: BinaryIO, block_bytes: int = settings.UPLOAD_READ_BLOCK_BYTES) -> str:
+    """
+    Decodes a UTF-8 file block by block.
+
+    The incremental decoder carries multi-byte sequences split across block
+    boundaries, so only one raw block is in memory next to the decoded text.
+    Raises UnicodeDecodeError on invalid input, like bytes.decode().
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    text = io.StringIO()
+    while True:
+        block = source.read(block_bytes)
+        if not block:
+            break
+        text.write(decoder.decode(block))
+    text.write(decoder.decode(b"", final=True))
+    return text.getvalue()
+
+
+def _pdf_page_count(path: str) -> int:
+    from pypdf import PdfReader
+
+    return len(PdfReader(path).pages)
+
+
+def _extract_pdf_pages(path: str, first: int, last: int) -> list[str]:
+    # Runs in a worker process; each worker opens the file itself
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    return [reader.pages[i].extract_text() or "" for i in range(first, last)]
+
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    global _pdf_pool
+    if _pdf_pool is None:
+        _pdf_pool = ProcessPoolExecutor(
+            max_workers=settings.PDF_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pdf_pool
+
+
+def shutdown_pdf_pool():
+    global _pdf_pool
+    if _pdf_pool is not None:
+        _pdf_pool.shutdown(wait=False, cancel_futures=True)
+        _pdf_pool = None
+
+
+async def extract_pdf_text(path: str, pages_per_task: int = settings.PDF_PAGES_PER_TASK) -> str:
+    """
+    Extracts a PDF's text in a process pool, pages_per_task pages per task.
+
+    Page text is joined with blank lines so TTS sharding can split on page
+    boundaries.
+    """
+    loop = asyncio.get_running_loop()
+    pool = _get_pdf_pool()
+    page_count = await loop.run_in_executor(pool, _pdf_page_count, path)
+    tasks = [
+        loop.run_in_executor(pool, _extract_pdf_pages, path, first, min(first + pages_per_task, page_count))
+        for first in range(0, page_count, pages_per_task)
+    ]
+    pages = [page.strip() for batch in await asyncio.gather(*tasks) for page in batch]
+    return "\n\n".join(page for page in pages if page)
+
+
+def _spool_to_disk(source: BinaryIO, block_bytes: int) -> str:
+    # Worker processes need a real path; the upload may still be in memory
+    source.seek(0)
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as spool:
+        shutil.copyfileobj(source, spool, block_bytes)
+    return spool.name
+
+
+async def read_upload_text(file: UploadFile) -> str:
+    """
+    Returns the text of an uploaded .txt or .pdf file.
+
+    The request body has already been spooled by Starlette (in memory up to
+    1 MB, on disk beyond); decoding and PDF extraction run off the event loop.
+
+    Raises:
+        UnsupportedUploadError: Neither a text file nor a PDF.
+        UnicodeDecodeError: A text file that is not valid UTF-8.
+        EmptyDocumentError: No text could be extracted.
+    """
+    kind = upload_kind(file.filename, file.content_type)
+    block_bytes = settings.UPLOAD_READ_BLOCK_BYTES
+    loop = asyncio.get_running_loop()
+
+    if kind == "text":
+        await file.seek(0)
+        text = await loop.run_in_executor(None, decode_utf8_stream, file.file, block_bytes)
+    else:
+        path = await loop.run_in_executor(None, _spool_to_disk, file.file, block_bytes)
+        try:
+            text = await extract_pdf_text(path)
+        finally:
+            os.unlink(path)
+
+    if not text.strip():
+        raise EmptyDocumentError("The uploaded file contains no readable text.")
+    return text
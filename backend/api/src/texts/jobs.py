@@ -0,0 +1,299 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from pydantic import BaseModel, Field, PrivateAttr
+
+from api.core.config import settings
+from api.core.logging import get_logger
+from api.core.metrics import track_queue_depth
+from .incremental import PreviousVersion
+from .logic import PIPELINE_STAGES, process_text_to_multimodal, simulate_word_timings
+from .store import ResultStore, result_store
+from .word_timeline import WordTimeline
+
+logger = get_logger(__name__)
+
+
+class StageProgress(BaseModel):
+    status: str = "pending"  # pending | running | done | failed
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    detail: dict[str, Any] = Field(default_factory=dict)
+
+
+class Job(BaseModel):
+    id: str
+    filename: Optional[str] = None
+    status: str = "queued"  # queued | running | succeeded | failed
+    created_at: float = Field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    stages: dict[str, StageProgress] = Field(
+        default_factory=lambda: {stage: StageProgress() for stage in PIPELINE_STAGES}
+    )
+    degraded: bool = False
+    error: Optional[str] = None
+    output_dir: str = ""
+    output_mode: str = "wav"
+    audio_format: str = settings.AUDIO_FORMAT
+    audio_bitrate: Optional[str] = None
+    # Result this text is an edit of; its unchanged parts are reused
+    previous_id: Optional[str] = None
+
+    events: list[dict[str, Any]] = Field(default_factory=list, exclude=True)
+
+    _timeline: Optional[WordTimeline] = PrivateAttr(default=None)
+    _loop: Optional[asyncio.AbstractEventLoop] = PrivateAttr(default=None)
+    _listeners: set[asyncio.Queue] = PrivateAttr(default_factory=set)
+    _events_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def update_stage(self, stage: str, status: str, **detail):
+        """Progress callback handed to the pipeline; records per-stage status."""
+        progress = self.stages.setdefault(stage, StageProgress())
+        if status == "running" and progress.status != "running":
+            progress.started_at = time.time()
+        progress.status = status
+        if status in ("done", "failed"):
+            progress.finished_at = time.time()
+        progress.detail.update(detail)
+        self.publish("stage", {"stage": stage, "status": status, **detail})
+
+    def publish(self, event: str, data: Any):
+        """
+        Appends an event to the job's log and wakes any subscribers.
+
+        Safe to call from pipeline threads; subscribers are notified on the
+        event loop the job was created on. A "words" event also makes the word
+        timings available on the job before the remaining stages finish.
+        """
+        if event == "words":
+            self._timeline = data
+        with self._events_lock:
+            item = {"id": len(self.events) + 1, "event": event, "data": data}
+            self.events.append(item)
+            listeners = list(self._listeners)
+        if self._loop is not None:
+            for queue in listeners:
+                self._loop.call_soon_threadsafe(queue.put_nowait, item)
+
+    def subscribe(self, after_id: int = 0) -> tuple[asyncio.Queue, list[dict[str, Any]]]:
+        """Registers a listener; returns its queue and the events it already missed."""
+        queue: asyncio.Queue = asyncio.Queue()
+        with self._events_lock:
+            self._listeners.add(queue)
+            backlog = self.events[after_id:]
+        return queue, backlog
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        with self._events_lock:
+            self._listeners.discard(queue)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+    @property
+    def timeline(self) -> Optional[WordTimeline]:
+        """Word timings once TTS (or the simulated fallback) has produced them."""
+        return self._timeline
+
+    @property
+    def result(self) -> Optional[list[dict[str, Any]]]:
+        return self._timeline.to_records() if self._timeline is not None else None
+
+    def summary(self, include_result: bool = True) -> dict[str, Any]:
+        data = self.model_dump()
+        if include_result:
+            data["result"] = self.result
+        return data
+
+
+class JobManager:
+    """
+    Bounded pool of background workers that run the text-to-multimodal pipeline.
+
+    Uploads are queued and return immediately; a fixed number of worker tasks
+    pull jobs off the queue and run the pipeline on the app's event loop. The
+    pipeline awaits its provider calls and hands CPU-bound work to threads and
+    process pools, so status requests are answered while it runs.
+    Finished jobs are kept in memory up to ``retention`` entries; successful,
+    non-degraded results are also written to ``store`` so they outlive both
+    the retention limit and restarts.
+    """
+
+    def __init__(
+        self,
+        workers: int = settings.JOB_WORKERS,
+        queue_size: int = settings.JOB_QUEUE_SIZE,
+        retention: int = settings.JOB_RETENTION,
+        jobs_dir: str = settings.JOBS_DIR,
+        store: ResultStore = result_store,
+    ):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.retention = retention
+        self.jobs_dir = jobs_dir
+        self.store = store
+        self.jobs: OrderedDict[str, Job] = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: list[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        track_queue_depth(lambda: self.queue_depth)
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [
+            asyncio.create_task(self._worker(n)) for n in range(self.workers)
+        ]
+        logger.info(f"Started {self.workers} pipeline workers")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(
+        self,
+        job_id: str,
+        text: str,
+        api_key: Optional[str],
+        filename: Optional[str] = None,
+        output_mode: str = "wav",
+        audio_format: str = settings.AUDIO_FORMAT,
+        audio_bitrate: Optional[str] = None,
+        previous_id: Optional[str] = None,
+    ) -> Job:
+        """
+        Queue a pipeline run under ``job_id`` (the input's result_key()).
+
+        ``previous_id`` names a stored result of an earlier version of the
+        same document; the run then only redoes what the edit changed.
+
+        An unfinished job with the same id is returned instead of queueing the
+        same work twice. Raises ``asyncio.QueueFull`` when at capacity.
+        """
+        if self._queue is None:
+            raise RuntimeError("JobManager has not been started")
+
+        existing = self.jobs.get(job_id)
+        if existing is not None and not existing.finished:
+            return existing
+
+        job = Job(
+            id=job_id,
+            filename=filename,
+            output_dir=os.path.join(self.jobs_dir, job_id),
+            output_mode=output_mode,
+            audio_format=audio_format,
+            audio_bitrate=audio_bitrate,
+            previous_id=previous_id,
+        )
+        job._loop = self._loop
+        self._queue.put_nowait((job, text, api_key))
+        self.jobs.pop(job_id, None)
+        self.jobs[job_id] = job
+        self._prune()
+        return job
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def _prune(self):
+        # Drop the oldest finished jobs once over the retention limit
+        excess = len(self.jobs) - self.retention
+        if excess <= 0:
+            return
+        for job_id in list(self.jobs):
+            if excess <= 0:
+                break
+            if self.jobs[job_id].finished:
+                del self.jobs[job_id]
+                excess -= 1
+
+    async def _worker(self, n: int):
+        while True:
+            job, text, api_key = await self._queue.get()
+            try:
+                await self._run(job, text, api_key)
+            except Exception as e:
+                logger.error(f"Worker {n} crashed on job {job.id}: {str(e)}")
+                job.status = "failed"
+                job.error = str(e)
+                job.finished_at = time.time()
+                job.publish("error", {"error": job.error})
+            finally:
+                self._queue.task_done()
+
+    def _load_previous(self, result_id: str) -> Optional[PreviousVersion]:
+        stored = self.store.get(result_id)
+        return PreviousVersion.load(stored) if stored is not None else None
+
+    async def _run(self, job: Job, text: str, api_key: Optional[str]):
+        job.status = "running"
+        job.started_at = time.time()
+        os.makedirs(job.output_dir, exist_ok=True)
+
+        previous = None
+        if job.previous_id is not None:
+            previous = await asyncio.to_thread(self._load_previous, job.previous_id)
+            if previous is None:
+                logger.info(f"Job {job.id}: previous result {job.previous_id} is gone, processing in full")
+
+        result = None
+        try:
+            result = await process_text_to_multimodal(
+                text,
+                api_key,
+                output_dir=job.output_dir,
+                progress=job.update_stage,
+                output_mode=job.output_mode,
+                audio_format=job.audio_format,
+                audio_bitrate=job.audio_bitrate,
+                on_event=job.publish,
+                previous=previous,
+            )
+            job._timeline = result.word_timeline
+            if result.degraded:
+                job.degraded = True
+                job.error = result.degraded
+                logger.warning(f"Job {job.id}: processed {job.filename} degraded: {result.degraded}")
+            else:
+                logger.info(f"Job {job.id}: successfully processed {job.filename}")
+        except Exception as e:
+            logger.warning(
+                f"Job {job.id}: AI Pipeline failed (likely out of credits): {str(e)}. Falling back to simulation."
+            )
+            job.degraded = True
+            job.error = str(e)
+            # Keep real timings if TTS finished before a later stage failed
+            if job.timeline is None:
+                simulated = await asyncio.to_thread(simulate_word_timings, text)
+                job.publish("words", WordTimeline.from_records(simulated))
+
+        # Degraded results aren't stored, so the text is processed in full once
+        # the provider is back
+        if result is not None and not result.degraded:
+            try:
+                await asyncio.to_thread(
+                    self.store.save, job.id, job.filename, job.output_mode, job.output_dir, result
+                )
+            except Exception as e:
+                # The job itself succeeded; it just won't be served from the store
+                logger.error(f"Job {job.id}: failed to store result: {str(e)}")
+
+        job.status = "succeeded"
+        job.finished_at = time.time()
+        job.publish("done", {"status": job.status, "degraded": job.degraded, "error": job.error})
+
+
+job_manager = JobManager()
@@ -1,50 +1,355 @@
-import requests
+import asyncio
+import difflib
+import httpx
 from pydub import AudioSegment
 import os
-import base64
 import json
+import re
+import uuid
+import wave
 from dotenv import load_dotenv
+from typing import Optional
+
+from api.core.breaker import CircuitBreaker
+from api.core.cache import DiskCache, link_or_copy
+from api.core.concurrency import gather_or_cancel
+from api.core.config import settings
+from api.core.http import LoopLocalClient
+from api.core.metrics import provider_call, register_cache
+from api.core.ratelimit import ProviderLimiter
+from .hls import HLSPlaylist, encode_segment
+from .mixer import mix_to_wav
+from .tts_stream import StreamingJSONAudioParser
+from .word_timeline import WordTimeline
 
 # Load API key from .env
 load_dotenv()
 LEMONFOX_API_KEY = os.getenv("LEMONFOX_API_KEY")
 
-def query_lemonfox_tts(text: str, api_key: str):
-    url = "https://api.lemonfox.ai/v1/audio/speech"
+DEFAULT_VOICE = "sarah"
+TTS_STREAM_BLOCK_BYTES = 64 * 1024
+
+tts_cache = register_cache(DiskCache(
+    settings.TTS_CACHE_DIR,
+    max_bytes=settings.TTS_CACHE_MAX_BYTES,
+    name="tts",
+))
+
+lemonfox_limiter = ProviderLimiter(
+    "lemonfox",
+    rate=settings.LEMONFOX_RATE_PER_SECOND,
+    burst=settings.LEMONFOX_BURST,
+    max_concurrency=settings.LEMONFOX_MAX_CONCURRENCY,
+)
+lemonfox_breaker = CircuitBreaker("lemonfox", slow_call_seconds=settings.LEMONFOX_SLOW_CALL_SECONDS)
+lemonfox_http = LoopLocalClient(
+    timeout=settings.TTS_REQUEST_TIMEOUT,
+    limits=httpx.Limits(max_connections=settings.LEMONFOX_MAX_CONCURRENCY),
+)
+
+
+def _read_cached_tts(cache_key: str, audio_name: str, output_path: str):
+    entry = tts_cache.get(cache_key)
+    if entry is None:
+        return None
+    try:
+        link_or_copy(os.path.join(entry, audio_name), output_path)
+        with open(os.path.join(entry, "word_timestamps.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None  # Evicted between lookup and read; synthesize again
+
+
+async def _synthesize(text: str, api_key: str, output_path: str, voice: str, response_format: str):
+    # Identical (text, voice, format) requests are served from the TTS cache
+    cache_key = tts_cache.make_key(text, voice, response_format)
+    audio_name = f"audio.{response_format}"
+    word_timestamps = await asyncio.to_thread(_read_cached_tts, cache_key, audio_name, output_path)
+    if word_timestamps is not None:
+        print(f"Audio saved as {output_path} (cached)")
+        return word_timestamps
+
+    url = settings.LEMONFOX_API_URL
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json"
     }
     payload = {
         "input": text,
-        "voice": "sarah",            # Choose any voice you want
-        "response_format": "wav",
+        "voice": voice,            # Choose any voice you want
+        "response_format": response_format,
         "word_timestamps": True           # Enables word-level timestamps
     }
 
-    response = requests.post(url, headers=headers, json=payload)
-    response.raise_for_status()
-
-    # print(response.headers)
-    # print(response.content)
-
-    data = response.json()
-
-    # Extract and save audio
-    audio_b64 = data['audio']
-    audio_bytes = base64.b64decode(audio_b64)
-    with open("narration.wav", "wb") as f:
-        f.write(audio_bytes)
-    print("Audio saved as narration.wav")
+    # Stream the response: the base64 audio is decoded straight into
+    # output_path and only the word timestamps are held in memory. Parsing
+    # and decoding run on a worker thread, one network block at a time
+    # An open breaker fails the call before it queues for the rate limiter
+    client = lemonfox_http.get()
+    lemonfox_breaker.check()
+    # Written beside output_path and renamed over it: a file left by an
+    # earlier run of the job may be a hard link into the TTS cache
+    tmp_path = f"{output_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        async with lemonfox_limiter.slot():
+            with lemonfox_breaker.call(), provider_call("lemonfox", "speech") as call:
+                async with client.stream("POST", url, headers=headers, json=payload) as response:
+                    call.sent(len(response.request.content))
+                    response.raise_for_status()
+                    with open(tmp_path, "wb") as f:
+                        parser = StreamingJSONAudioParser(f, audio_key="audio")
+                        async for block in response.aiter_bytes(TTS_STREAM_BLOCK_BYTES):
+                            call.received(len(block))
+                            await asyncio.to_thread(parser.feed, block)
+                        data = await asyncio.to_thread(parser.close)
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    print(f"Audio saved as {output_path} ({parser.audio_bytes} bytes)")
 
     # Extract and print timestamps
     word_timestamps = data.get("word_timestamps", [])
     # for word_info in word_timestamps:
     #     print(f"{word_info['word']}: {word_info['start']}s - {word_info['end']}s")
 
+    await asyncio.to_thread(tts_cache.put, cache_key, {
+        audio_name: output_path,
+        "word_timestamps.json": json.dumps(word_timestamps).encode("utf-8"),
+    })
+
     # print(word_timestamps)
     return word_timestamps
 
+
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+_SENTENCE_BREAK = re.compile(r"(?:(?<=[.!?])|(?<=[.!?][\"”’)\]]))\s+")
+
+
+def _pack(pieces: list[str], max_chars: int, sep: str) -> list[str]:
+    # Greedily joins consecutive pieces while they fit in max_chars
+    packed = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + len(sep) + len(piece) > max_chars:
+            packed.append(current)
+            current = piece
+        else:
+            current = f"{current}{sep}{piece}" if current else piece
+    if current:
+        packed.append(current)
+    return packed
+
+
+def _shard_pieces(text: str, max_chars: int) -> list[tuple[str, str]]:
+    # (separator, text) pieces: whole paragraphs where they fit, otherwise
+    # the paragraph's sentences (or word runs of overlong sentences)
+    pieces = []
+    for paragraph in _PARAGRAPH_BREAK.split(text.strip()):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            pieces.append(("\n\n", paragraph))
+            continue
+
+        sentences = []
+        for sentence in _SENTENCE_BREAK.split(paragraph):
+            if len(sentence) <= max_chars:
+                sentences.append(sentence)
+            else:
+                sentences.extend(_pack(sentence.split(), max_chars, " "))
+        pieces.extend(("\n\n" if n == 0 else " ", sentence) for n, sentence in enumerate(sentences))
+    return pieces
+
+
+def _pack_spans(pieces: list[tuple[str, str]], max_chars: int) -> list[tuple[int, int]]:
+    # Greedily groups consecutive pieces while they fit in max_chars; returns
+    # half-open index ranges
+    spans = []
+    first = length = 0
+    for i, (sep, piece) in enumerate(pieces):
+        if i > first and length + len(sep) + len(piece) > max_chars:
+            spans.append((first, i))
+            first, length = i, len(piece)
+        else:
+            length += len(sep) + len(piece) if i > first else len(piece)
+    if first < len(pieces):
+        spans.append((first, len(pieces)))
+    return spans
+
+
+def _join(pieces: list[tuple[str, str]]) -> str:
+    return pieces[0][1] + "".join(f"{sep}{piece}" for sep, piece in pieces[1:])
+
+
+def split_text_into_shards(text: str, max_chars: int) -> list[str]:
+    """
+    Splits text into shards of at most max_chars, breaking on paragraph boundaries
+    first, then sentence boundaries, and only as a last resort on whitespace.
+    """
+    pieces = _shard_pieces(text, max_chars)
+    return [_join(pieces[first:last]) for first, last in _pack_spans(pieces, max_chars)]
+
+
+def reshard_like(text: str, previous_text: str, max_chars: int) -> list[str]:
+    """
+    Shards text like split_text_into_shards(), but keeps every shard of
+    previous_text whose pieces are all unchanged, and only repacks the pieces
+    in between.
+
+    Shards are cached by their text, so after an edit only the shards that
+    contain it are synthesized again; left to greedy packing, a sentence that
+    grew or shrank could move every shard boundary after it.
+    """
+    pieces = _shard_pieces(text, max_chars)
+    old_pieces = _shard_pieces(previous_text, max_chars)
+
+    # Old piece index -> new piece index, for pieces the diff kept
+    moved: dict[int, int] = {}
+    matcher = difflib.SequenceMatcher(None, old_pieces, pieces, autojunk=False)
+    for tag, i1, i2, j1, _ in matcher.get_opcodes():
+        if tag == "equal":
+            moved.update(zip(range(i1, i2), range(j1, j1 + i2 - i1)))
+
+    # New piece index where a whole old shard starts -> its piece count
+    kept: dict[int, int] = {}
+    for first, last in _pack_spans(old_pieces, max_chars):
+        if all(i in moved for i in range(first, last)) and moved[last - 1] - moved[first] == last - 1 - first:
+            kept[moved[first]] = last - first
+
+    shards = []
+    pending: list[tuple[str, str]] = []
+
+    def flush():
+        shards.extend(_join(pending[first:last]) for first, last in _pack_spans(pending, max_chars))
+        pending.clear()
+
+    j = 0
+    while j < len(pieces):
+        if j in kept:
+            flush()
+            shards.append(_join(pieces[j:j + kept[j]]))
+            j += kept[j]
+        else:
+            pending.append(pieces[j])
+            j += 1
+    flush()
+    return shards
+
+
+def concatenate_wavs(
+    input_paths: list[str], output_path: str, block_frames: int = 1 << 16, align_seconds: float = 0.0
+) -> list[float]:
+    """
+    Concatenates WAV files with identical formats into output_path, streaming
+    blocks of frames. Returns each input's duration in seconds.
+
+    With align_seconds, every input but the last is padded with silence to a
+    multiple of it, and the returned durations include the padding.
+    """
+    # Renamed over output_path once complete, so an existing hard link there
+    # (a cached single-shard narration) is replaced rather than overwritten
+    tmp_path = f"{output_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        durations = _concatenate_wavs(input_paths, tmp_path, block_frames, align_seconds)
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return durations
+
+
+def _concatenate_wavs(input_paths: list[str], output_path: str, block_frames: int, align_seconds: float):
+    durations = []
+    with wave.open(output_path, "wb") as out:
+        for n, path in enumerate(input_paths):
+            with wave.open(path, "rb") as src:
+                if n == 0:
+                    out.setparams(src.getparams())
+                frame_bytes = src.getsampwidth() * src.getnchannels()
+                frames = 0
+                while True:
+                    block = src.readframes(block_frames)
+                    if not block:
+                        break
+                    out.writeframes(block)
+                    frames += len(block) // frame_bytes
+
+                align_frames = int(align_seconds * src.getframerate())
+                if align_frames > 0 and n < len(input_paths) - 1:
+                    padding = -frames % align_frames
+                    out.writeframes(bytes(padding * frame_bytes))
+                    frames += padding
+                durations.append(frames / src.getframerate())
+    return durations
+
+
+async def query_lemonfox_tts(
+    text: str,
+    api_key: str,
+    output_path: str = "narration.wav",
+    voice: str = DEFAULT_VOICE,
+    response_format: str = "wav",
+    shard_chars: int = settings.TTS_SHARD_CHARS,
+    max_concurrency: int = settings.TTS_CONCURRENCY,
+    previous_text: Optional[str] = None,
+):
+    """
+    Synthesizes text to output_path and returns its word timestamps.
+
+    WAV narrations longer than shard_chars are split on paragraph and sentence
+    boundaries, the shards are synthesized concurrently (each through the TTS
+    cache) and their audio concatenated. Each shard's timestamps are shifted by
+    the duration of the audio before it, so the merged list stays continuous
+    and monotonic.
+
+    previous_text is an earlier version of text whose shards are reused where
+    the edit didn't touch them (see reshard_like()). With
+    TTS_SHARD_ALIGN_SECONDS set, shards are padded to a multiple of it, so a
+    small edit usually leaves the timing of every later shard, and so the mix
+    after it, unchanged.
+    """
+    if response_format != "wav":
+        shards = [text]
+    elif previous_text is not None:
+        shards = reshard_like(text, previous_text, shard_chars)
+    else:
+        shards = split_text_into_shards(text, shard_chars)
+    if len(shards) <= 1:
+        return await _synthesize(text, api_key, output_path, voice, response_format)
+
+    print(f"Synthesizing {len(shards)} TTS shards")
+    shard_paths = [f"{output_path}.shard{n}.wav" for n in range(len(shards))]
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def synthesize_shard(shard: str, path: str):
+        async with semaphore:
+            return await _synthesize(shard, api_key, path, voice, response_format)
+
+    shard_timestamps = await gather_or_cancel(
+        (synthesize_shard(shard, path) for shard, path in zip(shards, shard_paths)),
+        serial_while=lambda: not lemonfox_breaker.closed,
+    )
+
+    try:
+        durations = await asyncio.to_thread(
+            concatenate_wavs, shard_paths, output_path, align_seconds=settings.TTS_SHARD_ALIGN_SECONDS
+        )
+    finally:
+        for path in shard_paths:
+            os.remove(path)
+    print(f"Audio saved as {output_path}")
+
+    word_timestamps = []
+    offset = 0.0
+    for timestamps, duration in zip(shard_timestamps, durations):
+        for ts in timestamps:
+            word_timestamps.append({**ts, "start": ts["start"] + offset, "end": ts["end"] + offset})
+        offset += duration
+    return word_timestamps
+
+
 def get_word_to_line_map(annotated_text_block):
     word_to_line = []
     lines = annotated_text_block.strip().splitlines()
@@ -71,37 +376,17 @@ def get_word_to_line_map(annotated_text_block):
 import string
 
 def merge_timestamps_with_lines(word_timestamps, annotated_text_block, word_to_line):
-    merged = []
-    idx = 0
-
-    for ts in word_timestamps:
-        word = ts["word"].lower().strip(".,?!;:\"“”‘’()[]")
-        
-        # Skip purely punctuation tokens
-        if all(char in string.punctuation for char in ts["word"]):
-            continue
+    return WordTimeline.build(word_timestamps, word_to_line).to_records()
 
-        # Try to find the next matching word in the word_to_line list
-        while idx < len(word_to_line) and word != word_to_line[idx][0]:
-            idx += 1
 
-        if idx < len(word_to_line):
-            line = word_to_line[idx][1]
-            idx += 1
-        else:
-            line = -1  # fallback if no match found
-
-        merged.append({
-            "word": ts["word"],
-            "start": ts["start"],
-            "end": ts["end"],
-            "line": line
-        })
-
-    return merged
+def _ends_sentence(word: str) -> bool:
+    return word.rstrip("\"'”’)]").endswith((".", "!", "?"))
 
 
 def rebuild_annotated_text(word_timestamps, max_line_length=120):
+    # Lines also end after a sentence once they are half full, so wrapping
+    # falls back into step a sentence or two after an edit instead of
+    # shifting every later line (see incremental.py)
     annotated_lines = []
     word_to_line_map = []
 
@@ -126,6 +411,11 @@ def rebuild_annotated_text(word_timestamps, max_line_length=120):
         word_clean = word.strip(".,?!;:\"“”‘’()[]").lower()
         word_to_line_map.append((word_clean, current_line_idx))
 
+        if _ends_sentence(word) and len(current_line) > max_line_length // 2:
+            annotated_lines.append(f"[Line {current_line_idx}] {current_line.strip()}")
+            current_line = ""
+            current_line_idx += 1
+
     # Final line
     if current_line.strip():
         annotated_lines.append(f"[Line {current_line_idx}] {current_line.strip()}")
@@ -134,37 +424,26 @@ def rebuild_annotated_text(word_timestamps, max_line_length=120):
     return annotated_text, word_to_line_map
 
 
-def get_current_line(t: float, merged_list):
-    # Finds the latest word at or before timestamp t
-    current_line = None
-    for entry in merged_list:
-        if entry["start"] <= t:
-            current_line = entry["line"]
-        else:
-            break
-    return current_line
+def get_current_line(t: float, word_timeline):
+    # Finds the line of the latest word at or before timestamp t
+    if not isinstance(word_timeline, WordTimeline):
+        word_timeline = WordTimeline.from_records(word_timeline)
+    return word_timeline.line_at(t)
+
+def get_music_sync_timeline(chunks, word_timeline):
+    if not isinstance(word_timeline, WordTimeline):
+        word_timeline = WordTimeline.from_records(word_timeline)
 
-def get_music_sync_timeline(chunks, merged_word_timestamps):
     timeline = []
     for chunk in chunks:
-        start_line = chunk["start_line"]
-        end_line = chunk["end_line"]
-        music_file_path = chunk["music_file_path"]
-
-        # Get all word timestamps for lines in this chunk
-        relevant_words = [
-            word for word in merged_word_timestamps
-            if start_line <= word["line"] <= end_line
-        ]
-
-        if not relevant_words:
+        # Start and end of the words on the chunk's lines, from the line index
+        span = word_timeline.span(chunk["start_line"], chunk["end_line"])
+        if span is None:
             continue  # skip empty chunks
 
-        chunk_start_time = min(word["start"] for word in relevant_words)
-        chunk_end_time = max(word["end"] for word in relevant_words)
-
+        chunk_start_time, chunk_end_time = span
         timeline.append({
-            "music_file_path": music_file_path,
+            "music_file_path": chunk["music_file_path"],
             "chunk_start": chunk_start_time,
             "chunk_end": chunk_end_time
         })
@@ -173,7 +452,34 @@ def get_music_sync_timeline(chunks, merged_word_timestamps):
 
 
 
-def orchestrate_audio(narration_path, timeline, fade_duration=2000, duck_db=-8):
+def orchestrate_audio(narration_path, timeline, fade_duration=2000, duck_db=-8,
+                      output_path="orchestrated_output.wav", engine=settings.MIX_ENGINE,
+                      hls_dir=None, on_segment_ready=None):
+    if hls_dir is not None:
+        # Mix and publish HLS segments in timeline order, so playback can start
+        # before the whole mix is done; on_segment_ready(n) fires after each one
+        playlist = HLSPlaylist(hls_dir, settings.HLS_SEGMENT_SECONDS)
+
+        def publish_segment(index, first_frame, pcm, fmt):
+            filename = HLSPlaylist.segment_name(index)
+            encode_segment(pcm, fmt, os.path.join(hls_dir, filename),
+                           start_seconds=first_frame / fmt.frame_rate, bitrate=settings.HLS_BITRATE)
+            playlist.add(filename, len(pcm) / fmt.frame_rate)
+            if on_segment_ready is not None:
+                on_segment_ready(len(playlist.segments))
+
+        mix_to_wav(narration_path, timeline, output_path, fade_duration=fade_duration, duck_db=duck_db,
+                   segment_ms=int(settings.HLS_SEGMENT_SECONDS * 1000), on_segment=publish_segment)
+        playlist.finish()
+        print(f"✅ Exported: {output_path} and {playlist.path}")
+        return
+
+    if engine == "numpy":
+        # Vectorized in-place mix; see mixer.py
+        mix_to_wav(narration_path, timeline, output_path, fade_duration=fade_duration, duck_db=duck_db)
+        print(f"✅ Exported: {output_path}")
+        return
+
     # Load narration
     narration = AudioSegment.from_wav(narration_path)
 
@@ -205,11 +511,11 @@ def orchestrate_audio(narration_path, timeline, fade_duration=2000, duck_db=-8):
     final = narration.overlay(music_bed)
 
     # Export the result
-    final.export("orchestrated_output.wav", format="wav")
-    print("✅ Exported: orchestrated_output.wav")
+    final.export(output_path, format="wav")
+    print(f"✅ Exported: {output_path}")
 
 def create_soundtrack_for_text(text):
-    word_timestamps = query_lemonfox_tts(text, LEMONFOX_API_KEY)
+    word_timestamps = asyncio.run(query_lemonfox_tts(text, LEMONFOX_API_KEY))
 
     annon_text, word_to_line_map = rebuild_annotated_text(word_timestamps)
     file_path = "annotated_story.txt"
@@ -227,7 +533,7 @@ def create_soundtrack_for_text(text):
     # print(word_timestamps)
     merged = merge_timestamps_with_lines(word_timestamps, annotated_text, word_to_line_map)
     print(merged)
-    chunks = generate_song_chunks(generate_prompt_chunks(FORMATTED_LINE))
+    chunks = asyncio.run(generate_song_chunks(asyncio.run(generate_prompt_chunks(FORMATTED_LINE))))
 
     timeline = get_music_sync_timeline(chunks, merged)
     print(timeline)
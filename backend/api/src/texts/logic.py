@@ -1,39 +1,217 @@
+import asyncio
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+from api.core.breaker import CircuitOpenError
+from api.core.config import settings
+from api.core.metrics import stage_span
+
 from .lemon_fox import (
-    query_lemonfox_tts, 
-    rebuild_annotated_text, 
-    merge_timestamps_with_lines,
+    query_lemonfox_tts,
+    tts_cache,
+    rebuild_annotated_text,
     get_music_sync_timeline,
     orchestrate_audio
 )
-from .song_gen import generate_song_chunks
-from .chunkify import generate_prompt_chunks
+from .song_gen import generate_song_chunks, music_cache
+from .chunkify import chunk_cache, generate_prompt_chunks
+from .encode import audio_extension, encode_audio
+from .google_client import google_client
+from .hls import PLAYLIST_NAME
+from .incremental import SOURCE_NAME, PreviousVersion, carry_over_chunks, seed_music_cache
+from .word_timeline import WordTimeline
 import os
 
-async def process_text_to_multimodal(text: str, api_key: str):
+PIPELINE_STAGES = ("tts", "chunking", "music", "mixing", "encoding")
+OUTPUT_MODES = ("wav", "hls")
+
+# Output file names inside a job's output_dir
+NARRATION_NAME = "narration.wav"
+OUTPUT_STEM = "orchestrated_output"
+OUTPUT_NAME = f"{OUTPUT_STEM}.wav"
+SONGS_DIR_NAME = "songs"
+HLS_DIR_NAME = "hls"
+
+# Called as progress(stage, status, **detail) whenever a stage starts or ends
+ProgressCallback = Callable[..., None]
+
+# Called as on_event(event, data) as soon as a stage produces data the reader
+# can use: "words" after TTS, "chunks" after chunking, "music" per finished clip
+EventCallback = Callable[[str, Any], None]
+
+
+@dataclass
+class PipelineResult:
+    """Everything a finished run produced; file paths are relative to output_dir."""
+
+    word_timeline: WordTimeline
+    chunks: list[dict[str, Any]]
+    music: list[dict[str, Any]]
+    audio_path: str
+    hls_playlist: Optional[str] = None
+    # Why the result is incomplete, when a provider's circuit breaker was open
+    degraded: Optional[str] = None
+
+
+def output_name(audio_format: str) -> str:
+    """File name of the final mix in audio_format."""
+    return f"{OUTPUT_STEM}.{audio_extension(audio_format)}"
+
+
+@contextmanager
+def _stage(progress: Optional[ProgressCallback], name: str):
+    # Yields a dict; anything the stage puts in it is reported alongside "done"
+    detail: dict[str, Any] = {}
+    with stage_span(name):
+        if progress is None:
+            yield detail
+            return
+        progress(name, "running")
+        try:
+            yield detail
+        except Exception as e:
+            progress(name, "failed", error=str(e))
+            raise
+        progress(name, "done", **detail)
+
+
+async def process_text_to_multimodal(
+    text: str,
+    api_key: str,
+    output_dir: str = ".",
+    progress: Optional[ProgressCallback] = None,
+    output_mode: str = "wav",
+    on_event: Optional[EventCallback] = None,
+    audio_format: str = settings.AUDIO_FORMAT,
+    audio_bitrate: Optional[str] = None,
+    previous: Optional[PreviousVersion] = None,
+) -> PipelineResult:
+    # previous: an earlier version of the same document. Its TTS shards,
+    # chunks and music are reused wherever the edit left them unchanged
+    emit = on_event or (lambda event, data: None)
+    narration_path = os.path.join(output_dir, NARRATION_NAME)
+    degraded: list[str] = []
+
+    # Kept so a later edit of this text can be processed incrementally
+    await asyncio.to_thread(_write_source, os.path.join(output_dir, SOURCE_NAME), text)
+
     # 1. Get TTS and Word Timestamps
-    word_timestamps = query_lemonfox_tts(text, api_key)
-    
+    with _stage(progress, "tts") as detail:
+        word_timestamps = await query_lemonfox_tts(
+            text, api_key, output_path=narration_path,
+            previous_text=previous.text if previous is not None else None,
+        )
+        detail["tts_cache"] = tts_cache.stats()
+
     # 2. Format text for the music model (Greedy line wrap)
-    annotated_text, word_to_line_map = rebuild_annotated_text(word_timestamps)
-    
+    # CPU-bound steps run on worker threads so the event loop stays responsive
+    annotated_text, word_to_line_map = await asyncio.to_thread(rebuild_annotated_text, word_timestamps)
+
+    # Word timings are final at this point, so the reader can start now
+    # This gives the frontend the exact timing for word highlighting
+    word_timeline = await asyncio.to_thread(WordTimeline.build, word_timestamps, word_to_line_map)
+    emit("words", word_timeline)
+
     # 3. Generate Music Prompts and Audio Chunks
     # This uses your Lyria 2 integration in song_gen.py
-    prompt_chunks = generate_prompt_chunks(annotated_text)
-    music_chunks = generate_song_chunks(prompt_chunks)
-    
+    # With Claude or Lyria unavailable the narration is still delivered, with
+    # whatever music is cached, rather than waiting on a provider that's down
+    with _stage(progress, "chunking") as detail:
+        try:
+            if previous is not None:
+                prompt_chunks, detail["reused_chunks"] = await carry_over_chunks(
+                    previous, word_timeline, annotated_text
+                )
+                detail["restored_music"] = await asyncio.to_thread(seed_music_cache, previous)
+            else:
+                prompt_chunks = await generate_prompt_chunks(annotated_text)
+        except CircuitOpenError as e:
+            prompt_chunks = {"chunks": []}
+            detail["degraded"] = str(e)
+            degraded.append(f"No music: {e}")
+        detail["chunk_cache"] = chunk_cache.stats()
+    emit("chunks", prompt_chunks)
+
+    def relative(chunk):
+        return {**chunk, "music_file_path": os.path.relpath(chunk["music_file_path"], output_dir)}
+
+    def on_chunk_ready(chunk):
+        emit("music", relative(chunk))
+
+    with _stage(progress, "music") as detail:
+        music_chunks = await generate_song_chunks(
+            prompt_chunks,
+            songs_dir=os.path.join(output_dir, SONGS_DIR_NAME),
+            on_chunk_ready=on_chunk_ready,
+            allow_missing=True,
+        )
+        wanted = sum(1 for chunk in prompt_chunks["chunks"] if chunk.get("music_prompt"))
+        if len(music_chunks) < wanted:
+            detail["degraded"] = f"{wanted - len(music_chunks)} of {wanted} chunks without music"
+            degraded.append(f"{detail['degraded']}: vertex is unavailable")
+        detail["music_cache"] = music_cache.stats()
+        detail["google_auth"] = google_client.stats()
+
     # 4. Merge Narration and Music into a single file
     # This creates 'orchestrated_output.wav'
-    timeline = get_music_sync_timeline(music_chunks, merge_timestamps_with_lines(
-        word_timestamps, annotated_text, word_to_line_map
-    ))
-    orchestrate_audio("narration.wav", timeline)
+    with _stage(progress, "mixing"):
+        timeline = get_music_sync_timeline(music_chunks, word_timeline)
+        hls_dir = None
+        on_segment_ready = None
+        if output_mode == "hls":
+            hls_dir = os.path.join(output_dir, HLS_DIR_NAME)
+            if progress is not None:
+                def on_segment_ready(segments):
+                    progress("mixing", "running", hls_playlist=PLAYLIST_NAME, hls_segments=segments)
+        await asyncio.to_thread(
+            orchestrate_audio,
+            narration_path,
+            timeline,
+            output_path=os.path.join(output_dir, OUTPUT_NAME),
+            hls_dir=hls_dir,
+            on_segment_ready=on_segment_ready,
+        )
 
-    # 4. Merge everything for the Frontend
-    # This gives the frontend the exact timing for word highlighting
-    final_merged_data = merge_timestamps_with_lines(
-        word_timestamps, 
-        annotated_text, 
-        word_to_line_map
+    # 5. Compress the mix; the WAV is only kept if configured to
+    with _stage(progress, "encoding") as detail:
+        detail["audio_format"] = audio_format
+        if audio_format != "wav":
+            wav_path = os.path.join(output_dir, OUTPUT_NAME)
+            await encode_audio(wav_path, audio_format, audio_bitrate)
+            if not settings.KEEP_WAV_OUTPUT:
+                os.remove(wav_path)
+
+    return PipelineResult(
+        word_timeline=word_timeline,
+        chunks=prompt_chunks["chunks"],
+        music=[relative(chunk) for chunk in music_chunks],
+        audio_path=output_name(audio_format),
+        hls_playlist=f"{HLS_DIR_NAME}/{PLAYLIST_NAME}" if hls_dir else None,
+        degraded="; ".join(degraded) or None,
     )
-    
-    return final_merged_data
\ No newline at end of file
+
+
+def _write_source(path: str, text: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def simulate_word_timings(text: str) -> list[dict[str, Any]]:
+    """Evenly spaced fake word timings, used when the AI pipeline is unavailable."""
+    words = text.split()
+    simulated_data = []
+    current_line = 1
+
+    for i, word in enumerate(words):
+        simulated_data.append({
+            "word": word,
+            "start": i * 0.45,
+            "end": (i * 0.45) + 0.35,
+            "line": current_line
+        })
+
+        if word.strip()[-1] in ".!?":
+            current_line += 1
+
+    return simulated_data
@@ -0,0 +1,355 @@
+import io
+import os
+import wave
+from dataclasses import dataclass
+from typing import Callable, Iterator, Optional
+
+import numpy as np
+from pydub import AudioSegment
+from pydub.utils import audioop, db_to_float
+
+from api.core.cache import DiskCache
+from api.core.config import settings
+from api.core.metrics import register_cache
+
+# Frames processed per vectorized step; bounds the temporary memory of a mix
+BLOCK_FRAMES = 1 << 18
+
+# pydub fades run from/to -120 dB rather than true silence
+_FADE_FLOOR = db_to_float(-120)
+
+# AudioSegment.silent(), which the pydub mix used for its music bed
+_BED_FRAME_RATE = 11025
+_BED_SAMPLE_WIDTH = 2
+
+_DTYPES = {2: np.int16, 4: np.int32}
+
+# Music clips decoded into a mix format, keyed by the WAV file and that
+# format. Entries are .npy files, memory-mapped read-only on reuse
+PCM_ASSET_NAME = "pcm.npy"
+pcm_cache = register_cache(DiskCache(
+    settings.PCM_CACHE_DIR,
+    max_bytes=settings.PCM_CACHE_MAX_BYTES,
+    name="pcm",
+))
+
+
+@dataclass(frozen=True)
+class AudioFormat:
+    frame_rate: int
+    channels: int
+    sample_width: int
+
+    @property
+    def dtype(self):
+        return _DTYPES[self.sample_width]
+
+    def frames(self, ms: float) -> int:
+        # Same rounding as pydub's millisecond slicing
+        return int(ms * (self.frame_rate / 1000.0))
+
+
+def read_wav_format(path: str) -> AudioFormat:
+    with wave.open(path, "rb") as f:
+        return AudioFormat(f.getframerate(), f.getnchannels(), f.getsampwidth())
+
+
+def wav_data_offset(path: str) -> int:
+    """Byte offset of the PCM payload in a RIFF/WAVE file."""
+    with open(path, "rb") as f:
+        header = f.read(12)
+        if header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+            raise ValueError(f"{path} is not a WAV file")
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                raise ValueError(f"{path} has no data chunk")
+            size = int.from_bytes(chunk[4:], "little")
+            if chunk[:4] == b"data":
+                return f.tell()
+            f.seek(size + (size & 1), 1)
+
+
+def mix_format(narration: AudioFormat, music: list[AudioFormat]) -> AudioFormat:
+    """
+    Output format of a mix, chosen the way pydub's overlay syncs segments: the
+    highest frame rate, channel count and sample width among the narration, the
+    music clips and the 11025 Hz 16-bit silent bed. Widths are rounded up to a
+    NumPy-friendly 16 or 32 bits.
+    """
+    formats = [narration, AudioFormat(_BED_FRAME_RATE, 1, _BED_SAMPLE_WIDTH), *music]
+    width = max(f.sample_width for f in formats)
+    return AudioFormat(
+        frame_rate=max(f.frame_rate for f in formats),
+        channels=max(f.channels for f in formats),
+        sample_width=2 if width <= 2 else 4,
+    )
+
+
+def _convert_block(data: bytes, src: AudioFormat, dst: AudioFormat, rate_state):
+    # Same order as pydub's _sync: channels, then frame rate, then sample width
+    width = src.sample_width
+    if src.channels != dst.channels:
+        if src.channels == 1 and dst.channels == 2:
+            data = audioop.tostereo(data, width, 1, 1)
+        else:
+            raise ValueError(f"Cannot convert {src.channels} channels to {dst.channels}")
+    if src.frame_rate != dst.frame_rate:
+        data, rate_state = audioop.ratecv(
+            data, width, dst.channels, src.frame_rate, dst.frame_rate, rate_state
+        )
+    if width != dst.sample_width:
+        data = audioop.lin2lin(data, width, dst.sample_width)
+    return data, rate_state
+
+
+def convert_wav(src_path: str, dst_path: str, fmt: AudioFormat) -> int:
+    """Streams src_path into a new WAV in fmt, returning the frames written."""
+    src_fmt = read_wav_format(src_path)
+    frames = 0
+    rate_state = None
+    with wave.open(src_path, "rb") as src, wave.open(dst_path, "wb") as dst:
+        dst.setnchannels(fmt.channels)
+        dst.setsampwidth(fmt.sample_width)
+        dst.setframerate(fmt.frame_rate)
+        while True:
+            block = src.readframes(BLOCK_FRAMES)
+            if not block:
+                break
+            block, rate_state = _convert_block(block, src_fmt, fmt, rate_state)
+            dst.writeframes(block)
+            frames += len(block) // (fmt.channels * fmt.sample_width)
+    return frames
+
+
+def resize_wav(path: str, frames: int, fmt: AudioFormat) -> None:
+    """Truncates or silence-pads a WAV's data chunk to exactly frames frames."""
+    offset = wav_data_offset(path)
+    data_bytes = frames * fmt.channels * fmt.sample_width
+    with open(path, "r+b") as f:
+        f.truncate(offset + data_bytes)
+        f.seek(offset - 4)
+        f.write(data_bytes.to_bytes(4, "little"))
+        f.seek(4)
+        f.write((offset + data_bytes - 8).to_bytes(4, "little"))
+
+
+def pydub_length(frames: int, fmt: AudioFormat) -> int:
+    # pydub slices whole segments to their length rounded to the millisecond,
+    # padding or trimming up to a couple of frames
+    return fmt.frames(round(1000 * frames / fmt.frame_rate))
+
+
+def load_pcm(path: str, fmt: AudioFormat) -> np.ndarray:
+    """Decodes a WAV file into a (frames, channels) float32 array in fmt."""
+    segment = AudioSegment.from_wav(path)
+    segment = (
+        segment.set_channels(fmt.channels)
+        .set_frame_rate(fmt.frame_rate)
+        .set_sample_width(fmt.sample_width)
+    )
+    pcm = np.frombuffer(segment.raw_data, dtype=fmt.dtype)
+    return pcm.reshape(-1, fmt.channels).astype(np.float32)
+
+
+def load_cached_pcm(path: str, fmt: AudioFormat) -> np.ndarray:
+    """
+    load_pcm() through the PCM cache. A hit is a read-only memory map of the
+    cached array, so popular clips skip WAV parsing and resampling and share
+    their pages between mixes; a miss decodes and stores the clip.
+    """
+    # Keyed by file identity rather than content, which would cost as much to
+    # hash as to decode; jobs' song files are hard links to the music cache's
+    # clips, so every job using a clip shares its entry
+    st = os.stat(path)
+    key = pcm_cache.make_key(
+        [st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns],
+        [fmt.frame_rate, fmt.channels, fmt.sample_width],
+    )
+
+    entry = pcm_cache.get(key)
+    if entry is not None:
+        try:
+            return np.load(os.path.join(entry, PCM_ASSET_NAME), mmap_mode="r")
+        except FileNotFoundError:
+            pass  # Evicted between lookup and read; decode again
+
+    pcm = load_pcm(path, fmt)
+    if len(pcm):
+        buffer = io.BytesIO()
+        np.save(buffer, pcm)
+        pcm_cache.put(key, {PCM_ASSET_NAME: buffer.getvalue()})
+    return pcm
+
+
+class ChunkEnvelope:
+    """
+    Gain envelope of one looped music chunk: linear fade-in and fade-out in
+    one-millisecond steps (as pydub does for fades over 100 ms) times the
+    constant ducking gain.
+
+    Fades are clamped to the chunk's length. Here the engines differ on
+    purpose: pydub doesn't clamp, and fading a chunk shorter than the fade
+    (fade_out(2000) on 1000 ms) returns a wrongly faded 1999 ms segment, so
+    the pydub mix is off by thousands of LSB over such chunks. Chunks at
+    least fade_ms long match it within 2 LSB.
+    """
+
+    def __init__(self, fmt: AudioFormat, duration_ms: int, fade_ms: int, duck_db: float):
+        self.duration_ms = duration_ms
+        self.fade_in_ms = min(fade_ms, duration_ms)
+        self.fade_out_ms = min(fade_ms, duration_ms)
+        self.duck = db_to_float(duck_db)
+        # First frame of every millisecond step
+        self.ms_starts = (np.arange(duration_ms + 1) * (fmt.frame_rate / 1000.0)).astype(np.int64)
+        self.fade_in_end = self.ms_starts[self.fade_in_ms]
+        self.fade_out_start = self.ms_starts[duration_ms - self.fade_out_ms]
+
+    def gain(self, first: int, count: int):
+        """Per-frame gains for frames [first, first + count), or a scalar if constant."""
+        if first >= self.fade_in_end and first + count <= self.fade_out_start:
+            return self.duck
+
+        ms = np.searchsorted(self.ms_starts, np.arange(first, first + count), side="right") - 1
+        gain = np.full(count, self.duck, dtype=np.float32)
+        if self.fade_in_ms:
+            fading = ms < self.fade_in_ms
+            gain[fading] *= _FADE_FLOOR + (1 - _FADE_FLOOR) * ms[fading] / self.fade_in_ms
+        if self.fade_out_ms:
+            step = ms - (self.duration_ms - self.fade_out_ms)
+            fading = step >= 0
+            gain[fading] *= 1 + (_FADE_FLOOR - 1) * step[fading] / self.fade_out_ms
+        return gain[:, None]
+
+
+def _looped(music: np.ndarray, first: int, count: int) -> Iterator[tuple[int, np.ndarray]]:
+    # Yields (offset, view) pieces covering frames [first, first + count) of the
+    # music looped forever, without materializing the loop
+    offset = 0
+    length = len(music)
+    while offset < count:
+        pos = (first + offset) % length
+        piece = music[pos:pos + count - offset]
+        yield offset, piece
+        offset += len(piece)
+
+
+@dataclass
+class MixChunk:
+    """One timeline chunk, resolved to frames in the mix format."""
+
+    music: np.ndarray
+    start: int
+    frames: int
+    envelope: ChunkEnvelope
+
+
+def plan_chunks(
+    timeline: list[dict],
+    fmt: AudioFormat,
+    fade_ms: int,
+    duck_db: float,
+) -> list[MixChunk]:
+    """
+    Decodes each distinct music file once (or maps it from the PCM cache) and
+    resolves chunk times to frames.
+    """
+    decoded: dict[str, np.ndarray] = {}
+    chunks = []
+    for chunk in timeline:
+        duration_ms = int((chunk["chunk_end"] - chunk["chunk_start"]) * 1000)
+        path = chunk["music_file_path"]
+        if path not in decoded:
+            decoded[path] = load_cached_pcm(path, fmt)
+        if duration_ms <= 0 or not len(decoded[path]):
+            continue
+        chunks.append(MixChunk(
+            music=decoded[path],
+            start=fmt.frames(int(chunk["chunk_start"] * 1000)),
+            frames=fmt.frames(duration_ms),
+            envelope=ChunkEnvelope(fmt, duration_ms, fade_ms, duck_db),
+        ))
+    return chunks
+
+
+def mix_chunk(out: np.ndarray, chunk: MixChunk, first: int = 0, last: Optional[int] = None) -> None:
+    """
+    Adds one faded, ducked, looped music chunk into out in place, saturating to
+    the sample range. Only frames in [first, last) of out are touched.
+    """
+    last = len(out) if last is None else min(last, len(out))
+    first = max(first, chunk.start)
+    last = min(last, chunk.start + chunk.frames)
+    if first >= last:
+        return
+
+    channels = out.shape[1]
+    info = np.iinfo(out.dtype)
+    for block_start in range(first, last, BLOCK_FRAMES):
+        count = min(BLOCK_FRAMES, last - block_start)
+        rel = block_start - chunk.start
+        block = np.empty((count, channels), dtype=np.float32)
+        for offset, piece in _looped(chunk.music, rel, count):
+            block[offset:offset + len(piece)] = piece
+        block *= chunk.envelope.gain(rel, count)
+        np.trunc(block, out=block)
+
+        target = out[block_start:block_start + count]
+        mixed = target.astype(np.int64) + block.astype(np.int64)
+        np.clip(mixed, info.min, info.max, out=mixed)
+        target[:] = mixed
+
+
+# Called as on_segment(index, first_frame, pcm, fmt) once a segment's mix is final
+SegmentCallback = Callable[[int, int, np.ndarray, AudioFormat], None]
+
+
+def mix_to_wav(
+    narration_path: str,
+    timeline: list[dict],
+    output_path: str,
+    fade_duration: int = 2000,
+    duck_db: float = -8,
+    segment_ms: Optional[int] = None,
+    on_segment: Optional[SegmentCallback] = None,
+) -> str:
+    """
+    Mixes the timeline's music under the narration into output_path.
+
+    The narration is stream-converted into the output WAV, which is then
+    memory-mapped and each chunk's music summed into it in place, block by
+    block. Memory use is O(block + music clip) instead of O(narration) per
+    chunk, and the result matches the pydub overlay mix up to rounding.
+
+    With segment_ms set, the mix is produced in timeline order one segment at a
+    time, and on_segment is called with each finished segment so it can be
+    encoded and published while later segments are still being mixed.
+    """
+    music_formats = [read_wav_format(chunk["music_file_path"]) for chunk in timeline]
+    fmt = mix_format(read_wav_format(narration_path), music_formats)
+
+    frames = convert_wav(narration_path, output_path, fmt)
+    if pydub_length(frames, fmt) != frames:
+        frames = pydub_length(frames, fmt)
+        resize_wav(output_path, frames, fmt)
+    if not frames:
+        return output_path
+
+    out = np.memmap(
+        output_path,
+        dtype=fmt.dtype,
+        mode="r+",
+        offset=wav_data_offset(output_path),
+        shape=(frames, fmt.channels),
+    )
+    chunks = plan_chunks(timeline, fmt, fade_duration, duck_db)
+    segment_frames = fmt.frames(segment_ms) if segment_ms else frames
+    for index, first in enumerate(range(0, frames, segment_frames)):
+        last = min(first + segment_frames, frames)
+        for chunk in chunks:
+            mix_chunk(out, chunk, first, last)
+        if on_segment is not None:
+            on_segment(index, first, out[first:last], fmt)
+    out.flush()
+    del out
+    return output_path
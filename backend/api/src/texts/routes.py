@@ -1,116 +1,369 @@
-from fastapi import APIRouter, Depends, File, UploadFile, HTTPException
-from typing import Dict, Any
+import asyncio
+import json
+import re
 
-from .logic import process_text_to_multimodal
+from fastapi import APIRouter, Depends, File, Form, Request, UploadFile, HTTPException
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from typing import Dict, Any, Optional
+
+from .hls import PLAYLIST_NAME
+from .ingest import EmptyDocumentError, UnsupportedUploadError, read_upload_text
+from .jobs import job_manager
+from .encode import AUDIO_FORMATS, CODECS, effective_bitrate, media_type_for, usable_audio_format
+from .logic import HLS_DIR_NAME, NARRATION_NAME, OUTPUT_MODES, OUTPUT_NAME, output_name
+from .store import StoredResult, result_key, result_store
+from .word_timeline import (
+    COMPACT_MEDIA_TYPE,
+    PACKED_MEDIA_TYPE,
+    WORD_TIMING_FORMATS,
+    WordTimeline,
+)
+from api.core.exceptions import NotFoundException
 from api.core.config import settings
 from api.core.logging import get_logger
+from api.core.responses import artifact_response
 import os
 
 logger = get_logger(__name__)
 
 router = APIRouter(prefix="/texts", tags=["texts"])
 
+HLS_FILENAME = re.compile(r"^(playlist\.m3u8|segment_\d{5}\.ts)$")
+
+# Downloadable audio and the stage that has to finish before it is complete
+AUDIO_ARTIFACTS = {
+    NARRATION_NAME: "tts",
+    OUTPUT_NAME: "mixing",
+    **{output_name(audio_format): "encoding" for audio_format in CODECS},
+}
+AUDIO_BITRATE = re.compile(r"^\d{1,3}k$")
+
+# Comment lines sent on an idle event stream so proxies keep it open
+SSE_HEARTBEAT_SECONDS = 15.0
+SSE_FINAL_EVENTS = ("done", "error")
+
+
+def _lookup(
+    text: str, output_mode: str, audio_format: str, audio_bitrate: Optional[str], previous_id: Optional[str]
+) -> tuple[str, Optional[StoredResult]]:
+    key = result_key(text, output_mode, audio_format, audio_bitrate, previous_id)
+    return key, result_store.get(key)
+
+
+def _result_urls(request: Request, result_id: str, audio_name: str) -> Dict[str, str]:
+    return {
+        "status_url": request.url_for("get_job", job_id=result_id).path,
+        "events_url": request.url_for("get_job_events", job_id=result_id).path,
+        "words_url": request.url_for("get_job_words", job_id=result_id).path,
+        "result_url": request.url_for("get_text", result_id=result_id).path,
+        "audio_url": request.url_for("get_job_audio", job_id=result_id, filename=audio_name).path,
+    }
+
 
 @router.post("/")
 async def upload(
+    request: Request,
     file: UploadFile = File(...),
+    output_mode: str = Form("wav"),
+    audio_format: str = Form(settings.AUDIO_FORMAT),
+    audio_bitrate: Optional[str] = Form(None),
+    previous_id: Optional[str] = Form(None),
 ):
 
-    if not file.content_type or not file.content_type.startswith("text/"):
+    if output_mode not in OUTPUT_MODES:
         raise HTTPException(
             status_code=400,
-            detail="Only text files are allowed. Please upload a .txt file.",
+            detail=f"output_mode must be one of: {', '.join(OUTPUT_MODES)}",
         )
-
-    if file.filename and not file.filename.lower().endswith(".txt"):
-        raise HTTPException(status_code=400, detail="File must have .txt extension")
+    if audio_format not in AUDIO_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"audio_format must be one of: {', '.join(AUDIO_FORMATS)}",
+        )
+    if audio_bitrate is not None and not AUDIO_BITRATE.match(audio_bitrate):
+        raise HTTPException(
+            status_code=400, detail="audio_bitrate must be in kbit/s, e.g. 96k"
+        )
+    # Without ffmpeg the mix can only be served as WAV
+    audio_format = usable_audio_format(audio_format)
+    audio_bitrate = effective_bitrate(audio_format, audio_bitrate)
 
     try:
-        # Read file content
-        content = await file.read()
-
-        # Decode as UTF-8 text
-        text = content.decode("utf-8")
+        # Decode (or extract, for PDFs) off the event loop
+        text = await read_upload_text(file)
 
         logger.info(
-            f"Successfully processed text file: {file.filename}, size: {len(content)} bytes"
+            f"Successfully processed file: {file.filename}, size: {file.size} bytes, {len(text)} characters"
+        )
+
+        # Hashing a book-length text and reading the store stay off the event loop
+        key, stored = await run_in_threadpool(
+            _lookup, text, output_mode, audio_format, audio_bitrate, previous_id
         )
+        if stored is not None:
+            logger.info(f"Serving stored result {key} for {file.filename}")
+            return JSONResponse(
+                status_code=200,
+                content={
+                    "job_id": key,
+                    "status": "succeeded",
+                    "cached": True,
+                    **_result_urls(request, key, stored.audio_path),
+                },
+            )
 
         try:
-            processed_data = await process_text_to_multimodal(
+            job = job_manager.submit(
+                key,
                 text,
-                os.getenv("LEMONFOX_API_KEY")
+                os.getenv("LEMONFOX_API_KEY"),
+                file.filename,
+                output_mode,
+                audio_format,
+                audio_bitrate,
+                previous_id,
             )
-            logger.info(f"Successfully proccessed {file.filename} via LemonFox API")
-            return processed_data
-        except Exception as e:
-            logger.warning(f"AI Pipeline failed (likely out of credits): {str(e)}. Falling back to simulation.")
-
-            words = text.split()
-            simulated_data = []
-            current_line = 1
-
-            for i, word in enumerate(words):
-                simulated_data.append({
-                    "word": word,
-                    "start": i * 0.45,
-                    "end": (i * 0.45) + 0.35,
-                    "line": current_line
-                })
-
-                if word.strip()[-1] in ".!?":
-                    current_line += 1
-
-            return simulated_data
-        
-            # return [
-            #     {"word": "The", "start": 0.0, "end": 0.2, "line": 1},
-            #     {"word": "quick", "start": 0.3, "end": 0.6, "line": 1},
-            #     {"word": "brown", "start": 0.7, "end": 1.0, "line": 1},
-            #     {"word": "fox", "start": 1.1, "end": 1.4, "line": 1},
-            #     {"word": "jumped", "start": 1.5, "end": 1.9, "line": 1},
-            #     {"word": "over", "start": 2.0, "end": 2.3, "line": 1},
-            #     {"word": "the", "start": 2.4, "end": 2.6, "line": 1},
-            #     {"word": "lazy", "start": 2.7, "end": 3.0, "line": 1},
-            #     {"word": "dog.", "start": 3.1, "end": 3.5, "line": 1},
-            #     {"word": "This", "start": 4.0, "end": 4.3, "line": 2},
-            #     {"word": "is", "start": 4.4, "end": 4.6, "line": 2},
-            #     {"word": "the", "start": 4.7, "end": 4.9, "line": 2},
-            #     {"word": "second", "start": 5.0, "end": 5.4, "line": 2},
-            #     {"word": "sentence", "start": 5.5, "end": 5.9, "line": 2},
-            #     {"word": "in", "start": 6.0, "end": 6.2, "line": 2},
-            #     {"word": "our", "start": 6.3, "end": 6.5, "line": 2},
-            #     {"word": "sample", "start": 6.6, "end": 6.9, "line": 2},
-            #     {"word": "text.", "start": 7.0, "end": 7.4, "line": 2},
-            #     {"word": "Reading", "start": 8.0, "end": 8.4, "line": 3},
-            #     {"word": "speed", "start": 8.5, "end": 8.8, "line": 3},
-            #     {"word": "can", "start": 8.9, "end": 9.1, "line": 3},
-            #     {"word": "vary", "start": 9.2, "end": 9.5, "line": 3},
-            #     {"word": "depending", "start": 9.6, "end": 10.1, "line": 3},
-            #     {"word": "on", "start": 10.2, "end": 10.4, "line": 3},
-            #     {"word": "the", "start": 10.5, "end": 10.7, "line": 3},
-            #     {"word": "complexity", "start": 10.8, "end": 11.4, "line": 3},
-            #     {"word": "of", "start": 11.5, "end": 11.7, "line": 3},
-            #     {"word": "the", "start": 11.8, "end": 12.0, "line": 3},
-            #     {"word": "content.", "start": 12.1, "end": 12.6, "line": 3},
-            #     {"word": "Each", "start": 13.0, "end": 13.3, "line": 4},
-            #     {"word": "sentence", "start": 13.4, "end": 13.8, "line": 4},
-            #     {"word": "will", "start": 13.9, "end": 14.1, "line": 4},
-            #     {"word": "be", "start": 14.2, "end": 14.4, "line": 4},
-            #     {"word": "highlighted", "start": 14.5, "end": 15.1, "line": 4},
-            #     {"word": "for", "start": 15.2, "end": 15.4, "line": 4},
-            #     {"word": "its", "start": 15.5, "end": 15.7, "line": 4},
-            #     {"word": "entire", "start": 15.8, "end": 16.2, "line": 4},
-            #     {"word": "duration.", "start": 16.3, "end": 18.8, "line": 4},
-            # ]
+        except asyncio.QueueFull:
+            raise HTTPException(
+                status_code=503,
+                detail="Too many texts are being processed. Please try again later.",
+            )
+
+        logger.info(f"Queued {file.filename} as job {job.id}")
+        return JSONResponse(
+            status_code=202,
+            content={
+                "job_id": job.id,
+                "status": job.status,
+                "cached": False,
+                **_result_urls(request, job.id, output_name(job.audio_format)),
+            },
+        )
 
+    except UnsupportedUploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except UnicodeDecodeError as e:
         logger.error(f"Failed to decode file {file.filename} as UTF-8: {str(e)}")
         raise HTTPException(
             status_code=400, detail="File must be valid UTF-8 encoded text"
         )
+    except EmptyDocumentError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing file {file.filename}: {str(e)}")
         raise HTTPException(
             status_code=500, detail="Internal server error while processing file"
         )
+
+
+async def _get_stored(result_id: str) -> StoredResult:
+    stored = await run_in_threadpool(result_store.get, result_id)
+    if stored is None:
+        raise NotFoundException(detail=f"Job {result_id} not found")
+    return stored
+
+
+def _stored_events(stored: StoredResult) -> list[Dict[str, Any]]:
+    # The events a live job would have published, minus stage progress
+    events = [("words", stored.word_timeline), ("chunks", {"chunks": stored.chunks})]
+    events += [("music", chunk) for chunk in stored.music]
+    events.append(("done", {"status": "succeeded", "degraded": False, "error": None}))
+    return [{"id": i, "event": event, "data": data} for i, (event, data) in enumerate(events, 1)]
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        stored = await _get_stored(job_id)
+        return {"status": "succeeded", **stored.summary()}
+    return job.summary()
+
+
+def _word_timing_format(request: Request, format: Optional[str]) -> str:
+    # An explicit ?format= wins; otherwise the first vendor type in Accept
+    if format is not None:
+        if format not in WORD_TIMING_FORMATS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"format must be one of: {', '.join(WORD_TIMING_FORMATS)}",
+            )
+        return format
+    for media_range in request.headers.get("accept", "").split(","):
+        media_type = media_range.split(";", 1)[0].strip()
+        if media_type == PACKED_MEDIA_TYPE:
+            return "packed"
+        if media_type == COMPACT_MEDIA_TYPE:
+            return "compact"
+    return "records"
+
+
+def _format_sse(item: Dict[str, Any], word_format: str = "records") -> str:
+    data = item["data"]
+    if isinstance(data, WordTimeline):
+        data = data.to_compact() if word_format == "compact" else data.to_records()
+    return f"id: {item['id']}\nevent: {item['event']}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.get("/jobs/{job_id}/events")
+async def get_job_events(
+    request: Request,
+    job_id: str,
+    after_id: Optional[int] = None,
+    format: str = "records",
+):
+    """
+    Server-sent events for a job: "stage" on every progress update, then
+    "words", "chunks" and one "music" per clip as each stage produces them,
+    ending with "done" (or "error"). Reconnecting clients resume after the
+    Last-Event-ID header (or ?after_id=) instead of replaying everything.
+    With ?format=compact the "words" event carries the parallel-array form.
+    """
+    if format not in ("records", "compact"):
+        raise HTTPException(status_code=400, detail="format must be records or compact")
+
+    if after_id is None:
+        last_event_id = request.headers.get("last-event-id", "")
+        after_id = int(last_event_id) if last_event_id.isdigit() else 0
+
+    job = job_manager.get(job_id)
+    if job is None:
+        # A stored result replays its events in one go
+        stored = await _get_stored(job_id)
+        body = "".join(_format_sse(item, format) for item in _stored_events(stored)[after_id:])
+        return Response(body, media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    async def stream():
+        queue, backlog = job.subscribe(after_id)
+        last_id = after_id
+        try:
+            for item in backlog:
+                last_id = item["id"]
+                yield _format_sse(item, format)
+                if item["event"] in SSE_FINAL_EVENTS:
+                    return
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(), SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keep-alive\n\n"
+                    continue
+                # Events published while subscribing may be in both the backlog and the queue
+                if item["id"] <= last_id:
+                    continue
+                last_id = item["id"]
+                yield _format_sse(item, format)
+                if item["event"] in SSE_FINAL_EVENTS:
+                    return
+        finally:
+            job.unsubscribe(queue)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/jobs/{job_id}/words")
+async def get_job_words(request: Request, job_id: str, format: Optional[str] = None):
+    """
+    A job's word timings, available as soon as TTS finishes. Served as the
+    per-word JSON list by default, or in the compact parallel-array JSON
+    (COMPACT_MEDIA_TYPE) or packed binary (PACKED_MEDIA_TYPE) form when the
+    client asks for it via Accept or ?format=.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        timeline = (await _get_stored(job_id)).word_timeline
+    else:
+        timeline = job.timeline
+    if timeline is None:
+        raise NotFoundException(detail=f"Word timings for job {job_id} are not ready yet")
+
+    word_format = _word_timing_format(request, format)
+    headers = {"Vary": "Accept"}
+    if word_format == "packed":
+        return Response(timeline.to_packed(), media_type=PACKED_MEDIA_TYPE, headers=headers)
+    if word_format == "compact":
+        return JSONResponse(timeline.to_compact(), media_type=COMPACT_MEDIA_TYPE, headers=headers)
+    return JSONResponse(timeline.to_records(), headers=headers)
+
+
+@router.get("/jobs/{job_id}/hls/{filename}")
+async def get_job_hls(job_id: str, filename: str):
+    job = job_manager.get(job_id)
+    output_dir = job.output_dir if job is not None else (await _get_stored(job_id)).output_dir
+    if not HLS_FILENAME.match(filename):
+        raise NotFoundException(detail=f"{filename} not found")
+
+    path = os.path.join(output_dir, HLS_DIR_NAME, filename)
+    if not os.path.isfile(path):
+        raise NotFoundException(detail=f"{filename} not found")
+
+    if filename == PLAYLIST_NAME:
+        # The playlist grows while the job is mixing; clients must re-fetch it
+        return FileResponse(
+            path,
+            media_type="application/vnd.apple.mpegurl",
+            headers={"Cache-Control": "no-cache"},
+        )
+    return artifact_response(
+        path,
+        media_type="video/mp2t",
+        headers={"Cache-Control": f"public, max-age={settings.AUDIO_CACHE_MAX_AGE}"},
+    )
+
+
+@router.get("/jobs/{job_id}/audio/{filename}")
+async def get_job_audio(job_id: str, filename: str):
+    """
+    A job's narration or final mix (WAV or compressed), once the stage that
+    writes it is done.
+
+    Supports Range requests, so seeking in a long book only fetches the bytes
+    after the seek point, and ETag / If-None-Match revalidation so repeat
+    listens are answered from browser and CDN caches.
+    """
+    if filename not in AUDIO_ARTIFACTS:
+        raise NotFoundException(detail=f"{filename} not found")
+
+    job = job_manager.get(job_id)
+    if job is None:
+        output_dir = (await _get_stored(job_id)).output_dir
+    else:
+        if job.stages[AUDIO_ARTIFACTS[filename]].status != "done":
+            raise NotFoundException(detail=f"{filename} for job {job_id} is not ready yet")
+        output_dir = job.output_dir
+
+    path = os.path.join(output_dir, filename)
+    if not os.path.isfile(path):
+        raise NotFoundException(detail=f"{filename} not found")
+    return artifact_response(
+        path,
+        media_type=media_type_for(filename),
+        headers={"Cache-Control": f"public, max-age={settings.AUDIO_CACHE_MAX_AGE}"},
+    )
+
+
+@router.get("/{result_id}")
+async def get_text(result_id: str):
+    """
+    A finished result from the store: word timings, chunks, music clips and
+    the paths of the mixed audio, served without re-running the pipeline.
+    """
+    stored = await run_in_threadpool(result_store.get, result_id)
+    if stored is None:
+        job = job_manager.get(result_id)
+        if job is not None and not job.finished:
+            return JSONResponse(
+                status_code=202,
+                content={"id": job.id, "status": job.status},
+            )
+        raise NotFoundException(detail=f"Result {result_id} not found")
+    return stored.summary()
@@ -1,10 +1,18 @@
+import asyncio
 import json
-import google.auth
-import google.auth.transport.requests
-import requests
+import httpx
 import base64
 import os # Make sure os is imported
+import random
+import uuid
+
+from api.core.breaker import CircuitOpenError
+from api.core.cache import DiskCache, link_or_copy
+from api.core.concurrency import gather_or_cancel
+from api.core.config import settings
+from api.core.metrics import register_cache
 from .chunkify import BookChunk, ChunksList
+from .google_client import google_client
 
 # --- Configuration ---
 # Replace with your actual Google Cloud Project ID
@@ -12,13 +20,21 @@ PROJECT_ID = "balladai-463622"
 
 # Lyria 2 model endpoint. This is fixed for the public model.
 # Make sure Lyria 2 is available in 'us-central1' in your project.
-MUSIC_MODEL_ENDPOINT = f"https://us-central1-aiplatform.googleapis.com/v1/projects/{PROJECT_ID}/locations/us-central1/publishers/google/models/lyria-002:predict"
+MUSIC_MODEL_ENDPOINT = f"{settings.VERTEX_API_BASE}/v1/projects/{PROJECT_ID}/locations/us-central1/publishers/google/models/lyria-002:predict"
 
 
 # Directory where generated songs will be saved
 SONGS_DIR = "./songs" # Define the directory
 
-def send_request_to_google_api(api_endpoint, data=None):
+# Generated clips keyed by normalized prompt and generation parameters
+MUSIC_ASSET_NAME = "audio.wav"
+music_cache = register_cache(DiskCache(
+    settings.MUSIC_CACHE_DIR,
+    max_bytes=settings.MUSIC_CACHE_MAX_BYTES,
+    name="music",
+))
+
+async def send_request_to_google_api(api_endpoint, data=None):
     """
     Sends an HTTP request to a Google API endpoint.
 
@@ -29,24 +45,13 @@ def send_request_to_google_api(api_endpoint, data=None):
     Returns:
         The response from the Google API.
     """
-    # Get access token using default credentials (will use Cloud Shell's auth)
-    creds, project = google.auth.default()
-    auth_req = google.auth.transport.requests.Request()
-    creds.refresh(auth_req)
-    access_token = creds.token
-
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json",
-    }
-
+    # Credentials and connections are cached on the shared client, so only the
+    # first request (or one close to token expiry) pays for a token exchange
     print(f"Sending request to: {api_endpoint}")
-    response = requests.post(api_endpoint, headers=headers, json=data)
-    response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
-    return response.json()
+    return await google_client.post(api_endpoint, data)
 
 
-def generate_music(prompt_request: dict):
+async def generate_music(prompt_request: dict):
     """
     Generates music using the Lyria 2 model.
 
@@ -58,19 +63,155 @@ def generate_music(prompt_request: dict):
     """
     req = {"instances": [prompt_request], "parameters": {}}
     print(f"Request payload: {json.dumps(req, indent=2)}")
-    resp = send_request_to_google_api(MUSIC_MODEL_ENDPOINT, req)
-    print(resp)
+    resp = await send_request_to_google_api(MUSIC_MODEL_ENDPOINT, req)
+    # The response is mostly base64 audio; printing it would stall the event loop
+    print(f"Lyria returned {len(resp.get('predictions', []))} prediction(s)")
     return resp["predictions"]
 
-def generate_song_chunks(prompt_chunks_list: dict) -> list[dict]:
+async def generate_music_with_retry(prompt_request: dict, max_retries: int, backoff: float):
+    """
+    Calls generate_music, retrying transient failures with exponential backoff.
+
+    Connection errors, timeouts and HTTP 429/5xx responses are retried up to
+    max_retries times, sleeping backoff * 2**attempt seconds (plus jitter) between
+    attempts. Any other error is raised immediately.
+    """
+    attempt = 0
+    while True:
+        try:
+            return await generate_music(prompt_request)
+        except (httpx.HTTPStatusError, httpx.TransportError) as e:
+            status = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else None
+            retryable = status is None or status == 429 or status >= 500
+            if not retryable or attempt >= max_retries:
+                raise
+            delay = backoff * (2 ** attempt) * (1 + random.random() / 2)
+            print(f"Lyria request failed ({e}); retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+def normalize_music_prompt(prompt: str) -> str:
+    """Canonical form of a music prompt: case-folded, single-spaced, no trailing period."""
+    return " ".join(prompt.split()).casefold().rstrip(".")
+
+
+def music_request(music_prompt: str) -> dict:
+    """The Lyria request for a chunk's music prompt."""
+    return {
+        "prompt": music_prompt,
+        "sample_count": 1 # Generate one audio sample per prompt
+    }
+
+
+def music_cache_key(prompt_request: dict) -> str:
+    """Cache key over the normalized prompt and every other generation parameter."""
+    params = {k: v for k, v in prompt_request.items() if k != "prompt"}
+    return music_cache.make_key(
+        MUSIC_MODEL_ENDPOINT,
+        normalize_music_prompt(prompt_request["prompt"]),
+        params,
+    )
+
+
+def _chunk_filename(songs_dir: str, i: int, chunk_data: dict) -> str:
+    starting_line = chunk_data.get("starting_line_number")
+    ending_line = chunk_data.get("ending_line_number")
+    return os.path.join(songs_dir, f"lyria_chunk_{i+1}_lines_{starting_line}-{ending_line}.wav")
+
+
+def _link_cached_asset(cache_key: str, output_filenames: list[str]) -> bool:
+    entry = music_cache.get(cache_key)
+    if entry is None:
+        return False
+    try:
+        for output_filename in output_filenames:
+            link_or_copy(os.path.join(entry, MUSIC_ASSET_NAME), output_filename)
+        return True
+    except FileNotFoundError:
+        return False  # Evicted between lookup and read; generate again
+
+
+def _save_asset(cache_key: str, bytes_b64: str, output_filenames: list[str]) -> None:
+    decoded_audio_data = base64.b64decode(bytes_b64)
+
+    print("writing to audio file")
+    first, *rest = output_filenames
+    # A file left by an earlier run of the job may be a hard link into the
+    # music cache; writing through it would change the cached clip in place
+    tmp = f"{first}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(decoded_audio_data)
+    os.replace(tmp, first)
+    for output_filename in rest:
+        link_or_copy(first, output_filename)
+    print(f"Saved audio to: {output_filenames}")
+
+    music_cache.put(cache_key, {MUSIC_ASSET_NAME: first})
+
+
+async def _generate_asset(cache_key: str, prompt_request: dict, output_filenames: list[str],
+                          max_retries: int, backoff: float, on_file_ready=None):
+    """
+    Produces the audio for one unique prompt and places it at every output filename.
+
+    The music cache is consulted first; on a miss Lyria is called once and the
+    result stored, no matter how many chunks share the prompt. Decoding and
+    file I/O run on a worker thread.
+    """
+    if await asyncio.to_thread(_link_cached_asset, cache_key, output_filenames):
+        print(f"Reused cached music for: {output_filenames}")
+        if on_file_ready is not None:
+            for output_filename in output_filenames:
+                on_file_ready(output_filename)
+        return
+
+    print(f"Request: {prompt_request}")
+
+    # Generate music
+    predictions = await generate_music_with_retry(prompt_request, max_retries, backoff)
+    if not predictions:
+        raise ValueError(f"Lyria returned no predictions for prompt: {prompt_request['prompt']}")
+
+    # Assuming we get at least one prediction and want the first one
+    await asyncio.to_thread(_save_asset, cache_key, predictions[0]["bytesBase64Encoded"], output_filenames)
+    if on_file_ready is not None:
+        for output_filename in output_filenames:
+            on_file_ready(output_filename)
+
+
+async def generate_song_chunks(
+    prompt_chunks_list: dict,
+    songs_dir: str = SONGS_DIR,
+    max_concurrency: int = settings.MUSIC_CONCURRENCY,
+    max_retries: int = settings.MUSIC_MAX_RETRIES,
+    retry_backoff: float = settings.MUSIC_RETRY_BACKOFF,
+    on_chunk_ready=None,
+    allow_missing: bool = False,
+) -> list[dict]:
     """
     Iterates through a list of book chunks, generates music for each chunk's prompt,
-    saves the generated audio to the SONGS_DIR, and returns a list of dictionaries with
+    saves the generated audio to songs_dir, and returns a list of dictionaries with
     music file paths and line numbers.
 
+    Chunks whose prompts normalize to the same text (with the same generation
+    parameters) share a single Lyria call, and prompts already generated by an
+    earlier upload are served from the music cache. Up to max_concurrency Lyria
+    requests are in flight at once, so total wall time approaches the slowest
+    single chunk rather than the sum of all of them. The returned list is always
+    in chunk order regardless of completion order.
+
     Args:
         prompt_chunks_list: A dictionary in the format of ChunksList,
                             e.g., {"chunks": [{"music_prompt": "...", "starting_line_number": ..., ...}]}
+        songs_dir: Directory the generated WAV files are written to (defaults to SONGS_DIR).
+        max_concurrency: Maximum number of prompts generated in parallel (1 = serial).
+        max_retries: Retries per prompt for transient Lyria failures.
+        retry_backoff: Base delay in seconds for the exponential retry backoff.
+        on_chunk_ready: Optional callback, called on the event loop with each
+                        chunk's result dictionary as soon as its file is written.
+        allow_missing: While Lyria's circuit breaker is open, leave out the chunks
+                       whose music isn't cached instead of raising CircuitOpenError.
 
     Returns:
         A list of dictionaries, where each dictionary contains:
@@ -79,48 +220,60 @@ def generate_song_chunks(prompt_chunks_list: dict) -> list[dict]:
         - "end_line": The ending line number of the text chunk.
     """
     # Create the songs directory if it doesn't exist
-    os.makedirs(SONGS_DIR, exist_ok=True)
-    print(f"Ensured '{SONGS_DIR}' directory exists.")
+    os.makedirs(songs_dir, exist_ok=True)
+    print(f"Ensured '{songs_dir}' directory exists.")
 
     processed_chunks = []
+    # Unique generation requests, each with the output files that need its audio
+    assets: dict[str, tuple[dict, list[str]]] = {}
+
     # Access the 'chunks' list within the passed dictionary
     for i, chunk_data in enumerate(prompt_chunks_list.get("chunks", [])):
         music_prompt = chunk_data.get("music_prompt")
-        starting_line = chunk_data.get("starting_line_number")
-        ending_line = chunk_data.get("ending_line_number")
-
         if not music_prompt:
             print(f"Warning: Chunk {i} has no music_prompt. Skipping music generation.")
             continue
 
-        print(f"\n--- Generating music for Chunk {i+1} (Lines {starting_line}-{ending_line}) ---")
         # Prepare the prompt for the Lyria model
-        lyria_prompt_request = {
-            "prompt": music_prompt,
-            "sample_count": 1 # Generate one audio sample per prompt
-        }
-
-        print(f"Request {i}: {lyria_prompt_request}")
-
-        # Generate music
-        predictions = generate_music(lyria_prompt_request)
-        print(predictions) 
-        if predictions:
-            # Assuming we get at least one prediction and want the first one
-            bytes_b64 = predictions[0]["bytesBase64Encoded"]
-            decoded_audio_data = base64.b64decode(bytes_b64)
-
-        print("writing to audio file")
-        # Create a unique filename for the audio chunk within the SONGS_DIR
-        output_filename = os.path.join(SONGS_DIR, f"lyria_chunk_{i+1}_lines_{starting_line}-{ending_line}.wav")
-        with open(output_filename, "wb") as f:
-            f.write(decoded_audio_data)
-        print(f"Saved audio for chunk {i+1} to: {output_filename}")
+        lyria_prompt_request = music_request(music_prompt)
+        output_filename = _chunk_filename(songs_dir, i, chunk_data)
+        assets.setdefault(music_cache_key(lyria_prompt_request), (lyria_prompt_request, []))[1].append(output_filename)
 
         processed_chunks.append({
             "music_file_path": output_filename, # This now stores the path to the actual file
-            "start_line": starting_line,
-            "end_line": ending_line,
+            "start_line": chunk_data.get("starting_line_number"),
+            "end_line": chunk_data.get("ending_line_number"),
         })
 
-    return processed_chunks
\ No newline at end of file
+    if not assets:
+        return []
+
+    on_file_ready = None
+    if on_chunk_ready is not None:
+        by_filename = {chunk["music_file_path"]: chunk for chunk in processed_chunks}
+
+        def on_file_ready(output_filename):
+            on_chunk_ready(by_filename[output_filename])
+
+    print(f"--- Generating music for {len(processed_chunks)} chunks ({len(assets)} unique prompts) ---")
+
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    missing: set[str] = set()
+
+    async def generate(key, request, filenames):
+        async with semaphore:
+            try:
+                await _generate_asset(key, request, filenames, max_retries, retry_backoff, on_file_ready)
+            except CircuitOpenError as e:
+                if not allow_missing:
+                    raise
+                print(f"Skipping music for {filenames}: {e}")
+                missing.update(filenames)
+
+    # Prompts still waiting or in flight are cancelled once one has failed for good
+    await gather_or_cancel(
+        (generate(key, request, filenames) for key, (request, filenames) in assets.items()),
+        serial_while=lambda: not google_client.breaker.closed,
+    )
+
+    return [chunk for chunk in processed_chunks if chunk["music_file_path"] not in missing]
@@ -0,0 +1,182 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import Any, Optional
+
+from pydantic import BaseModel
+
+from api.core.cache import DiskCache
+from api.core.config import settings
+from api.core.logging import get_logger
+from .chunkify import INSTRUCTION
+from .encode import effective_bitrate
+from .lemon_fox import DEFAULT_VOICE
+from .logic import PipelineResult
+from .word_timeline import WordTimeline
+
+logger = get_logger(__name__)
+
+# Bump when a pipeline change makes stored results stale for the same input
+RESULT_FORMAT_VERSION = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id TEXT PRIMARY KEY,
+    filename TEXT,
+    output_mode TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    word_timeline BLOB NOT NULL,
+    chunks TEXT NOT NULL,
+    music TEXT NOT NULL,
+    output_dir TEXT NOT NULL,
+    audio_path TEXT NOT NULL,
+    hls_playlist TEXT
+)
+"""
+
+
+def result_key(
+    text: str,
+    output_mode: str,
+    audio_format: str = settings.AUDIO_FORMAT,
+    audio_bitrate: Optional[str] = None,
+    previous_id: Optional[str] = None,
+) -> str:
+    """
+    Content hash of an upload plus every setting that changes the pipeline's
+    output, including the result an edited upload builds on.
+    """
+    return DiskCache.make_key(
+        RESULT_FORMAT_VERSION,
+        text,
+        previous_id,
+        output_mode,
+        audio_format,
+        effective_bitrate(audio_format, audio_bitrate),
+        DEFAULT_VOICE,
+        settings.TTS_SHARD_CHARS,
+        settings.TTS_SHARD_ALIGN_SECONDS,
+        settings.CHUNKING_MODEL,
+        INSTRUCTION,
+        settings.CHUNK_WINDOW_LINES,
+        settings.CHUNK_WINDOW_OVERLAP,
+        settings.MIX_ENGINE,
+        settings.HLS_SEGMENT_SECONDS if output_mode == "hls" else None,
+        settings.HLS_BITRATE if output_mode == "hls" else None,
+    )
+
+
+class StoredResult(BaseModel):
+    id: str
+    filename: Optional[str] = None
+    output_mode: str
+    created_at: float
+    chunks: list[dict[str, Any]]
+    music: list[dict[str, Any]]
+    audio_path: str
+    hls_playlist: Optional[str] = None
+    output_dir: str
+
+    _word_timeline_blob: bytes = b""
+
+    @property
+    def word_timeline(self) -> WordTimeline:
+        return WordTimeline.from_packed(self._word_timeline_blob)
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            **self.model_dump(exclude={"output_dir"}),
+            "result": self.word_timeline.to_records(),
+        }
+
+
+class ResultStore:
+    """
+    Finished pipeline results, persisted across restarts.
+
+    Metadata, the packed word timeline and the chunk/music lists live in one
+    SQLite table keyed by result_key(); the audio files stay in the job's
+    output directory, which rows reference along with each file's path
+    relative to it. A row is only written once every artifact is on disk, so a
+    stored result is always complete.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+                    with closing(sqlite3.connect(self.db_path)) as conn, conn:
+                        conn.execute("PRAGMA journal_mode=WAL")
+                        conn.execute(_SCHEMA)
+                    self._initialized = True
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def save(
+        self,
+        result_id: str,
+        filename: Optional[str],
+        output_mode: str,
+        output_dir: str,
+        result: PipelineResult,
+    ) -> None:
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    result_id,
+                    filename,
+                    output_mode,
+                    time.time(),
+                    result.word_timeline.to_packed(),
+                    json.dumps(result.chunks),
+                    json.dumps(result.music),
+                    os.path.abspath(output_dir),
+                    result.audio_path,
+                    result.hls_playlist,
+                ),
+            )
+        logger.info(f"Stored result {result_id}")
+
+    def get(self, result_id: str) -> Optional[StoredResult]:
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT id, filename, output_mode, created_at, word_timeline, chunks, music,"
+                " output_dir, audio_path, hls_playlist FROM results WHERE id = ?",
+                (result_id,),
+            ).fetchone()
+        if row is None:
+            return None
+
+        stored = StoredResult(
+            id=row[0],
+            filename=row[1],
+            output_mode=row[2],
+            created_at=row[3],
+            chunks=json.loads(row[5]),
+            music=json.loads(row[6]),
+            output_dir=row[7],
+            audio_path=row[8],
+            hls_playlist=row[9],
+        )
+        if not os.path.isfile(os.path.join(stored.output_dir, stored.audio_path)):
+            # Artifacts were removed behind our back; treat as never computed
+            self.delete(result_id)
+            return None
+        stored._word_timeline_blob = row[4]
+        return stored
+
+    def delete(self, result_id: str) -> None:
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM results WHERE id = ?", (result_id,))
+
+
+result_store = ResultStore(settings.RESULTS_DB)
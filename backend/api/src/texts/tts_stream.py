@@ -0,0 +1,166 @@
+import base64
+import json
+from typing import Any, BinaryIO
+
+_WHITESPACE = b" \t\r\n"
+_BRACKETS_OPEN = b"{["
+_BRACKETS_CLOSE = b"}]"
+
+
+class StreamingJSONAudioParser:
+    """
+    Incremental parser for a JSON object carrying base64 audio in one of its fields.
+
+    Bytes are fed in as they arrive from the network. The audio string is
+    base64-decoded on the fly and written straight to ``audio_out``; every other
+    top-level value is kept as raw JSON text and decoded by :meth:`close`. Memory
+    use is bounded by the non-audio fields (e.g. word timestamps) plus one
+    network block, no matter how long the audio is.
+    """
+
+    def __init__(self, audio_out: BinaryIO, audio_key: str = "audio"):
+        self.audio_out = audio_out
+        self.audio_key = audio_key
+        self.audio_bytes = 0
+        self.fields: dict[str, Any] = {}
+        self._state = "object_start"
+        self._key = bytearray()
+        self._current_key = ""
+        self._raw = bytearray()
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._b64 = bytearray()
+        self._seen_audio = False
+
+    def feed(self, data: bytes) -> None:
+        i = 0
+        n = len(data)
+        while i < n:
+            state = self._state
+            if state == "audio":
+                i = self._feed_audio(data, i)
+                continue
+
+            c = data[i]
+            if state == "object_start":
+                if c == ord("{"):
+                    self._state = "key"
+                elif c not in _WHITESPACE:
+                    raise ValueError("Expected a JSON object")
+            elif state == "key":
+                if c == ord('"'):
+                    self._key.clear()
+                    self._state = "key_string"
+                elif c == ord("}"):
+                    self._state = "done"
+                elif c not in _WHITESPACE and c != ord(","):
+                    raise ValueError(f"Unexpected byte {chr(c)!r} before object key")
+            elif state == "key_string":
+                if self._escape:
+                    self._escape = False
+                    self._key.append(c)
+                elif c == ord("\\"):
+                    self._escape = True
+                    self._key.append(c)
+                elif c == ord('"'):
+                    self._current_key = json.loads(b'"' + bytes(self._key) + b'"')
+                    self._state = "colon"
+                else:
+                    self._key.append(c)
+            elif state == "colon":
+                if c == ord(":"):
+                    self._state = "value"
+                elif c not in _WHITESPACE:
+                    raise ValueError("Expected ':' after object key")
+            elif state == "value":
+                if c in _WHITESPACE:
+                    pass
+                elif self._current_key == self.audio_key and c == ord('"'):
+                    self._seen_audio = True
+                    self._state = "audio"
+                else:
+                    self._raw.clear()
+                    self._depth = 0
+                    self._state = "raw"
+                    continue  # Re-read this byte as the start of the raw value
+            elif state == "raw":
+                i = self._feed_raw(data, i)
+                continue
+            elif state == "done":
+                if c not in _WHITESPACE:
+                    raise ValueError("Trailing data after JSON object")
+            i += 1
+
+    def _feed_audio(self, data: bytes, i: int) -> int:
+        # Copy everything up to the next quote or escape into the base64 buffer
+        quote = data.find(b'"', i)
+        backslash = data.find(b"\\", i)
+        stops = [pos for pos in (quote, backslash) if pos != -1]
+        end = min(stops) if stops else len(data)
+
+        if self._escape:
+            # Only "\/" can appear inside a base64 string
+            if data[i] != ord("/"):
+                raise ValueError("Unexpected escape sequence in audio field")
+            self._escape = False
+            self._b64.append(ord("/"))
+            return i + 1
+
+        self._b64 += data[i:end]
+        self._flush_audio(final=False)
+        if end == len(data):
+            return end
+        if end == backslash:
+            self._escape = True
+            return end + 1
+
+        self._flush_audio(final=True)
+        self._state = "key"
+        return end + 1
+
+    def _flush_audio(self, final: bool) -> None:
+        usable = len(self._b64) if final else len(self._b64) - len(self._b64) % 4
+        if not usable:
+            return
+        decoded = base64.b64decode(bytes(self._b64[:usable]))
+        del self._b64[:usable]
+        self.audio_out.write(decoded)
+        self.audio_bytes += len(decoded)
+
+    def _feed_raw(self, data: bytes, i: int) -> int:
+        # Consume one top-level value; it ends at a depth-0 ',' or the closing '}'
+        start = i
+        n = len(data)
+        while i < n:
+            c = data[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == ord("\\"):
+                    self._escape = True
+                elif c == ord('"'):
+                    self._in_string = False
+            elif c == ord('"'):
+                self._in_string = True
+            elif c in _BRACKETS_OPEN:
+                self._depth += 1
+            elif c in _BRACKETS_CLOSE and self._depth > 0:
+                self._depth -= 1
+            elif self._depth == 0 and (c == ord(",") or c == ord("}")):
+                self._raw += data[start:i]
+                self.fields[self._current_key] = json.loads(bytes(self._raw))
+                self._raw.clear()
+                self._state = "key" if c == ord(",") else "done"
+                return i + 1
+            i += 1
+        self._raw += data[start:i]
+        return i
+
+    def close(self) -> dict[str, Any]:
+        """Finishes parsing and returns the decoded non-audio fields."""
+        if self._state != "done":
+            raise ValueError("Truncated JSON response")
+        if not self._seen_audio:
+            raise ValueError(f"Response has no {self.audio_key!r} field")
+        return self.fields
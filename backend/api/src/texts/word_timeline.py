@@ -0,0 +1,236 @@
+import string
+import struct
+from typing import Any, Iterable, Optional
+
+import numpy as np
+
+_STRIP_CHARS = ".,?!;:\"“”‘’()[]"
+
+# Representations served for a job's word timings, picked via the Accept header
+RECORDS_MEDIA_TYPE = "application/json"
+COMPACT_MEDIA_TYPE = "application/vnd.ballad.word-timings+json"
+PACKED_MEDIA_TYPE = "application/vnd.ballad.word-timings"
+WORD_TIMING_FORMATS = {
+    "records": RECORDS_MEDIA_TYPE,
+    "compact": COMPACT_MEDIA_TYPE,
+    "packed": PACKED_MEDIA_TYPE,
+}
+
+# magic, version, word count, distinct words, line offsets, word table bytes
+PACKED_HEADER = struct.Struct("<4sHxxIIII")
+PACKED_MAGIC = b"BWT1"
+PACKED_VERSION = 1
+
+
+def _is_punctuation(word: str) -> bool:
+    return all(char in string.punctuation for char in word)
+
+
+class WordTimeline:
+    """
+    Column-oriented word timings for one narration.
+
+    Instead of one dict per word, timings live in parallel arrays (start, end,
+    line) with each distinct word spelling stored once in ``words`` and
+    referenced by index. Built once per job and shared by every later stage.
+
+    Lines are non-decreasing in word order (unmatched words, line -1, can
+    only trail), so the words of any line range are one contiguous slice;
+    ``line_offsets[n]`` is the index of the first word on line n or later.
+    """
+
+    def __init__(
+        self,
+        words: list[str],
+        word_ids: np.ndarray,
+        start: np.ndarray,
+        end: np.ndarray,
+        line: np.ndarray,
+    ):
+        self.words = words
+        self.word_ids = word_ids
+        self.start = start
+        self.end = end
+        self.line = line
+
+        matched = int(np.count_nonzero(line >= 0))
+        line_count = int(line[:matched].max()) + 1 if matched else 0
+        self.line_offsets = np.searchsorted(line[:matched], np.arange(line_count + 1))
+        # Earliest start from each word onwards and latest end up to each word,
+        # so a span's bounds are two lookups; exact for in-order timings
+        self._min_start_after = np.minimum.accumulate(start[::-1])[::-1]
+        self._max_end_before = np.maximum.accumulate(end)
+
+    @classmethod
+    def build(cls, word_timestamps: Iterable[dict], word_to_line: list[tuple[str, int]]) -> "WordTimeline":
+        """
+        Aligns TTS word timestamps with the annotated text's line numbers.
+
+        Punctuation-only tokens are dropped; each remaining word is matched to
+        the next entry of word_to_line with the same cleaned spelling, and gets
+        line -1 once no match is left.
+        """
+        interned: dict[str, int] = {}
+        word_ids, starts, ends, lines = [], [], [], []
+        idx = 0
+
+        for ts in word_timestamps:
+            raw = ts["word"]
+            if _is_punctuation(raw):
+                continue
+            word = raw.lower().strip(_STRIP_CHARS)
+
+            # Try to find the next matching word in the word_to_line list
+            while idx < len(word_to_line) and word != word_to_line[idx][0]:
+                idx += 1
+
+            if idx < len(word_to_line):
+                line = word_to_line[idx][1]
+                idx += 1
+            else:
+                line = -1  # fallback if no match found
+
+            word_ids.append(interned.setdefault(raw, len(interned)))
+            starts.append(ts["start"])
+            ends.append(ts["end"])
+            lines.append(line)
+
+        return cls(
+            words=list(interned),
+            word_ids=np.array(word_ids, dtype=np.int32),
+            start=np.array(starts, dtype=np.float64),
+            end=np.array(ends, dtype=np.float64),
+            line=np.array(lines, dtype=np.int32),
+        )
+
+    @classmethod
+    def from_records(cls, records: Iterable[dict]) -> "WordTimeline":
+        """Builds a timeline from already merged {"word", "start", "end", "line"} dicts."""
+        interned: dict[str, int] = {}
+        word_ids, starts, ends, lines = [], [], [], []
+        for record in records:
+            word_ids.append(interned.setdefault(record["word"], len(interned)))
+            starts.append(record["start"])
+            ends.append(record["end"])
+            lines.append(record["line"])
+        return cls(
+            words=list(interned),
+            word_ids=np.array(word_ids, dtype=np.int32),
+            start=np.array(starts, dtype=np.float64),
+            end=np.array(ends, dtype=np.float64),
+            line=np.array(lines, dtype=np.int32),
+        )
+
+    def __len__(self) -> int:
+        return len(self.start)
+
+    @property
+    def line_count(self) -> int:
+        return len(self.line_offsets) - 1
+
+    def word(self, index: int) -> str:
+        return self.words[self.word_ids[index]]
+
+    def line_words(self, start_line: int, end_line: int) -> tuple[int, int]:
+        """Half-open word index range covering lines start_line..end_line inclusive."""
+        start_line = max(start_line, 0)
+        end_line = min(end_line, self.line_count - 1)
+        if start_line > end_line:
+            return 0, 0
+        return int(self.line_offsets[start_line]), int(self.line_offsets[end_line + 1])
+
+    def line_texts(self) -> list[str]:
+        """The words of every line joined by spaces, indexed by line number."""
+        return [
+            " ".join(self.word(i) for i in range(first, last))
+            for first, last in zip(self.line_offsets[:-1].tolist(), self.line_offsets[1:].tolist())
+        ]
+
+    def span(self, start_line: int, end_line: int) -> Optional[tuple[float, float]]:
+        """Start and end time of lines start_line..end_line, or None if they have no words."""
+        first, last = self.line_words(start_line, end_line)
+        if first >= last:
+            return None
+        return float(self._min_start_after[first]), float(self._max_end_before[last - 1])
+
+    def line_at(self, t: float) -> Optional[int]:
+        """Line of the latest word starting at or before t (binary search)."""
+        index = int(np.searchsorted(self.start, t, side="right")) - 1
+        if index < 0:
+            return None
+        return int(self.line[index])
+
+    def to_records(self) -> list[dict[str, Any]]:
+        """The per-word dicts the API has always returned."""
+        words = self.words
+        return [
+            {"word": words[word_id], "start": start, "end": end, "line": line}
+            for word_id, start, end, line in zip(
+                self.word_ids.tolist(), self.start.tolist(), self.end.tolist(), self.line.tolist()
+            )
+        ]
+
+    def to_compact(self) -> dict[str, Any]:
+        """
+        Parallel-array form of the timings, with times quantized to integer
+        milliseconds and the line index included so clients can find a line's
+        words without scanning.
+        """
+        return {
+            "count": len(self),
+            "words": self.words,
+            "word_ids": self.word_ids.tolist(),
+            "start_ms": _to_ms(self.start).tolist(),
+            "end_ms": _to_ms(self.end).tolist(),
+            "line": self.line.tolist(),
+            "line_offsets": self.line_offsets.tolist(),
+        }
+
+    def to_packed(self) -> bytes:
+        """
+        Binary form of to_compact(): a fixed header, then little-endian
+        start_ms, end_ms (uint32), line (int32) and word_ids (uint32) arrays of
+        ``count`` items, line_offsets (uint32), and finally the word table as
+        NUL-separated UTF-8. Every array starts 4-byte aligned so clients can
+        view them as typed arrays without copying.
+        """
+        table = "\0".join(self.words).encode("utf-8")
+        header = PACKED_HEADER.pack(
+            PACKED_MAGIC, PACKED_VERSION, len(self), len(self.words), len(self.line_offsets), len(table)
+        )
+        return b"".join([
+            header,
+            _to_ms(self.start).astype("<u4").tobytes(),
+            _to_ms(self.end).astype("<u4").tobytes(),
+            self.line.astype("<i4").tobytes(),
+            self.word_ids.astype("<u4").tobytes(),
+            self.line_offsets.astype("<u4").tobytes(),
+            table,
+        ])
+
+    @classmethod
+    def from_packed(cls, data: bytes) -> "WordTimeline":
+        """Inverse of to_packed(), up to the millisecond quantization."""
+        magic, version, count, word_count, offset_count, table_bytes = PACKED_HEADER.unpack_from(data)
+        if magic != PACKED_MAGIC or version != PACKED_VERSION:
+            raise ValueError("Not a packed word timeline")
+
+        def take(dtype: str, n: int) -> np.ndarray:
+            nonlocal pos
+            array = np.frombuffer(data, dtype=dtype, count=n, offset=pos)
+            pos += array.nbytes
+            return array
+
+        pos = PACKED_HEADER.size
+        start = take("<u4", count) / 1000
+        end = take("<u4", count) / 1000
+        line = take("<i4", count).astype(np.int32)
+        word_ids = take("<u4", count).astype(np.int32)
+        take("<u4", offset_count)  # Rebuilt by __init__
+        table = data[pos:pos + table_bytes].decode("utf-8")
+        words = table.split("\0") if word_count else []
+        return cls(words, word_ids, start, end, line)
+
+
+def _to_ms(seconds: np.ndarray) -> np.ndarray:
+    return np.rint(seconds * 1000).astype(np.int64)
@@ -0,0 +1,179 @@
+"""
+/health latency while uploads are being processed.
+
+Starts the API under uvicorn against the local provider fakes
+(benchmarks.fake_providers), measures /health latency while idle, then
+submits several distinct uploads at once and keeps measuring until every
+job has finished. With the pipeline running on the event loop without
+blocking it, the loaded percentiles should stay close to the idle ones.
+
+Usage (from backend/):
+    python -m benchmarks.bench_health
+    python -m benchmarks.bench_health --uploads 8 --copies 2 --interval 0.02
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.fake_providers import FakeProviders, provider_env
+
+TEXT_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "data", "the_lottery.txt")
+BACKEND_DIR = os.path.join(os.path.dirname(__file__), "..")
+
+
+def _serve_fakes(word_ms: int, music_seconds: float, urls, stop) -> None:
+    # The fakes build large base64 payloads; in their own process they don't
+    # compete with the measuring client for the GIL
+    with FakeProviders(word_ms=word_ms, music_seconds=music_seconds) as fakes:
+        urls.put(fakes.url)
+        stop.wait()
+        urls.put(dict(fakes.requests))
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _summary(samples: list[float]) -> str:
+    ms = sorted(s * 1000 for s in samples)
+    pick = lambda q: ms[min(len(ms) - 1, int(q * len(ms)))]
+    return (
+        f"n={len(ms):<5} p50={statistics.median(ms):7.2f} ms  p95={pick(0.95):7.2f} ms"
+        f"  p99={pick(0.99):7.2f} ms  max={ms[-1]:7.2f} ms"
+    )
+
+
+async def _sample_health(client: httpx.AsyncClient, interval: float, stop: asyncio.Event) -> list[float]:
+    samples = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        response = await client.get("/health")
+        samples.append(time.perf_counter() - start)
+        response.raise_for_status()
+        await asyncio.sleep(interval)
+    return samples
+
+
+async def _run_upload(client: httpx.AsyncClient, text: str, n: int, audio_format: str) -> float:
+    start = time.perf_counter()
+    response = await client.post(
+        "/texts/",
+        files={"file": (f"bench_{n}.txt", text.encode("utf-8"), "text/plain")},
+        data={"audio_format": audio_format},
+    )
+    response.raise_for_status()
+    status_url = response.json()["status_url"]
+    while True:
+        job = (await client.get(status_url)).json()
+        if job["status"] in ("succeeded", "failed"):
+            if job.get("degraded"):
+                print(f"  upload {n} degraded: {job.get('error')}")
+            return time.perf_counter() - start
+        await asyncio.sleep(0.5)
+
+
+async def _measure(base_url: str, texts: list[str], idle_seconds: float, interval: float, audio_format: str):
+    async with httpx.AsyncClient(base_url=base_url, timeout=600) as client:
+        stop = asyncio.Event()
+        idle = asyncio.create_task(_sample_health(client, interval, stop))
+        await asyncio.sleep(idle_seconds)
+        stop.set()
+        idle_samples = await idle
+
+        stop = asyncio.Event()
+        loaded = asyncio.create_task(_sample_health(client, interval, stop))
+        start = time.perf_counter()
+        durations = await asyncio.gather(
+            *(_run_upload(client, text, n, audio_format) for n, text in enumerate(texts))
+        )
+        stop.set()
+        loaded_samples = await loaded
+        return idle_samples, loaded_samples, durations, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uploads", type=int, default=4, help="uploads submitted at once")
+    parser.add_argument("--copies", type=int, default=1, help="copies of the text per upload")
+    parser.add_argument("--interval", type=float, default=0.05, help="seconds between /health probes")
+    parser.add_argument("--idle-seconds", type=float, default=3.0)
+    parser.add_argument("--word-ms", type=int, default=100)
+    parser.add_argument("--music-seconds", type=float, default=10.0)
+    parser.add_argument("--audio-format", default="opus")
+    args = parser.parse_args()
+
+    with open(TEXT_PATH, encoding="utf-8") as f:
+        text = "\n\n".join([f.read()] * args.copies)
+    # Distinct texts, so no upload is answered from the result store
+    texts = [f"Reading {n + 1}.\n\n{text}" for n in range(args.uploads)]
+
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    ctx = multiprocessing.get_context("spawn")
+    urls, stop = ctx.Queue(), ctx.Event()
+    fakes = ctx.Process(target=_serve_fakes, args=(args.word_ms, args.music_seconds, urls, stop))
+    fakes.start()
+    fakes_url = urls.get(timeout=60)
+    with tempfile.TemporaryDirectory() as workdir:
+        env = {
+            **os.environ,
+            **provider_env(fakes_url),
+            "JOBS_DIR": os.path.join(workdir, "jobs"),
+            "RESULTS_DB": os.path.join(workdir, "results.sqlite3"),
+            "TTS_CACHE_DIR": os.path.join(workdir, "cache", "tts"),
+            "CHUNK_CACHE_DIR": os.path.join(workdir, "cache", "chunks"),
+            "MUSIC_CACHE_DIR": os.path.join(workdir, "cache", "music"),
+            "ENCODE_CACHE_DIR": os.path.join(workdir, "cache", "encode"),
+            "PCM_CACHE_DIR": os.path.join(workdir, "cache", "pcm"),
+            "DEBUG": "false",
+        }
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "api.main:app", "--port", str(port), "--log-level", "warning"],
+            cwd=BACKEND_DIR,
+            env=env,
+            stdout=subprocess.DEVNULL,
+        )
+        try:
+            deadline = time.monotonic() + 60
+            while True:
+                try:
+                    httpx.get(f"{base_url}/health").raise_for_status()
+                    break
+                except httpx.HTTPError:
+                    if server.poll() is not None or time.monotonic() > deadline:
+                        raise RuntimeError("API server did not start")
+                    time.sleep(0.2)
+
+            idle, loaded, durations, wall = asyncio.run(
+                _measure(base_url, texts, args.idle_seconds, args.interval, args.audio_format)
+            )
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+            stop.set()
+            requests = urls.get(timeout=30)
+            fakes.join()
+
+    print(f"/health idle:    {_summary(idle)}")
+    print(f"/health loaded:  {_summary(loaded)}")
+    print(
+        f"{args.uploads} uploads x{args.copies}: wall {wall:.1f} s,"
+        f" per job {min(durations):.1f}-{max(durations):.1f} s"
+    )
+    calls = ", ".join(f"{name} {count}" for name, count in sorted(requests.items()))
+    print(f"fake provider calls: {calls}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Benchmark the orchestrate_audio mixing engines on a synthetic narration.
+
+Generates a narration (24 kHz mono, like LemonFox) and a few 30 s music clips
+(48 kHz stereo, like Lyria), then mixes them with each engine in its own
+process so peak RSS is measured independently. The numpy engine runs a
+second time with the PCM cache its first run filled ("numpy-warm"). When
+both engines run, the outputs are compared sample by sample.
+
+--check-short-chunks instead runs a regression check on chunks shorter
+than the fade, where the numpy engine clamps the fades and deliberately
+differs from pydub (see mixer.ChunkEnvelope). It exits non-zero on failure.
+
+Usage (from backend/):
+    python -m benchmarks.bench_mixer --minutes 60 --chunks 20
+    python -m benchmarks.bench_mixer --minutes 5 --engines numpy
+    python -m benchmarks.bench_mixer --check-short-chunks
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+from api.src.texts.lemon_fox import orchestrate_audio
+from api.src.texts.mixer import read_wav_format, wav_data_offset
+
+
+def write_wav(path, pcm: np.ndarray, frame_rate: int):
+    with wave.open(path, "wb") as f:
+        f.setnchannels(pcm.shape[1])
+        f.setsampwidth(2)
+        f.setframerate(frame_rate)
+        f.writeframes(pcm.astype(np.int16).tobytes())
+
+
+def make_narration(path, minutes: float, frame_rate: int = 24000, block_seconds: int = 60):
+    rng = np.random.default_rng(0)
+    remaining = int(minutes * 60 * frame_rate)
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(frame_rate)
+        while remaining:
+            n = min(remaining, block_seconds * frame_rate)
+            f.writeframes(rng.normal(0, 3000, n).astype(np.int16).tobytes())
+            remaining -= n
+
+
+def make_music(path, seed: int, seconds: float = 30, frame_rate: int = 48000):
+    t = np.arange(int(seconds * frame_rate)) / frame_rate
+    base = 110 * (1 + seed % 5)
+    tone = sum(np.sin(2 * np.pi * base * k * t) / k for k in (1, 1.5, 2))
+    pcm = np.stack([tone, np.roll(tone, 100)], axis=1) * 6000
+    write_wav(path, pcm, frame_rate)
+
+
+def make_timeline(music_paths, minutes: float, chunks: int):
+    length = minutes * 60 / chunks
+    return [
+        {
+            "music_file_path": music_paths[i % len(music_paths)],
+            "chunk_start": i * length,
+            "chunk_end": (i + 1) * length - 0.25,
+        }
+        for i in range(chunks)
+    ]
+
+
+def _run_engine(engine, label, narration, timeline, output, results):
+    start = time.perf_counter()
+    orchestrate_audio(narration, timeline, output_path=output, engine=engine)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is reported in KiB on Linux
+    results[label] = (elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+
+def read_pcm(path):
+    fmt = read_wav_format(path)
+    return np.memmap(path, dtype=np.int16, mode="r", offset=wav_data_offset(path)).reshape(-1, fmt.channels)
+
+
+def _run_check(tmp, results):
+    results["failures"] = check_short_chunks(tmp)
+
+
+def check_short_chunks(tmp: str, fade_ms: int = 2000) -> list[str]:
+    """
+    Mixes one chunk shorter than fade_ms and one longer than two fades with
+    both engines and returns what went wrong. The long chunk must match the
+    pydub mix within 2 LSB. The short chunk must keep the narration's length,
+    stay within its own span, and fade from and back to silence.
+    """
+    narration = os.path.join(tmp, "short_narration.wav")
+    music = os.path.join(tmp, "short_music.wav")
+    # Narration already in the mix format's rate, so the music is out - narration
+    make_narration(narration, minutes=12 / 60, frame_rate=48000)
+    make_music(music, seed=0, seconds=5)
+    short = {"music_file_path": music, "chunk_start": 2.0, "chunk_end": 3.0}
+    long = {"music_file_path": music, "chunk_start": 5.0, "chunk_end": 11.0}
+    outputs = {}
+    for engine in ("numpy", "pydub"):
+        outputs[engine] = os.path.join(tmp, f"short_{engine}.wav")
+        orchestrate_audio(narration, [short, long], fade_duration=fade_ms,
+                          output_path=outputs[engine], engine=engine)
+
+    failures = []
+    voice = read_pcm(narration)[:, 0].astype(np.int32)
+    mixed, reference = read_pcm(outputs["numpy"]), read_pcm(outputs["pydub"])
+    if len(mixed) != len(voice):
+        failures.append(f"mix has {len(mixed)} frames, narration {len(voice)}")
+        return failures
+
+    rate = read_wav_format(outputs["numpy"]).frame_rate
+    span = lambda chunk: slice(int(chunk["chunk_start"] * rate), int(chunk["chunk_end"] * rate))
+    diff = int(np.abs(mixed[span(long)].astype(np.int32) - reference[span(long)]).max())
+    if diff > 2:
+        failures.append(f"long chunk differs from pydub by {diff} LSB")
+
+    added = np.abs(mixed[:, 0].astype(np.int32) - voice)
+    outside = np.ones(len(added), dtype=bool)
+    outside[span(short)] = outside[span(long)] = False
+    if added[outside].any():
+        failures.append("music outside the chunks' spans")
+    inside = added[span(short)]
+    edge = int(0.01 * rate)
+    if inside[:edge].max() > 0.02 * inside.max() or inside[-edge:].max() > 0.02 * inside.max():
+        failures.append("short chunk does not fade from and back to silence")
+    if not inside.any():
+        failures.append("short chunk is silent")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--minutes", type=float, default=60)
+    parser.add_argument("--chunks", type=int, default=20)
+    parser.add_argument("--engines", default="numpy,pydub")
+    parser.add_argument("--check-short-chunks", action="store_true")
+    args = parser.parse_args()
+
+    if args.check_short_chunks:
+        with tempfile.TemporaryDirectory() as tmp:
+            # In its own process, so the PCM cache it imports lives in tmp
+            os.environ["PCM_CACHE_DIR"] = os.path.join(tmp, "pcm")
+            ctx = multiprocessing.get_context("spawn")
+            results = ctx.Manager().dict()
+            proc = ctx.Process(target=_run_check, args=(tmp, results))
+            proc.start()
+            proc.join()
+            failures = results.get("failures", [f"check crashed with exit code {proc.exitcode}"])
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        print("short chunks: ok" if not failures else f"short chunks: {len(failures)} failures")
+        raise SystemExit(1 if failures else 0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Read by the spawned engine processes when they import the settings
+        os.environ["PCM_CACHE_DIR"] = os.path.join(tmp, "pcm")
+        narration = os.path.join(tmp, "narration.wav")
+        make_narration(narration, args.minutes)
+        music_paths = []
+        for i in range(3):
+            music_paths.append(os.path.join(tmp, f"music_{i}.wav"))
+            make_music(music_paths[-1], seed=i)
+        timeline = make_timeline(music_paths, args.minutes, args.chunks)
+
+        ctx = multiprocessing.get_context("spawn")
+        results = ctx.Manager().dict()
+        outputs = {}
+        runs = [(engine, engine) for engine in args.engines.split(",")]
+        if "numpy" in args.engines.split(","):
+            runs.append(("numpy", "numpy-warm"))
+        for engine, label in runs:
+            outputs[label] = os.path.join(tmp, f"mix_{label}.wav")
+            proc = ctx.Process(
+                target=_run_engine, args=(engine, label, narration, timeline, outputs[label], results)
+            )
+            proc.start()
+            proc.join()
+            if proc.exitcode != 0:
+                print(f"{label}: failed with exit code {proc.exitcode}")
+                continue
+            elapsed, peak_mb = results[label]
+            print(f"{label:>10}: {elapsed:8.2f} s  peak RSS {peak_mb:8.1f} MiB")
+
+        if "numpy" in results and "pydub" in results:
+            print(f"speedup: {results['pydub'][0] / results['numpy'][0]:.1f}x")
+            a, b = read_pcm(outputs["numpy"]), read_pcm(outputs["pydub"])
+            if a.shape != b.shape:
+                print(f"output shapes differ: {a.shape} vs {b.shape}")
+            else:
+                block = 1 << 20
+                diff = max(
+                    int(np.abs(a[i:i + block].astype(np.int32) - b[i:i + block]).max())
+                    for i in range(0, len(a), block)
+                )
+                print(f"max sample difference: {diff}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Offline benchmarks for every pipeline stage.
+
+Uses data/the_lottery.txt replicated N times and a local fake of LemonFox,
+Vertex AI and Anthropic (benchmarks.fake_providers), so nothing leaves the
+machine. Each case runs twice in a fresh process with its own empty caches,
+result store and jobs directory: once for wall time and peak RSS, once under
+tracemalloc for the peak Python and NumPy heap. e2e keeps the mix as WAV
+(AUDIO_FORMAT=wav), so it measures the pipeline rather than ffmpeg and runs
+without it.
+
+Stages:
+    rebuild         rebuild_annotated_text
+    merge           merge_timestamps_with_lines
+    sync            get_music_sync_timeline
+    mix             orchestrate_audio (numpy engine)
+    e2e             process_text_to_multimodal against the fake providers
+
+Audio stages (mix, e2e) default to smaller sizes: at --word-ms 300 the 10x
+narration is already close to three hours of audio.
+
+Usage (from backend/):
+    python -m benchmarks.bench_pipeline
+    python -m benchmarks.bench_pipeline --stages merge,sync --sizes 1,10,100
+    python -m benchmarks.bench_pipeline --stages e2e --audio-sizes 1 --word-ms 100
+"""
+import argparse
+import asyncio
+import contextlib
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.fake_providers import FakeProviders, provider_env
+
+TEXT_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "data", "the_lottery.txt")
+TEXT_STAGES = ("rebuild", "merge", "sync")
+AUDIO_STAGES = ("mix", "e2e")
+LINES_PER_CHUNK = 20
+
+
+def load_text(copies: int) -> str:
+    with open(TEXT_PATH, encoding="utf-8") as f:
+        text = f.read()
+    return "\n\n".join([text] * copies)
+
+
+def make_word_timestamps(text: str, word_ms: int) -> list[dict]:
+    # Same shape as the fake LemonFox timestamps
+    step = word_ms / 1000
+    return [
+        {"word": word, "start": round(i * step, 3), "end": round(i * step + step * 0.8, 3)}
+        for i, word in enumerate(text.split())
+    ]
+
+
+def make_chunks(line_count: int, music_paths: list[str]) -> list[dict]:
+    return [
+        {
+            "music_file_path": music_paths[i % len(music_paths)],
+            "start_line": start,
+            "end_line": min(start + LINES_PER_CHUNK, line_count) - 1,
+        }
+        for i, start in enumerate(range(0, line_count, LINES_PER_CHUNK))
+    ]
+
+
+def _prepare(stage: str, copies: int, word_ms: int, workdir: str):
+    """Builds the inputs for one case and returns a zero-argument callable to measure."""
+    from api.src.texts import lemon_fox
+    from api.src.texts.logic import process_text_to_multimodal
+    from api.src.texts.word_timeline import WordTimeline
+
+    text = load_text(copies)
+    if stage == "e2e":
+        return lambda: asyncio.run(process_text_to_multimodal(text, "offline", output_dir=workdir))
+
+    word_timestamps = make_word_timestamps(text, word_ms)
+    if stage == "rebuild":
+        return lambda: lemon_fox.rebuild_annotated_text(word_timestamps)
+
+    annotated_text, word_to_line = lemon_fox.rebuild_annotated_text(word_timestamps)
+    if stage == "merge":
+        return lambda: lemon_fox.merge_timestamps_with_lines(word_timestamps, annotated_text, word_to_line)
+
+    timeline = WordTimeline.build(word_timestamps, word_to_line)
+    if stage == "sync":
+        chunks = make_chunks(timeline.line_count, ["music.wav"])
+        return lambda: lemon_fox.get_music_sync_timeline(chunks, timeline)
+
+    from benchmarks.bench_mixer import make_music, make_narration
+
+    narration = os.path.join(workdir, "narration.wav")
+    make_narration(narration, minutes=float(timeline.end[-1]) / 60)
+    music_paths = []
+    for i in range(4):
+        music_paths.append(os.path.join(workdir, f"music_{i}.wav"))
+        make_music(music_paths[-1], seed=i)
+    sync = lemon_fox.get_music_sync_timeline(make_chunks(timeline.line_count, music_paths), timeline)
+    output = os.path.join(workdir, "orchestrated_output.wav")
+    return lambda: lemon_fox.orchestrate_audio(narration, sync, output_path=output, engine="numpy")
+
+
+def _run_case(stage, copies, word_ms, env, trace, results):
+    # Settings are read at import, so the environment is set before any api import.
+    # The pipeline's progress prints are silenced so they don't skew the timings
+    with tempfile.TemporaryDirectory() as workdir, open(os.devnull, "w") as devnull, \
+            contextlib.redirect_stdout(devnull):
+        os.environ.update(env)
+        for name in ("TTS_CACHE_DIR", "CHUNK_CACHE_DIR", "MUSIC_CACHE_DIR", "PCM_CACHE_DIR", "ENCODE_CACHE_DIR"):
+            os.environ[name] = os.path.join(workdir, "cache", name.lower())
+        os.environ["RESULTS_DB"] = os.path.join(workdir, "results.sqlite3")
+        os.environ["JOBS_DIR"] = os.path.join(workdir, "jobs")
+        os.environ["AUDIO_FORMAT"] = "wav"
+        run = _prepare(stage, copies, word_ms, workdir)
+
+        if trace:
+            tracemalloc.start()
+            run()
+            results["peak_heap"] = tracemalloc.get_traced_memory()[1] / 1024**2
+            tracemalloc.stop()
+            return
+
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+        run()
+        results["seconds"] = time.perf_counter() - start
+        # ru_maxrss is reported in KiB on Linux
+        results["peak_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        results["rss_growth"] = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024
+
+
+def measure(stage: str, copies: int, word_ms: int, env: dict) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    manager = ctx.Manager()
+    measured = {}
+    for trace in (False, True):
+        results = manager.dict()
+        proc = ctx.Process(target=_run_case, args=(stage, copies, word_ms, env, trace, results))
+        proc.start()
+        proc.join()
+        if proc.exitcode != 0:
+            raise RuntimeError(f"{stage} x{copies} failed with exit code {proc.exitcode}")
+        measured.update(results)
+    return measured
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stages", default=",".join(TEXT_STAGES + AUDIO_STAGES))
+    parser.add_argument("--sizes", default="1,10,100", help="copies of the text for rebuild/merge/sync")
+    parser.add_argument("--audio-sizes", default="1,10", help="copies of the text for mix/e2e")
+    parser.add_argument("--word-ms", type=int, default=300, help="spoken length of each word")
+    parser.add_argument("--music-seconds", type=float, default=30.0)
+    args = parser.parse_args()
+
+    stages = args.stages.split(",")
+    with FakeProviders(word_ms=args.word_ms, music_seconds=args.music_seconds,
+                       lines_per_chunk=LINES_PER_CHUNK) as server:
+        env = provider_env(server.url)
+        print(f"{'stage':<8} {'size':>5} {'time s':>9} {'peak RSS MiB':>13} {'RSS growth':>11} {'peak heap MiB':>14}")
+        for stage in stages:
+            sizes = args.audio_sizes if stage in AUDIO_STAGES else args.sizes
+            for copies in (int(n) for n in sizes.split(",")):
+                m = measure(stage, copies, args.word_ms, env)
+                print(
+                    f"{stage:<8} {f'{copies}x':>5} {m['seconds']:9.3f} {m['peak_rss']:13.1f}"
+                    f" {m['rss_growth']:11.1f} {m['peak_heap']:14.1f}",
+                    flush=True,
+                )
+        if "e2e" in stages:
+            calls = ", ".join(f"{name} {count}" for name, count in sorted(server.requests.items()))
+            print(f"fake provider calls: {calls}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Local stand-ins for the LemonFox, Vertex AI (Lyria) and Anthropic APIs.
+
+One threaded HTTP server answers all three with deterministic synthetic
+responses shaped like the real ones, so the pipeline can run end to end
+offline. Point the backend at it with provider_env(server.url).
+
+    with FakeProviders() as server:
+        os.environ.update(provider_env(server.url))
+        ...
+"""
+import base64
+import io
+import json
+import re
+import threading
+import wave
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+_LINE_NUMBER = re.compile(r"^\s*\[Line (\d+)\]", re.MULTILINE)
+
+
+def provider_env(url: str) -> dict[str, str]:
+    """Settings overrides that route every provider call to the fake server."""
+    return {
+        "LEMONFOX_API_URL": f"{url}/v1/audio/speech",
+        "VERTEX_API_BASE": url,
+        "ANTHROPIC_API_BASE": url,
+        "GOOGLE_ACCESS_TOKEN": "offline",
+        "ANTHROPIC_API_KEY": "offline",
+        "LEMONFOX_API_KEY": "offline",
+        # Keep litellm from fetching its model price list at import
+        "LITELLM_LOCAL_MODEL_COST_MAP": "True",
+    }
+
+
+def wav_bytes(pcm: np.ndarray, frame_rate: int) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(pcm.shape[1])
+        f.setsampwidth(2)
+        f.setframerate(frame_rate)
+        f.writeframes(pcm.astype(np.int16).tobytes())
+    return buffer.getvalue()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "FakeProviders"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.path.endswith("/audio/speech"):
+            provider, handler = "lemonfox", self.server.speech
+        elif self.path.endswith(":predict"):
+            provider, handler = "vertex", self.server.predict
+        elif self.path.endswith("/v1/messages"):
+            provider, handler = "anthropic", self.server.messages
+        else:
+            self.send_error(404)
+            return
+        if provider in self.server.failing:
+            self.server.requests[provider] += 1
+            self.send_error(503)
+            return
+
+        response = handler(body)
+        payload = json.dumps(response).encode("utf-8")
+        self.server.requests[provider] += 1
+        self.server.bytes_sent[provider] += len(payload)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class FakeProviders(ThreadingHTTPServer):
+    """
+    Args:
+        word_ms: Spoken length of every word in the fake narration.
+        music_seconds: Length of every fake Lyria clip (48 kHz stereo, like Lyria).
+        lines_per_chunk: Annotated lines per chunk in the fake Claude answer.
+
+    Providers named in ``failing`` (which can be changed while running)
+    answer 503 without doing any work, for exercising outages.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, word_ms: int = 300, music_seconds: float = 30.0, lines_per_chunk: int = 20):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.word_ms = word_ms
+        self.lines_per_chunk = lines_per_chunk
+        self.failing: set[str] = set()
+        self.requests: Counter = Counter()
+        self.bytes_sent: Counter = Counter()
+        self._music = base64.b64encode(self._make_music(music_seconds)).decode("ascii")
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+    @staticmethod
+    def _make_music(seconds: float, frame_rate: int = 48000) -> bytes:
+        t = np.arange(int(seconds * frame_rate)) / frame_rate
+        tone = np.sin(2 * np.pi * 220 * t) * 6000
+        return wav_bytes(np.stack([tone, np.roll(tone, 100)], axis=1), frame_rate)
+
+    def speech(self, body: dict) -> dict:
+        # LemonFox: 24 kHz mono WAV plus one timestamp per whitespace-separated word
+        frame_rate = 24000
+        words = body["input"].split()
+        step = self.word_ms / 1000
+        timestamps = [
+            {"word": word, "start": round(i * step, 3), "end": round(i * step + step * 0.8, 3)}
+            for i, word in enumerate(words)
+        ]
+        frames = int(len(words) * step * frame_rate)
+        pcm = (np.sin(np.arange(frames) * (2 * np.pi * 180 / frame_rate)) * 3000)[:, None]
+        return {
+            "audio": base64.b64encode(wav_bytes(pcm, frame_rate)).decode("ascii"),
+            "word_timestamps": timestamps,
+        }
+
+    def predict(self, body: dict) -> dict:
+        # Vertex AI Lyria: one base64 WAV per instance
+        return {"predictions": [{"bytesBase64Encoded": self._music} for _ in body["instances"]]}
+
+    def messages(self, body: dict) -> dict:
+        # Anthropic via litellm's JSON tool call: fixed-size chunks over the
+        # [Line N] numbers present in the request
+        text = "\n".join(
+            part if isinstance(part, str) else part.get("text", "")
+            for message in body["messages"]
+            for part in ([message["content"]] if isinstance(message["content"], str) else message["content"])
+        )
+        lines = [int(n) for n in _LINE_NUMBER.findall(text)]
+        chunks = []
+        if lines:
+            first, last = min(lines), max(lines)
+            for start in range(first, last + 1, self.lines_per_chunk):
+                mood = ("calm", "tense", "warm", "ominous")[(start // self.lines_per_chunk) % 4]
+                chunks.append({
+                    "starting_line_number": start,
+                    "ending_line_number": min(start + self.lines_per_chunk - 1, last),
+                    "music_instrumentation": "piano, strings",
+                    "music_genre": "cinematic",
+                    "music_mood": mood,
+                    "music_tempo": "slow",
+                    "music_prompt": f"A {mood} cinematic piece with piano and strings, slow tempo",
+                })
+
+        tool = (body.get("tools") or [{"name": "json_tool_call"}])[0]["name"]
+        return {
+            "id": "msg_offline",
+            "type": "message",
+            "role": "assistant",
+            "model": body["model"],
+            "stop_reason": "tool_use",
+            "stop_sequence": None,
+            "usage": {"input_tokens": len(text) // 4, "output_tokens": 50 * len(chunks)},
+            "content": [{"type": "tool_use", "id": "toolu_offline", "name": tool, "input": {"chunks": chunks}}],
+        }
@@ -36,6 +36,56 @@ interface WordTiming {
 	line: number;
 }
 
+// Parallel-array word timings with millisecond times and a line index:
+// line_offsets[n] is the index of the first word on line n or later
+interface CompactWordTimings {
+	count: number;
+	words: string[];
+	word_ids: number[];
+	start_ms: number[];
+	end_ms: number[];
+	line: number[];
+	line_offsets: number[];
+}
+
+interface DecodedWordTimings {
+	timings: WordTiming[];
+	lineOffsets: number[];
+}
+
+function decodeCompactWordTimings(
+	compact: CompactWordTimings,
+): DecodedWordTimings {
+	const timings: WordTiming[] = new Array(compact.count);
+	for (let i = 0; i < compact.count; i++) {
+		timings[i] = {
+			word: compact.words[compact.word_ids[i]],
+			start: compact.start_ms[i] / 1000,
+			end: compact.end_ms[i] / 1000,
+			line: compact.line[i],
+		};
+	}
+	return { timings, lineOffsets: compact.line_offsets };
+}
+
+// Index of the word being spoken at time t, or -1; binary search over the
+// (sorted) word start times
+function findWordIndexAt(wordTimings: WordTiming[], t: number): number {
+	let low = 0;
+	let high = wordTimings.length - 1;
+	let found = -1;
+	while (low <= high) {
+		const mid = (low + high) >> 1;
+		if (wordTimings[mid].start <= t) {
+			found = mid;
+			low = mid + 1;
+		} else {
+			high = mid - 1;
+		}
+	}
+	return found !== -1 && t <= wordTimings[found].end ? found : -1;
+}
+
 interface TextSegment {
 	content: string;
 	isWord: boolean;
@@ -45,6 +95,51 @@ interface TextSegment {
 	timing?: WordTiming;
 }
 
+// Streams a background processing job's server-sent events and resolves as
+// soon as the word timings are ready, so reading can start while the music
+// is still being generated and mixed. onDone is called when the job
+// finishes, with whether it fell back to simulated output
+function waitForWordTimings(
+	eventsUrl: string,
+	onDone?: (degraded: boolean) => void,
+): Promise<DecodedWordTimings> {
+	return new Promise((resolve, reject) => {
+		const source = new EventSource(eventsUrl);
+		let settled = false;
+
+		source.addEventListener("words", (event) => {
+			settled = true;
+			resolve(
+				decodeCompactWordTimings(
+					JSON.parse((event as MessageEvent).data),
+				),
+			);
+		});
+		source.addEventListener("music", (event) => {
+			console.debug("Music ready:", JSON.parse((event as MessageEvent).data));
+		});
+		source.addEventListener("done", (event) => {
+			source.close();
+			const { degraded } = JSON.parse((event as MessageEvent).data);
+			onDone?.(Boolean(degraded));
+			if (!settled) {
+				reject(new Error("Processing finished without word timings"));
+			}
+		});
+		source.addEventListener("error", (event) => {
+			// Named "error" events come from the job; plain ones from the
+			// connection, which EventSource retries unless it gave up
+			if (event instanceof MessageEvent) {
+				source.close();
+				const { error } = JSON.parse(event.data);
+				if (!settled) reject(new Error(error || "Processing failed"));
+			} else if (source.readyState === EventSource.CLOSED && !settled) {
+				reject(new Error("Lost connection to the processing job"));
+			}
+		});
+	});
+}
+
 // Memoized component for rendering individual text segments
 const TextSegment = React.memo(
 	({
@@ -146,6 +241,7 @@ TextContent.displayName = "TextContent";
 export default function StoryReader() {
 	const [isModalOpen, setIsModalOpen] = useState(false);
 	const [wordTimings, setWordTimings] = useState<WordTiming[]>([]);
+	const [lineOffsets, setLineOffsets] = useState<number[]>([]);
 	const [fileName, setFileName] = useState("");
 	const [isUploading, setIsUploading] = useState(false);
 
@@ -153,31 +249,41 @@ export default function StoryReader() {
 	const [currentTime, setCurrentTime] = useState(0);
 	const [isPlaying, setIsPlaying] = useState(false);
 	const [totalDuration, setTotalDuration] = useState(0);
+	// The mixed audio, once the job has produced it; until then playback
+	// is driven by a timer
+	const [audioUrl, setAudioUrl] = useState<string | null>(null);
 
 	const scrollAreaRef = useRef<HTMLDivElement>(null);
 	const textContainerRef = useRef<HTMLDivElement>(null);
 	const startTimeRef = useRef<number>(0);
 	const animationFrameRef = useRef<number | null>(null);
+	const audioRef = useRef<HTMLAudioElement>(null);
 
 	// Memoize the text structure from word timing data
 	const textStructure = useMemo(() => {
 		if (!wordTimings.length) return [];
 
-		// Group words by line number
-		const lineGroups: { [lineNumber: number]: WordTiming[] } = {};
-		wordTimings.forEach((wordTiming) => {
-			if (!lineGroups[wordTiming.line]) {
-				lineGroups[wordTiming.line] = [];
+		// Slice words into lines with the line index from the API; words the
+		// API could not place on a line trail after the last offset
+		const lines: { words: WordTiming[]; firstIndex: number }[] = [];
+		for (let line = 0; line + 1 < lineOffsets.length; line++) {
+			const first = lineOffsets[line];
+			const last = lineOffsets[line + 1];
+			if (first < last) {
+				lines.push({
+					words: wordTimings.slice(first, last),
+					firstIndex: first,
+				});
 			}
-			lineGroups[wordTiming.line].push(wordTiming);
-		});
-
-		// Convert to text structure with segments
-		const lines = Object.keys(lineGroups)
-			.sort((a, b) => parseInt(a) - parseInt(b))
-			.map((lineNumber) => lineGroups[parseInt(lineNumber)]);
+		}
+		const placed = lineOffsets.length
+			? lineOffsets[lineOffsets.length - 1]
+			: 0;
+		if (placed < wordTimings.length) {
+			lines.push({ words: wordTimings.slice(placed), firstIndex: placed });
+		}
 
-		return lines.map((lineWords, lineIndex) => {
+		return lines.map(({ words: lineWords, firstIndex }, lineIndex) => {
 			const segments: TextSegment[] = [];
 
 			lineWords.forEach((wordTiming, wordIndex) => {
@@ -185,7 +291,7 @@ export default function StoryReader() {
 				segments.push({
 					content: wordTiming.word,
 					isWord: true,
-					wordIndex: wordTimings.indexOf(wordTiming),
+					wordIndex: firstIndex + wordIndex,
 					lineIndex,
 					segmentIndex: segments.length,
 					timing: wordTiming,
@@ -205,21 +311,38 @@ export default function StoryReader() {
 
 			return segments;
 		});
-	}, [wordTimings]);
+	}, [wordTimings, lineOffsets]);
 
 	// Calculate total duration from word timings
 	useEffect(() => {
 		if (wordTimings.length > 0) {
-			const maxEndTime = Math.max(...wordTimings.map((w) => w.end));
+			let maxEndTime = 0;
+			for (const w of wordTimings) {
+				maxEndTime = Math.max(maxEndTime, w.end);
+			}
 			setTotalDuration(maxEndTime);
 		}
 	}, [wordTimings]);
 
 	// Animation loop for time-based highlighting
 	useEffect(() => {
+		const audio = audioUrl ? audioRef.current : null;
 		if (isPlaying) {
+			if (audio) {
+				// Only seek when the position moved (stop, restart); the
+				// browser fetches just the byte range it needs
+				if (Math.abs(audio.currentTime - currentTime) > 0.25) {
+					audio.currentTime = currentTime;
+				}
+				audio.play().catch((error) => {
+					console.error("Audio playback failed:", error);
+				});
+			}
+
 			const animate = () => {
-				const elapsed = (Date.now() - startTimeRef.current) / 1000;
+				const elapsed = audio
+					? audio.currentTime
+					: (Date.now() - startTimeRef.current) / 1000;
 				setCurrentTime(elapsed);
 
 				if (elapsed < totalDuration) {
@@ -233,6 +356,7 @@ export default function StoryReader() {
 			startTimeRef.current = Date.now() - currentTime * 1000;
 			animationFrameRef.current = requestAnimationFrame(animate);
 		} else {
+			audio?.pause();
 			if (animationFrameRef.current) {
 				cancelAnimationFrame(animationFrameRef.current);
 				animationFrameRef.current = null;
@@ -244,18 +368,15 @@ export default function StoryReader() {
 				cancelAnimationFrame(animationFrameRef.current);
 			}
 		};
-	}, [isPlaying, totalDuration]);
+	}, [isPlaying, totalDuration, audioUrl]);
 
 	// Auto-scroll to keep highlighted word in view
 	useEffect(() => {
 		if (isPlaying && textContainerRef.current && scrollAreaRef.current) {
 			// Find the currently highlighted word
-			const currentWord = wordTimings.find(
-				(w) => currentTime >= w.start && currentTime <= w.end,
-			);
+			const wordIndex = findWordIndexAt(wordTimings, currentTime);
 
-			if (currentWord) {
-				const wordIndex = wordTimings.indexOf(currentWord);
+			if (wordIndex !== -1) {
 				const highlightedElement =
 					textContainerRef.current.querySelector(
 						`[data-word-index="${wordIndex}"]`,
@@ -294,8 +415,11 @@ export default function StoryReader() {
 			const file = event.target.files?.[0];
 			if (!file) return;
 
-			if (file.type !== "text/plain") {
-				alert("Please upload a .txt file");
+			if (
+				file.type !== "text/plain" &&
+				file.type !== "application/pdf"
+			) {
+				alert("Please upload a .txt or .pdf file");
 				return;
 			}
 
@@ -308,6 +432,12 @@ export default function StoryReader() {
 				// Create FormData to send the file to the backend
 				const formData = new FormData();
 				formData.append("file", file);
+				// Opus is half the size of MP3 at the same quality, but not
+				// every browser plays Ogg
+				const canPlayOpus = new Audio().canPlayType(
+					'audio/ogg; codecs="opus"',
+				);
+				formData.append("audio_format", canPlayOpus ? "opus" : "mp3");
 
 				// Send the file to the backend API
 				const response = await fetch(`${API_URL}/texts`, {
@@ -321,17 +451,24 @@ export default function StoryReader() {
 					);
 				}
 
-				// Get the word timing data from the API response
-				const wordTimingData: WordTiming[] = await response.json();
+				// The upload is processed in the background; follow the job's
+				// events until the word timing data is ready
+				const { events_url: eventsUrl, audio_url: audioPath } =
+					await response.json();
+				const { timings: wordTimingData, lineOffsets: lineIndex } =
+					await waitForWordTimings(
+						`${API_URL}${eventsUrl}?format=compact`,
+						(degraded) => {
+							if (!degraded) setAudioUrl(`${API_URL}${audioPath}`);
+						},
+					);
 
-				if (
-					!Array.isArray(wordTimingData) ||
-					wordTimingData.length === 0
-				) {
+				if (wordTimingData.length === 0) {
 					throw new Error("No word timing data received from API");
 				}
 
 				setWordTimings(wordTimingData);
+				setLineOffsets(lineIndex);
 
 				// Simulate a brief delay for better UX
 				setTimeout(() => {
@@ -351,10 +488,12 @@ export default function StoryReader() {
 
 	const clearStory = useCallback(() => {
 		setWordTimings([]);
+		setLineOffsets([]);
 		setFileName("");
 		setCurrentTime(0);
 		setIsPlaying(false);
 		setTotalDuration(0);
+		setAudioUrl(null);
 	}, []);
 
 	const handlePlay = useCallback(() => {
@@ -409,6 +548,9 @@ export default function StoryReader() {
 				{/* Story Display */}
 				{wordTimings.length > 0 && (
 					<div className="relative">
+						{audioUrl && (
+							<audio ref={audioRef} src={audioUrl} preload="metadata" />
+						)}
 						{/* Controls */}
 						<div className="flex items-center justify-between mb-4">
 							<div className="flex items-center gap-2">
@@ -529,20 +671,20 @@ export default function StoryReader() {
 						<DialogHeader>
 							<DialogTitle>Upload Your Story</DialogTitle>
 							<DialogDescription>
-								Choose a .txt file containing your story to
-								display it with timed reading highlights.
+								Choose a .txt or .pdf file containing your story
+								to display it with timed reading highlights.
 							</DialogDescription>
 						</DialogHeader>
 
 						<div className="space-y-4">
 							<div className="space-y-2">
 								<Label htmlFor="story-file">
-									Story File (.txt)
+									Story File (.txt, .pdf)
 								</Label>
 								<Input
 									id="story-file"
 									type="file"
-									accept=".txt"
+									accept=".txt,.pdf"
 									onChange={handleFileUpload}
 									disabled={isUploading}
 									className="cursor-pointer"